@@ -12,6 +12,8 @@
 #include <gpib/ib.h>
 #endif
 
+#include "pythread.h"
+
 #include <errno.h>
 #include <lockdev.h>
 #include <unistd.h>
@@ -25,6 +27,86 @@
 static PyObject *GpibError;
 
 
+/* Threads.
+ *
+ * Calls that may wait on the bus are made with the interpreter lock
+ * released, so other Python threads run meanwhile. They hold a lock per
+ * device address (board and primary address) while they do, so threads
+ * sharing a device do not mix their transfers, even through different
+ * descriptors opened on it (such as a power supply and its DVM). Board
+ * descriptors, and devices whose address is unknown, have a lock of
+ * their own. Other threads may change the ibsta, iberr and ibcnt
+ * globals at any time, so the copies for this thread are used.
+ */
+
+#ifdef USE_INES
+#define THREAD_IBSTA() ibsta
+#define THREAD_IBERR() iberr
+#define THREAD_IBCNT() ((long) ibcnt)
+#else
+#define THREAD_IBSTA() ThreadIbsta()
+#define THREAD_IBERR() ThreadIberr()
+#define THREAD_IBCNT() ThreadIbcntl()
+#endif
+
+#define MAX_DESCRIPTORS 1024
+#define MAX_BOARDS 16
+#define MAX_PADS 31
+
+/* the address lock of each device descriptor, or NULL */
+static PyThread_type_lock descriptor_locks[MAX_DESCRIPTORS];
+/* locks of descriptors without an address lock */
+static PyThread_type_lock own_locks[MAX_DESCRIPTORS];
+static PyThread_type_lock address_locks[MAX_BOARDS][MAX_PADS];
+
+/* These must be called with the interpreter lock held, so that two
+ * threads don't make a lock at once. */
+static PyThread_type_lock _GetAddressLock(int board, int pad)
+{
+	if (board < 0 || board >= MAX_BOARDS || pad < 0 || pad >= MAX_PADS)
+		return NULL;
+	if (address_locks[board][pad] == NULL)
+		address_locks[board][pad] = PyThread_allocate_lock();
+	return address_locks[board][pad];
+}
+
+/* Record the device address of a new descriptor. A negative board
+ * means it has none. */
+static void _SetDescriptorAddress(int ud, int board, int pad)
+{
+	if (ud < 0 || ud >= MAX_DESCRIPTORS)
+		return;
+	if (board < 0)
+		descriptor_locks[ud] = NULL;
+	else
+		descriptor_locks[ud] = _GetAddressLock(board, pad);
+}
+
+static PyThread_type_lock _GetDescriptorLock(int ud)
+{
+	if (ud < 0 || ud >= MAX_DESCRIPTORS)
+		return NULL;
+	if (descriptor_locks[ud] != NULL)
+		return descriptor_locks[ud];
+	if (own_locks[ud] == NULL)
+		own_locks[ud] = PyThread_allocate_lock();
+	return own_locks[ud];
+}
+
+/* Bracket calls on descriptor ud. The code between may not use Python. */
+#define BEGIN_DEVICE_IO(ud) { \
+	PyThread_type_lock _devlock = _GetDescriptorLock(ud); \
+	Py_BEGIN_ALLOW_THREADS \
+	if (_devlock != NULL) \
+		PyThread_acquire_lock(_devlock, WAIT_LOCK);
+
+#define END_DEVICE_IO \
+	if (_devlock != NULL) \
+		PyThread_release_lock(_devlock); \
+	Py_END_ALLOW_THREADS \
+	}
+
+
 struct _iberr_string {
     int code;
     char *meaning;
@@ -55,11 +137,13 @@ void _SetGpibError(const char *funcname)
 	char *errstr;
 	struct _iberr_string entry;
 	int sverrno;
+	int err;
 
 	sverrno = errno;
 	errstr = (char *) PyMem_Malloc(4096);
 
-    if (iberr == EDVR || iberr == EFSO) {
+	err = THREAD_IBERR();
+    if (err == EDVR || err == EFSO) {
 		snprintf(errstr, 4096, "%s() error: (%d) %s", 
 				funcname, sverrno, strerror(sverrno));
     } 
@@ -67,7 +151,7 @@ void _SetGpibError(const char *funcname)
 		int i = 0;
 		while (1) {
 			entry = GPIB_errors[i];
-			if (entry.code == iberr || entry.meaning == NULL)
+			if (entry.code == err || entry.meaning == NULL)
 				break;
 			i++;
 		}
@@ -76,7 +160,7 @@ void _SetGpibError(const char *funcname)
 					funcname, entry.meaning);
 		else
 			snprintf(errstr, 4096, 
-					"%s() failed: unknown reason (iberr: %d).", funcname, iberr);
+					"%s() failed: unknown reason (iberr: %d).", funcname, err);
     }
 	PyErr_SetString(GpibError, errstr);
 	PyMem_Free(errstr);
@@ -98,20 +182,30 @@ static char gpib_find__doc__[] =
 ""
 ;
 
+
 static PyObject* gpib_find(PyObject *self, PyObject *args)
 {
     char *name;
 	int ud;
 	char lockname[LOCKNAME_SIZE];
 	pid_t owner;
+	int board;
+	int pad;
 
 	if (!PyArg_ParseTuple(args, "s", &name))
 		return NULL;
 
-	if((ud = ibfind(name)) & ERR){
+	Py_BEGIN_ALLOW_THREADS
+	ud = ibfind(name);
+	Py_END_ALLOW_THREADS
+	if(ud & ERR){
 		_SetGpibError("find");
 	    return NULL;
 	}
+	/* a board descriptor has no board index (IbaBNA) */
+	if ((ibask(ud, IbaBNA, &board) & ERR) || (ibask(ud, IbaPAD, &pad) & ERR))
+		board = -1;
+	_SetDescriptorAddress(ud, board, pad);
 
 	get_lockname(lockname, LOCKNAME_SIZE, ud);
 
@@ -145,12 +239,15 @@ static PyObject* gpib_ibdev(PyObject *self, PyObject *args)
 
 	if (!PyArg_ParseTuple(args, "ii|iiic", &board, &pad, &sad, &tmo, &eot, &eoc))
 		return NULL;
+	Py_BEGIN_ALLOW_THREADS
     ud = ibdev(board, pad, sad, tmo, eot, flags | eoc);
+	Py_END_ALLOW_THREADS
 // int ibdev(int boardID, int pad, int sad, int tmo, int eot, int eos);
     if (ud < 0) {
 		_SetGpibError("ibdev");
         return NULL;
     }
+	_SetDescriptorAddress(ud, board, pad);
 	return Py_BuildValue("i", ud);
 }
 
@@ -163,11 +260,15 @@ static PyObject* gpib_ibask(PyObject *self, PyObject *args)
 	int device;
 	int option;
 	int result;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "ii",&device, &option))
 		return NULL;
 
-    if (ibask(device, option, &result) & ERR) {
+	BEGIN_DEVICE_IO(device)
+	sta = ibask(device, option, &result);
+	END_DEVICE_IO
+    if (sta & ERR) {
 		_SetGpibError("ibask");
       return NULL;
     }
@@ -184,11 +285,15 @@ static PyObject* gpib_ibconfig(PyObject *self, PyObject *args)
     int device;
     int option;
     int setting;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "iii",&device, &option, &setting))
 		return NULL;
 
-    if (ibconfig(device, option, setting) & ERR) {
+	BEGIN_DEVICE_IO(device)
+	sta = ibconfig(device, option, setting);
+	END_DEVICE_IO
+    if (sta & ERR) {
 		_SetGpibError("ibconfig");
 	  return NULL;
     }
@@ -207,6 +312,8 @@ static PyObject* gpib_read(PyObject *self, PyObject *args)
 	char *result;
 	int device;
 	int len;
+	int sta;
+	long count;
 	PyObject *retval;
 
 	if (!PyArg_ParseTuple(args, "ii",&device,&len))
@@ -219,13 +326,17 @@ static PyObject* gpib_read(PyObject *self, PyObject *args)
 		return NULL;
 	}
 
-	if( ibrd(device,result,len) & ERR )
+	BEGIN_DEVICE_IO(device)
+	sta = ibrd(device, result, len);
+	count = THREAD_IBCNT();
+	END_DEVICE_IO
+	if( sta & ERR )
 	{
 		_SetGpibError("read");
 		PyMem_Free(result);
 		return NULL;
 	}
-	result[ibcnt] = '\0';
+	result[count] = '\0';
 
 	retval = Py_BuildValue("s", result);
 	PyMem_Free(result);
@@ -243,6 +354,8 @@ static PyObject* gpib_readbin(PyObject *self, PyObject *args)
 	PyObject *retval;
 	int device;
 	int len;
+	int sta;
+	long count;
 
 	if (!PyArg_ParseTuple(args, "ii",&device,&len))
 		return NULL;
@@ -253,23 +366,20 @@ static PyObject* gpib_readbin(PyObject *self, PyObject *args)
 		PyErr_SetString(GpibError, "Read Error: can't get Memory.");
 		return NULL;
 	}
-	if( ibrd(device, result, len) & ERR )
+	BEGIN_DEVICE_IO(device)
+	sta = ibrd(device, result, len);
+	if ((sta & ERR) && THREAD_IBERR() == EDVR && errno == EINTR)
+		sta = ibrd(device, result, len); /* try once more. */
+	count = THREAD_IBCNT();
+	END_DEVICE_IO
+	if( sta & ERR )
 	{
-		if (iberr == EDVR && errno == EINTR) { /* try once more. */
-			if( ibrd(device, result, len) & ERR )
-			{
-				_SetGpibError("readbin2");
-				PyMem_Free(result);
-				return NULL;
-			}
-		} else {
-			_SetGpibError("readbin");
-			PyMem_Free(result);
-			return NULL;
-		}
+		_SetGpibError("readbin");
+		PyMem_Free(result);
+		return NULL;
 	}
 
-	retval = PyString_FromStringAndSize(result, ibcnt);
+	retval = PyString_FromStringAndSize(result, count);
 	PyMem_Free(result);
 	return retval;
 }
@@ -287,6 +397,9 @@ static PyObject* gpib_fetch(PyObject *self, PyObject *args)
 	PyObject *retval;
 	int device;
 	int len;
+	int sta;
+	long count;
+	const char *failed = NULL;
 
 	if (!PyArg_ParseTuple(args, "iis#", &device, &len, &command, &command_len))
 		return NULL;
@@ -298,29 +411,28 @@ static PyObject* gpib_fetch(PyObject *self, PyObject *args)
 		return NULL;
 	}
 
-	if( ibwrt(device, command, command_len) & ERR ){
-		_SetGpibError("ask_wrt");
-		PyMem_Free(result);
-	    return NULL;
+	/* The write and read are one locked operation, so another thread's
+	 * query to the same device can't take this one's response. */
+	BEGIN_DEVICE_IO(device)
+	sta = ibwrt(device, command, command_len);
+	if (sta & ERR) {
+		failed = "ask_wrt";
+	} else {
+		sta = ibrd(device, result, len);
+		if ((sta & ERR) && THREAD_IBERR() == EDVR && errno == EINTR)
+			sta = ibrd(device, result, len); /* try once more. */
+		if (sta & ERR)
+			failed = "ask_rd";
 	}
-
-	if( ibrd(device, result, len) & ERR )
-	{
-    	if (iberr == EDVR && errno == EINTR) { /* try once more. */
-			if( ibrd(device, result, len) & ERR )
-			{
-				_SetGpibError("ask_rd2");
-				PyMem_Free(result);
-				return NULL;
-			}
-		} else {
-			_SetGpibError("ask_rd");
-			PyMem_Free(result);
-			return NULL;
-		}
+	count = THREAD_IBCNT();
+	END_DEVICE_IO
+	if (failed != NULL) {
+		_SetGpibError(failed);
+		PyMem_Free(result);
+		return NULL;
 	}
 
-	retval = PyString_FromStringAndSize(result, ibcnt);
+	retval = PyString_FromStringAndSize(result, count);
 	PyMem_Free(result);
 	return retval;
 }
@@ -336,10 +448,14 @@ static PyObject* gpib_write(PyObject *self, PyObject *args)
         char *command;
 		int command_len;
         int  device;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "is#",&device, &command, &command_len))
 		return NULL;
-	if( ibwrt(device, command, command_len) & ERR ){
+	BEGIN_DEVICE_IO(device)
+	sta = ibwrt(device, command, command_len);
+	END_DEVICE_IO
+	if( sta & ERR ){
 		_SetGpibError("write");
 	    return NULL;
 	}
@@ -358,10 +474,14 @@ static PyObject* gpib_writebin(PyObject *self, PyObject *args)
         int device;
         int length;
 	int cmdlength;
+	int sta;
 
         if (!PyArg_ParseTuple(args, "is#i",&device,&command,&cmdlength,&length))
                 return NULL;
-        if( ibwrt(device,command,length) & ERR ){
+	BEGIN_DEVICE_IO(device)
+	sta = ibwrt(device, command, length);
+	END_DEVICE_IO
+        if( sta & ERR ){
 		   _SetGpibError("writebin");
            return NULL;
         }
@@ -380,15 +500,19 @@ static PyObject* gpib_writea(PyObject *self, PyObject *args)
         char *command;
         int  command_len;
         int  device;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "is#", &device, &command, &command_len))
 		return NULL;
-	if( ibwrta(device, command, command_len) & ERR ){
+	BEGIN_DEVICE_IO(device)
+	sta = ibwrta(device, command, command_len);
+	END_DEVICE_IO
+	if( sta & ERR ){
 	  _SetGpibError("writea");
 	  return NULL;
 	}
 
-	return Py_BuildValue("i", ibsta);
+	return Py_BuildValue("i", sta);
 }
 
 
@@ -401,15 +525,19 @@ static PyObject* gpib_cmd(PyObject *self, PyObject *args)
         char *command;
         int  command_len;
         int  device;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "is#",&device, &command, &command_len))
 		return NULL;
-	if( ibcmd(device, command, command_len) & ERR ){
+	BEGIN_DEVICE_IO(device)
+	sta = ibcmd(device, command, command_len);
+	END_DEVICE_IO
+	if( sta & ERR ){
 	  _SetGpibError("cmd");
 	  return NULL;
 	}
 
-	return Py_BuildValue("i", ibsta);
+	return Py_BuildValue("i", sta);
 }
 
 static char gpib_ren__doc__[] =
@@ -420,16 +548,20 @@ static PyObject* gpib_ren(PyObject *self, PyObject *args)
 {
         int device;
         int val;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "ii",&device,&val))
 		return NULL;
 
-	if( ibsre(device,val) & ERR){
+	BEGIN_DEVICE_IO(device)
+	sta = ibsre(device, val);
+	END_DEVICE_IO
+	if( sta & ERR){
 	  _SetGpibError("ren");
 	  return NULL;
 	}
 
-	return Py_BuildValue("i", ibsta);
+	return Py_BuildValue("i", sta);
 }
 
 
@@ -440,11 +572,15 @@ static char gpib_clear__doc__[] =
 static PyObject* gpib_clear(PyObject *self, PyObject *args)
 {
         int device;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "i",&device))
 		return NULL;
 
-	if( ibclr(device) & ERR){
+	BEGIN_DEVICE_IO(device)
+	sta = ibclr(device);
+	END_DEVICE_IO
+	if( sta & ERR){
 	  _SetGpibError("clear");
 	  return NULL;
 	}
@@ -455,6 +591,32 @@ static PyObject* gpib_clear(PyObject *self, PyObject *args)
 }
 
 
+static char gpib_loc__doc__[] =
+"Put a device into local mode (GTL)."
+;
+
+static PyObject* gpib_loc(PyObject *self, PyObject *args)
+{
+        int device;
+	int sta;
+
+	if (!PyArg_ParseTuple(args, "i",&device))
+		return NULL;
+
+	BEGIN_DEVICE_IO(device)
+	sta = ibloc(device);
+	END_DEVICE_IO
+	if( sta & ERR){
+	  _SetGpibError("loc");
+	  return NULL;
+	}
+
+
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
+
 static char gpib_ifc__doc__[] =
 ""
 ;
@@ -466,7 +628,9 @@ static PyObject* gpib_ifc(PyObject *self, PyObject *args)
 	if (!PyArg_ParseTuple(args, "i",&device))
 		return NULL;
 
+	BEGIN_DEVICE_IO(device)
 	SendIFC(device);
+	END_DEVICE_IO
 
 	Py_INCREF(Py_None);
 	return Py_None;
@@ -480,6 +644,7 @@ static char gpib_close__doc__[] =
 static PyObject* gpib_close(PyObject *self, PyObject *args)
 {
     int device;
+	int sta;
 	char lockname[LOCKNAME_SIZE];
 
 	if (!PyArg_ParseTuple(args, "i",&device))
@@ -488,7 +653,11 @@ static PyObject* gpib_close(PyObject *self, PyObject *args)
 	get_lockname(lockname, LOCKNAME_SIZE, device);
     dev_unlock(lockname, getpid());
 
-	if( ibonl(device, 0) & ERR ){
+	BEGIN_DEVICE_IO(device)
+	sta = ibonl(device, 0);
+	END_DEVICE_IO
+	_SetDescriptorAddress(device, -1, 0); /* the number may be used again */
+	if( sta & ERR ){
 	  _SetGpibError("close");
 	  return NULL;
 	}
@@ -506,16 +675,20 @@ static PyObject* gpib_wait(PyObject *self, PyObject *args)
 {
         int device;
         int mask;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "ii",&device, &mask))
 		return NULL;
 
-	if(ibwait(device, mask) & ERR) {
+	BEGIN_DEVICE_IO(device)
+	sta = ibwait(device, mask);
+	END_DEVICE_IO
+	if(sta & ERR) {
 	  _SetGpibError("wait");
 	  return NULL;
 	}
 
-	return Py_BuildValue("i", ibsta);
+	return Py_BuildValue("i", sta);
 }
 
 static char gpib_tmo__doc__[] =
@@ -527,10 +700,14 @@ static PyObject* gpib_tmo(PyObject *self, PyObject *args)
 {
         int device;
         int value;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "ii",&device,&value))
 		return NULL;
-	if( ibtmo(device, value) & ERR){
+	BEGIN_DEVICE_IO(device)
+	sta = ibtmo(device, value);
+	END_DEVICE_IO
+	if( sta & ERR){
 	  _SetGpibError("tmo");
 	  return NULL;
 	}
@@ -545,12 +722,16 @@ static char gpib_rsp__doc__[] =
 static PyObject* gpib_rsp(PyObject *self, PyObject *args)
 {
         int device;
+	int sta;
 	char spr;
 
 	if (!PyArg_ParseTuple(args, "i",&device))
 		return NULL;
 
-	if( ibrsp(device, &spr) & ERR){
+	BEGIN_DEVICE_IO(device)
+	sta = ibrsp(device, &spr);
+	END_DEVICE_IO
+	if( sta & ERR){
 	  _SetGpibError("rsp");
 	  return NULL;
 	}
@@ -565,11 +746,15 @@ static char gpib_trg__doc__[] =
 static PyObject* gpib_trg(PyObject *self, PyObject *args)
 {
         int device;
+	int sta;
 
 	if (!PyArg_ParseTuple(args, "i",&device))
 		return NULL;
 
-	if( ibtrg(device) & ERR){
+	BEGIN_DEVICE_IO(device)
+	sta = ibtrg(device);
+	END_DEVICE_IO
+	if( sta & ERR){
 	  _SetGpibError("trg");
 	  return NULL;
 	}
@@ -579,7 +764,7 @@ static PyObject* gpib_trg(PyObject *self, PyObject *args)
 }
 
 static char gpib_ibsta__doc__[] =
-""
+"Status of the last call made by this thread."
 ;
 
 static PyObject* gpib_ibsta(PyObject *self, PyObject *args)
@@ -588,11 +773,11 @@ static PyObject* gpib_ibsta(PyObject *self, PyObject *args)
 	if (!PyArg_ParseTuple(args, ""))
 		return NULL;
 
-	return Py_BuildValue("i",ibsta);
+	return Py_BuildValue("i", THREAD_IBSTA());
 }
 
 static char gpib_ibcnt__doc__[] =
-""
+"Byte count of the last call made by this thread."
 ;
 
 static PyObject* gpib_ibcnt(PyObject *self, PyObject *args)
@@ -601,7 +786,7 @@ static PyObject* gpib_ibcnt(PyObject *self, PyObject *args)
 	if (!PyArg_ParseTuple(args, ""))
 		return NULL;
 
-	return Py_BuildValue("i",ibcnt);
+	return Py_BuildValue("l", THREAD_IBCNT());
 }
 
 /* List of methods defined in the module */
@@ -620,6 +805,7 @@ static struct PyMethodDef gpib_methods[] = {
  {"cmd",	gpib_cmd,	1,	gpib_cmd__doc__},
  {"ren",	gpib_ren,	1,	gpib_ren__doc__},
  {"clear",	gpib_clear,	1,	gpib_clear__doc__},
+ {"loc",	gpib_loc,	1,	gpib_loc__doc__},
  {"ifc",	gpib_ifc,	1,	gpib_ifc__doc__},
  {"close",	gpib_close,	1,	gpib_close__doc__},
  {"wait",	gpib_wait,	1,	gpib_wait__doc__},
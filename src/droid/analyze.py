@@ -12,6 +12,7 @@ readings related to batteries.
 
 import os
 import re
+import time
 import itertools
 
 import numpy
@@ -20,8 +21,16 @@ from pycopia import timespec
 from pycopia import aid
 from pycopia import dictlib
 
+from droid import ingest
+from droid import parsecache
+from droid import decimate
+from droid import histogram
+from droid import rangeindex
+from droid import resultcache
 from droid.reports import flatfile
-from droid.storage import datafile
+from droid.reports import columnar
+from droid.storage import catalog
+from droid.util import workers as workerpool
 from droid.physics import physical_quantities
 
 # abbreviation
@@ -59,6 +68,10 @@ PLOT_COLORS = [
 
 color_cycler = itertools.cycle(PLOT_COLORS)
 
+# rows per chunk for streaming data sets.
+CHUNKROWS = 65536
+TEXTROWSIZE = 64 # approximate bytes per row in text files
+
 # break up column name and measurement unit.
 HEADER_RE = re.compile(r'(\w+)\W*\((\w+)\)')
 
@@ -174,7 +187,18 @@ class DataSet(object):
   source is a data (.dat) file, use dataset parameter if source is another
   dataset object, use array and headers if source is an array object and
   associated headers with labels an units. 
+
+  Time slices (GetTimeSlice, GetTimeSlices, and a DataSet made from
+  another with a timespec) are views of the same data, found with a
+  sorted time index that is built once and shared by the slices. Data that
+  is shared is copied before it is changed in place (by NormalizeTime), so
+  changes to one never show in another.
   """
+  _timeindex = None
+  _indexed = None # the array the time index was built from
+  _shared = False # measurements may be seen by another DataSet, or caller
+  _rangeindexes = (None, None) # (array indexed, {column: RangeIndex})
+
   def __init__(self, filename=None, timespec=None, dataset=None,
         array=None, headers=None):
     if filename is not None:
@@ -212,17 +236,15 @@ class DataSet(object):
       of the measurement data.
     """
     if self._mean is None:
-      self.Transpose()
       unit = self.units[1]
-      timecol = self.measurements[0]
-      col1 = self.measurements[1]
+      timecol = self.measurements[:, 0]
+      col1 = self.measurements[:, 1]
       self.sampleperiod = PQ(timecol[1] - timecol[0], self.units[0])
       self._mean = PQ(numpy.mean(col1), unit)
       self._maximum = PQ(numpy.amax(col1), unit)
       self._minimum = PQ(numpy.amin(col1), unit)
       self._median  = PQ(numpy.median(col1), unit)
       self._crestfactor  = float(self._maximum / self._mean)
-      self.Transpose()
     return (self._mean, self._maximum, self._minimum, self._median, 
         self._crestfactor)
 
@@ -242,7 +264,7 @@ class DataSet(object):
     "Data offset %s after sampling started and spans %s." % (ts, offset, span)]
     s.append(str(self.metadata))
     s.append("")
-    s.append("%s %s samples:" % (len(self.measurements), self.sampleperiod))
+    s.append("%s %s samples:" % (len(self), self.sampleperiod))
     s.append(" Maximum: %s" % maxi)
     s.append(" Minimum: %s" % mini)
     s.append("    Mean: %s" % mean)
@@ -253,48 +275,119 @@ class DataSet(object):
   def FromFile(self, filename, timespec=None):
     headers, measurements = ReadArray(filename)
     self.FromArray(measurements, headers, timespec)
-    self.metadata = datafile.DecodeFullPathName(filename)
+    self.metadata = catalog.GetMetadata(filename)
+    self._shared = False # nobody else has the array
 
   def FromArray(self, measurements, headers, timespec=None):
     self.metadata = None
     self._mean = None
     self.samplestart = measurements[0][0]
+    self.measurements = measurements
+    self._shared = True # the caller still has it
     if timespec:
       timemarks = TimeMarksGenerator(timespec)
-      self.measurements = TimeSlice(measurements,
-          timemarks.next(),
+      starti, endi = self.GetTimeIndex().Find(timemarks.next(),
           timemarks.next())
-    else:
-      self.measurements = measurements
+      self._SetView(self.measurements[starti:endi],
+          self._timeindex.Slice(starti, endi))
     self.starttime = self.measurements[0][0]
     self.endtime = self.measurements[-1][0]
-    labels = []
-    units = []
-    for h in headers:
-      match = HEADER_RE.search(h)
-      if match:
-        labels.append(match.group(1))
-        units.append(match.group(2))
-      else:
-        raise ValueError("Not a properly formated data header")
-    self.labels = labels
-    self.units = units
+    self.labels, self.units = SplitHeaders(headers)
 
   def FromDataSet(self, dataset, timespec=None):
+    index = dataset.GetTimeIndex()
     if timespec:
       timemarks = TimeMarksGenerator(timespec)
-      self.measurements = TimeSlice(dataset.measurements,
-          timemarks.next(),
-          timemarks.next())
+      starti, endi = index.Find(timemarks.next(), timemarks.next())
     else:
-      self.measurements = dataset.measurements.copy()
+      starti, endi = 0, len(dataset.measurements)
+    self._SetView(dataset.measurements[starti:endi], index.Slice(starti, endi))
+    dataset._shared = True
     self.labels = dataset.labels[:]
     self.units = dataset.units[:]
     self.metadata = dataset.metadata.copy()
+    self.samplestart = dataset.samplestart
+    self.starttime = self.measurements[0][0]
+    self.endtime = self.measurements[-1][0]
     self._mean = None
 
+  def GetTimeIndex(self):
+    """Get the time index of the measurements, building it if needed."""
+    if self._timeindex is None or self._indexed is not self.measurements:
+      self._timeindex = TimeIndex(self.measurements[:, 0])
+      self._indexed = self.measurements
+    return self._timeindex
+
+  def GetRangeIndex(self, column=1):
+    """Get the rangeindex.RangeIndex of a column, building it if needed.
+
+    Window statistics (see GetWindowStats) then cost O(log n).
+    """
+    indexed, indexes = self._rangeindexes
+    if indexed is not self.measurements:
+      indexes = {}
+      self._rangeindexes = (self.measurements, indexes)
+    try:
+      return indexes[column]
+    except KeyError:
+      index = indexes[column] = rangeindex.RangeIndex(
+          self.GetTimeIndex().times, self.measurements[:, column])
+      return index
+
+  def GetWindowStats(self, start, end, column=1):
+    """Count, mean, RMS, minimum, maximum and charge of a column over a
+    window of time, relative to the start (as GetTimeSlice).
+
+    Returns:
+      AttrDict of values in the column's unit (charge in unit*s).
+    """
+    return self.GetRangeIndex(column).GetWindowStats(start, end)
+
+  def _SetView(self, measurements, timeindex):
+    self.measurements = measurements
+    self._timeindex = timeindex
+    self._indexed = measurements
+    self._shared = True
+
+  def _MakeView(self, starti, endi):
+    """Make a DataSet that is a view of a range of rows of this one."""
+    ds = DataSet()
+    ds._SetView(self.measurements[starti:endi],
+        self.GetTimeIndex().Slice(starti, endi))
+    self._shared = True
+    ds.units = self.units
+    ds.labels = self.labels
+    ds.metadata = self.metadata
+    ds.samplestart = self.samplestart
+    if endi > starti:
+      ds.starttime = ds.measurements[0][0]
+      ds.endtime = ds.measurements[-1][0]
+    return ds
+
+  def _Own(self):
+    """Copy the measurements if they are shared (copy-on-write)."""
+    if self._shared:
+      old = self.measurements
+      self.measurements = old.copy()
+      # same values, so the indexes are still good.
+      self._indexed = self.measurements
+      if self._rangeindexes[0] is old:
+        self._rangeindexes = (self.measurements, self._rangeindexes[1])
+      self._shared = False
+
   def NormalizeTime(self, start=None, offset=None):
-    self.measurements = NormalizeTime(self.measurements, start, offset)
+    """Make the time stamps relative to the start time, in place.
+
+    The time index is relative to the first time stamp, so it is not
+    affected.
+    """
+    self._Own()
+    times = self.measurements[:, 0]
+    if start is None:
+      start = times[0]
+    times -= start
+    if offset is not None:
+      times += offset
 
   def Transpose(self):
     self.measurements = self.measurements.transpose()
@@ -330,15 +423,17 @@ class DataSet(object):
     return datacolumns[0], datacols, labels
 
   def GetTimeSlice(self, timespec):
+    """Get a view of the rows in a span of time, relative to the start."""
     if type(timespec) is str:
       timemarks = TimeMarksGenerator(timespec)
-      return TimeSlice(self.measurements, 
-          timemarks.next(),
-          timemarks.next())
+      start, end = timemarks.next(), timemarks.next()
     elif type(timespec) in (list, tuple):
-      return TimeSlice(self.measurements, timespec[0], timespec[1])
+      start, end = timespec[0], timespec[1]
     else:
       raise ValueError("Need timespec string or 2-tuple of (start, end) time.")
+    starti, endi = self.GetTimeIndex().Find(start, end)
+    self._shared = True
+    return self.measurements[starti:endi]
 
   def GetTimeSlices(self, timespec):
     """Iterator generator to iterate over sections of time.
@@ -348,22 +443,381 @@ class DataSet(object):
       get 5 minute chunks at a time.
     """
     timemarks = iter(TimeMarksGenerator(timespec))
+    index = self.GetTimeIndex()
     start = timemarks.next()
     for end in timemarks:
-      subset = TimeSlice(self.measurements, start, end)
-      ds = DataSet()
-      ds.measurements = subset
-      ds.units = self.units
-      ds.labels = self.labels
-      ds.metadata = self.metadata
-      yield ds, start, end
+      starti, endi = index.Find(start, end)
+      yield self._MakeView(starti, endi), start, end
+      start = end
+
+
+class TimeIndex(object):
+  """A sorted, contiguous copy of the time stamps of a data set.
+
+  Lookups are binary searches, with no copying. Slices of the index are
+  views, so data sets that are slices of another share its index.
+  """
+  def __init__(self, times):
+    self.times = numpy.ascontiguousarray(times, numpy.float64)
+    if self.times is times:
+      self.times = times.copy() # do not follow in place changes.
+
+  def __len__(self):
+    return len(self.times)
+
+  def Find(self, start, end):
+    """Find the rows from start to end time, in seconds, relative to the
+    first time stamp (as TimeSlice does).
+
+    Returns:
+      tuple of (start row, end row), for slicing.
+    """
+    times = self.times
+    if not len(times):
+      return 0, 0
+    beginning = times[0]
+    return (int(times.searchsorted(beginning + start)),
+        int(times.searchsorted(beginning + end)))
+
+  def Slice(self, starti, endi):
+    index = TimeIndex.__new__(TimeIndex)
+    index.times = self.times[starti:endi]
+    return index
+
+
+def SplitHeaders(headers):
+  """Split column headers into lists of labels and units."""
+  labels = []
+  units = []
+  for h in headers:
+    match = HEADER_RE.search(h)
+    if match:
+      labels.append(match.group(1))
+      units.append(match.group(2))
+    else:
+      raise ValueError("Not a properly formated data header")
+  return labels, units
+
+
+class StreamingDataSet(DataSet):
+  """A DataSet that reads its data file a chunk at a time, when needed.
+
+  Use this for captures that are larger than memory. At most a chunk of
+  rows, or one time slice from GetTimeSlices, is held in memory. Each
+  operation makes one or more passes over the file, so repeated
+  operations cost more than with a resident DataSet.
+
+  The measurements attribute is always None. GetColumns loads only the
+  selected columns.
+  """
+  def __init__(self, filename, timespec=None, chunkrows=CHUNKROWS):
+    self.filename = filename
+    self.chunkrows = chunkrows
+    self.measurements = None
+    headers, chunks = ReadArrayChunks(filename, chunkrows)
+    self._ncols = len(headers)
+    self.labels, self.units = SplitHeaders(headers)
+    self.metadata = catalog.GetMetadata(filename)
+    if timespec:
+      timemarks = TimeMarksGenerator(timespec)
+      self._window = (timemarks.next(), timemarks.next())
+    else:
+      self._window = None
+    self._timeoffset = 0.0
+    self._mean = None
+    self._count = None
+    self._Scan()
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, idx):
+    raise TypeError("StreamingDataSet does not support indexing.")
+
+  def __iter__(self):
+    for chunk in self.IterChunks():
+      for row in chunk:
+        yield row
+
+  def IterChunks(self):
+    """Iterate over arrays of rows, a chunk at a time.
+
+    The time window given by the timespec, and any time normalization,
+    are applied.
+    """
+    headers, chunks = ReadArrayChunks(self.filename, self.chunkrows)
+    begin = None
+    for chunk in chunks:
+      if begin is None:
+        begin = chunk[0][0]
+      if self._window is not None:
+        times = chunk[:,0]
+        lo = times.searchsorted(begin + self._window[0])
+        hi = times.searchsorted(begin + self._window[1])
+        chunk = chunk[lo:hi]
+      if len(chunk):
+        if self._timeoffset:
+          chunk[:,0] += self._timeoffset
+        yield chunk
+      if self._window is not None and hi < len(times):
+        break
+
+  def _Scan(self):
+    """Pass over the data to get times, count, and the sums and extremes
+    needed for the statistics.
+    """
+    count = 0
+    total = 0.0
+    maxima = []
+    minima = []
+    finite = 0
+    finitemax = []
+    finitemin = []
+    self.samplestart = self.starttime = self.endtime = 0.0
+    self.sampleperiod = PQ(0.0, self.units[0])
+    for chunk in self.IterChunks():
+      if count == 0:
+        self.starttime = chunk[0][0]
+        if len(chunk) > 1:
+          self.sampleperiod = PQ(chunk[1][0] - chunk[0][0], self.units[0])
+      self.endtime = chunk[-1][0]
+      col1 = chunk[:,1]
+      count += len(chunk)
+      total += numpy.sum(col1)
+      maxima.append(numpy.amax(col1))
+      minima.append(numpy.amin(col1))
+      good = col1[numpy.isfinite(col1)]
+      if len(good):
+        finite += len(good)
+        finitemax.append(numpy.amax(good))
+        finitemin.append(numpy.amin(good))
+    headers, chunks = ReadArrayChunks(self.filename, self.chunkrows)
+    for chunk in chunks:
+      self.samplestart = chunk[0][0]
+      break
+    self._count = count
+    self._sum = total
+    self._maxima = maxima
+    self._minima = minima
+    self._finite = finite
+    if finite:
+      self._finiterange = (min(finitemin), max(finitemax))
+    else:
+      self._finiterange = None
+
+  def GetStats(self):
+    """Common statistics.
+
+    The median is exact, and is taken over the finite values only. It is
+    found by narrowing histograms, which takes a few passes over the file,
+    unless the statistics of the whole file are cached in its catalog.
+
+    Returns:
+      mean, maximum, minimum, median, crestfactor
+      of the measurement data.
+    """
+    if self._mean is None and self._window is None:
+      stats = catalog.GetCachedStats(self.metadata)
+      if stats is not None:
+        unit = self.units[1]
+        mean, maximum, minimum, median, self._crestfactor = stats
+        self._mean = PQ(mean, unit)
+        self._maximum = PQ(maximum, unit)
+        self._minimum = PQ(minimum, unit)
+        self._median = PQ(median, unit)
+    if self._mean is None:
+      unit = self.units[1]
+      self._mean = PQ(self._sum / self._count, unit)
+      self._maximum = PQ(numpy.amax(self._maxima), unit)
+      self._minimum = PQ(numpy.amin(self._minima), unit)
+      self._median = PQ(self._Median(), unit)
+      self._crestfactor  = float(self._maximum / self._mean)
+    return (self._mean, self._maximum, self._minimum, self._median, 
+        self._crestfactor)
+
+  def _Median(self):
+    n = self._finite
+    if not n:
+      return numpy.nan
+    lo, hi = self._finiterange
+    if lo == hi:
+      return lo
+    k1 = (n - 1) // 2
+    k2 = n // 2
+    v1 = self._SelectRank(k1, lo, hi)
+    if k2 == k1:
+      return v1
+    return (v1 + self._SelectRank(k2, lo, hi)) / 2.0
+
+  def _SelectRank(self, rank, lo, hi, bins=4096, maxdepth=8):
+    """Find the value of the given rank (in sorted order) of the finite
+    values in column one, holding no more than a chunk of values.
+    """
+    below = 0 # number of values less than lo
+    edges = numpy.linspace(lo, hi, bins + 1)
+    edges[-1] = numpy.inf # first level includes the maximum
+    for depth in range(maxdepth):
+      counts = numpy.zeros(bins, numpy.int64)
+      for col in self._IterFinite():
+        idx = edges.searchsorted(col, side="right") - 1
+        idx = idx[(idx >= 0) & (idx < bins)]
+        bc = numpy.bincount(idx)
+        counts[:len(bc)] += bc
+      cum = numpy.cumsum(counts)
+      b = cum.searchsorted(rank - below, side="right")
+      if b:
+        below += cum[b - 1]
+      if counts[b] <= self.chunkrows or depth == maxdepth - 1:
+        break
+      upper = edges[b + 1]
+      edges = numpy.linspace(edges[b], min(upper, hi), bins + 1)
+      edges[-1] = upper
+    if counts[b] > self.chunkrows: # all nearly the same value
+      return edges[b]
+    blo, bhi = edges[b], edges[b + 1]
+    values = []
+    for col in self._IterFinite():
+      values.append(col[(col >= blo) & (col < bhi)])
+    values = numpy.concatenate(values)
+    values.sort()
+    return values[rank - below]
+
+  def _IterFinite(self):
+    for chunk in self.IterChunks():
+      col1 = chunk[:,1]
+      yield col1[numpy.isfinite(col1)]
+
+  def NormalizeTime(self, start=None, offset=None):
+    if start is None:
+      start = self.starttime + self._timeoffset
+    self._timeoffset -= start
+    if offset is not None:
+      self._timeoffset += offset
+
+  def Transpose(self):
+    raise TypeError("StreamingDataSet can not be transposed.")
+
+  def GetColumns(self, columns):
+    """Returns a tuple of a list of selected columns, and a list of column
+    names (without unit).
+
+    Only the time column and the selected columns are loaded.
+    """
+    if columns is None:
+      columns = range(1, self._ncols)
+    elif type(columns) not in (tuple, list):
+      columns = [int(columns)]
+    times = []
+    datacols = [[] for n in columns]
+    for chunk in self.IterChunks():
+      times.append(chunk[:,0].copy())
+      for n, col in zip(columns, datacols):
+        col.append(chunk[:,n].copy())
+    labels = [self.labels[n] for n in columns]
+    return (_Concatenate(times), 
+        [_Concatenate(col) for col in datacols], labels)
+
+  def GetTimeSlice(self, timespec):
+    if type(timespec) is str:
+      timemarks = TimeMarksGenerator(timespec)
+      start, end = timemarks.next(), timemarks.next()
+    elif type(timespec) in (list, tuple):
+      start, end = timespec[0], timespec[1]
+    else:
+      raise ValueError("Need timespec string or 2-tuple of (start, end) time.")
+    for subset, start, end in self.GetTimeSlices((start, end)):
+      return subset.measurements
+
+  def GetTimeSlices(self, timespec):
+    """Iterator generator to iterate over sections of time.
+
+    Only the current slice is held in memory.
+
+    Args:
+      timespec (string): a time span specification, such as "0s,5m,..." to
+      get 5 minute chunks at a time. May also be a sequence of times.
+    """
+    if type(timespec) is str:
+      timemarks = iter(TimeMarksGenerator(timespec))
+    else:
+      timemarks = iter(timespec)
+    try:
+      start = timemarks.next()
+      end = timemarks.next()
+    except StopIteration:
+      return
+    pending = []
+    begin = None
+    for chunk in self.IterChunks():
+      if begin is None:
+        begin = chunk[0][0]
+      times = chunk[:,0] - begin
+      while 1:
+        lo = times.searchsorted(start)
+        hi = times.searchsorted(end)
+        if hi > lo:
+          pending.append(chunk[lo:hi])
+        if hi == len(times):
+          break
+        yield self._MakeSlice(pending), start, end
+        pending = []
+        start = end
+        try:
+          end = timemarks.next()
+        except StopIteration:
+          return
+    while 1:
+      yield self._MakeSlice(pending), start, end
+      pending = []
       start = end
+      try:
+        end = timemarks.next()
+      except StopIteration:
+        return
+
+  def _MakeSlice(self, rows):
+    ds = DataSet()
+    if rows:
+      ds.measurements = numpy.concatenate(rows)
+    else:
+      ds.measurements = numpy.zeros((0, self._ncols), numpy.float64)
+    ds.units = self.units
+    ds.labels = self.labels
+    ds.metadata = self.metadata
+    return ds
+
+
+def _Concatenate(arrays):
+  if arrays:
+    return numpy.concatenate(arrays)
+  return numpy.zeros((0,), numpy.float64)
+
+
+def ReadArrayChunks(filename, chunkrows=CHUNKROWS):
+  """Reads an array from a file, a chunk of rows at a time.
+
+  Chunks of text files are approximately chunkrows long. 
+
+  Returns:
+    tuple of (header list, iterator of arrays organized in rows).
+  """
+  unused_, filetype = os.path.splitext(filename)
+  if filetype == ".pdc":
+    header, a = columnar.MapArray(filename)
+    return header, _IterMappedChunks(a, chunkrows)
+  elif filetype in ingest.FILETYPES:
+    return ingest.ReadTextChunks(filename, chunkrows * TEXTROWSIZE)
+  else:
+    raise ValueError(
+      "ReadArrayChunks: Invalid file type. need .txt, .csv, .dat, or .pdc "
+      "(got %r)." % filetype)
+
 
+def _IterMappedChunks(a, chunkrows):
+  for i in xrange(0, len(a), chunkrows):
+    # Copied, so that private copy-on-write pages do not accumulate.
+    yield numpy.array(columnar.ToFloatArray(a[i:i + chunkrows]))
 
-def _ReadCSV(fileobj):
-  for line in fileobj:
-    for el in line.split(","):
-      yield float(el)
 
 def ReadArray(filename):
   """Reads an array from a file.
@@ -372,35 +826,25 @@ def ReadArray(filename):
   format. 
   The file could have been produced by an object from the
   droid.reports.flatfile module (hint, hint).
+
+  Binary columnar (.pdc) files are memory mapped, not read. Special SCPI
+  values were already converted when they were written.
+
+  Text files are parsed once; later reads of the unchanged file map the
+  parsed array from the parsecache module's cache.
   """
   unused_, filetype = os.path.splitext(filename)
-  fo = open(filename, "rU")
-  try:
-    if filetype == ".txt":
-      header = map(eval, fo.readline().split("\t"))
-      a = numpy.fromfile(fo, dtype="f8", sep="\n\t")
-    elif filetype == ".csv":
-      header = map(str.strip, fo.readline().split(","))
-      a = numpy.fromiter(_ReadCSV(fo), numpy.float64)
-    elif filetype == ".dat": # gnuplot style data
-      line1 = fo.readline()[2:].split("\t")
-      try:
-        header = map(eval, line1)
-      except (ValueError, SyntaxError): # assume no header line
-        header = line1
-        fo.seek(0)
-      a = numpy.fromfile(fo, dtype="f8", sep="\n")
-    else:
-      raise ValueError(
-        "ReadArray: Invalid file type. need .txt, .csv, or .dat (got %r)." % 
-        filetype)
-  finally:
-    fo.close()
-  # Data may have SCPI NAN or INF values in it. Convert to numpy
-  # equivalents.
-  a = numpy.fromiter(itertools.imap(ValueCheck, a), numpy.float64)
-  a.shape = (-1, len(header))
-  return header, a
+  if filetype == ".pdc":
+    header, a = columnar.MapArray(filename)
+    return header, columnar.ToFloatArray(a)
+  elif filetype in ingest.FILETYPES:
+    # Data may have SCPI NAN or INF values in it. These are converted to
+    # numpy equivalents.
+    return parsecache.GetCache().Read(filename, ingest.ReadTextArray)
+  else:
+    raise ValueError(
+      "ReadArray: Invalid file type. need .txt, .csv, .dat, or .pdc "
+      "(got %r)." % filetype)
 
 
 def MakeTimePlot(dataset, ylim=None, columns=None, autoscale=False):
@@ -422,8 +866,10 @@ def MakeTimePlot(dataset, ylim=None, columns=None, autoscale=False):
     _SetYLimit(ax, ylim, unit)
   ax.set_xlabel("Time (s)")
   ax.set_ylabel(unit)
+  pixels = GetPixelWidth(fig)
   for col, label, color in itertools.izip(datacols,  labels, color_cycler):
-    ax.plot(x_time, col, color=color, label=label, ls=ls, marker=mrk)
+    PlotTrace(ax, x_time, col, color, label, ls, mrk,
+        decimate.Envelope(x_time, col, pixels))
   #label = "%s-%s" % (colname, metadata.GetStateString(*legenddata))
   title = "%s-%s-%s" % (metadata.testcase, 
       metadata.timestamp.strftime("%m%d%H%M%S"),
@@ -434,66 +880,173 @@ def MakeTimePlot(dataset, ylim=None, columns=None, autoscale=False):
   return fig
 
 
+def GetPixelWidth(fig):
+  """Width of a figure, in pixels."""
+  return int(fig.get_figwidth() * fig.dpi)
+
+
+def PlotTrace(ax, times, values, color, label, ls, mrk, envelope=None):
+  """Plot one trace on the axes.
+
+  If an envelope (from the decimate module) is given, plot that as
+  vertical min/max lines instead of the individual samples.
+  """
+  if envelope is None:
+    ax.plot(times, values, color=color, label=label, ls=ls, marker=mrk)
+  else:
+    e_times, e_mins, e_maxs = envelope
+    ax.vlines(e_times, e_mins, e_maxs, color=color, label=label)
+
+
+def GetPyramid(filename, measurements=None):
+  """Get the level of detail Pyramid for a data file.
+
+  The pyramid is loaded from its sidecar file, if that is up to date.
+  Otherwise it is built and saved. It is built from the measurements, the
+  array of the whole file, if given, else by reading the file in chunks.
+  """
+  sidecar = filename + decimate.SIDECAR_EXTENSION
+  try:
+    if os.path.getmtime(sidecar) >= os.path.getmtime(filename):
+      return decimate.LoadPyramid(sidecar)
+  except (OSError, IOError):
+    pass
+  if measurements is None:
+    headers, chunks = ReadArrayChunks(filename)
+  else:
+    chunks = [measurements]
+  pyramid = decimate.BuildPyramid(chunks)
+  try:
+    pyramid.Save(sidecar)
+  except (OSError, IOError):
+    pass # read-only data directory, just don't cache it.
+  return pyramid
+
+
 def MakeCharts(dataset, timemarks="0s,9d", ylim=None, columns=None,
-      autoscale=False, events=None, interactive=False):
-  # import pylab here since this is a very large library that you might
-  # not want loaded and initialized everytime you use this module. Also,
-  # if you are using one of the GTK based backends for matplotlib, and you
-  # do not have DISPLAY set (e.g. running from a remote shell), then you
-  # will see this exception raised when you import this module:
-  # RuntimeError: could not open display
-  # This is not in my, or matplotlib's, control.
-  import pylab
-  from matplotlib.font_manager import FontProperties
-  pylab.ioff()
+      autoscale=False, events=None, interactive=False, pyramid=None,
+      workers=1):
+  """Plot a chart for each span of time.
+
+  Traces with more samples than the chart is wide are drawn as min/max
+  envelopes, taken from the pyramid (built from the dataset's file) if
+  given. Interactive charts are not decimated.
+
+  Each chart is drawn on its own Agg figure. With more than one worker,
+  the charts are rendered by that many forked worker processes at once,
+  while this one reads the next slices. The files are the same either way.
+  """
   names = []
   if type(events) is DataSet:
-    events.NormalizeTime(dataset.measurements[0][0])
-  dataset.NormalizeTime()
+    events.NormalizeTime(dataset.starttime)
+  if interactive or dataset.measurements is None:
+    # Free for a StreamingDataSet, and interactive charts select on the
+    # data set in chart time.
+    dataset.NormalizeTime()
+    origin = 0.0
+  else:
+    # Only the time column of each slice is offset, so an array shared
+    # with other reports is not copied.
+    origin = dataset.measurements[0][0]
   unit = dataset.unit
+  if columns is None:
+    colnums = range(1, len(dataset.labels))
+  elif type(columns) in (tuple, list):
+    colnums = columns
+  else:
+    colnums = [int(columns)]
+  if interactive:
+    workers = 1
+  pool = workerpool.Pool(workers)
 
   for subset, start, end in dataset.GetTimeSlices(timemarks):
     if len(subset) > 0:
       x_time, datacols, labels = subset.GetColumns(columns)
-      if len(x_time) < 100:
-        mrk = "."
-        ls = "-"
-      else:
-        mrk = ","
-        ls = "None"
-      for col, label, color in itertools.izip(datacols,  labels, color_cycler):
-        pylab.plot(x_time, col, color=color, label=label, ls=ls, marker=mrk)
-      pylab.setp(pylab.gcf(), dpi=100, size_inches=(9,6))
-      pylab.xlabel("Time (s)")
-      if not autoscale:
-        _SetYLimit(pylab.gca(), ylim, unit)
-      pylab.ylabel(unit)
-
-      if events is not None:
-        ax = pylab.gca()
-        for row in events:
-          ax.axvline(row[0], color="rgbymc"[int(row[1]) % 6])
-
+      if origin:
+        x_time = x_time - origin
+      # colors are taken here, so they do not depend on the worker.
+      colors = [color_cycler.next() for col in datacols]
       metadata = subset.metadata
       title = "%s-%s-%s-%ss-%ss" % (metadata.testcase, 
           metadata.timestamp.strftime("%m%d%H%M%S"),
           "-".join(labels),
           int(start), 
           int(end))
-      pylab.title(title, fontsize="x-small")
-      font = FontProperties(size="x-small")
-      pylab.legend(prop=font)
-
-      if not interactive:
+      if interactive:
+        # import pylab here since this is a very large library that you
+        # might not want loaded and initialized everytime you use this
+        # module. Also, if you are using one of the GTK based backends for
+        # matplotlib, and you do not have DISPLAY set (e.g. running from a
+        # remote shell), then you will see this exception raised when you
+        # import this module:
+        # RuntimeError: could not open display
+        # This is not in my, or matplotlib's, control.
+        import pylab
+        pylab.ioff()
+        fig = pylab.gcf()
+        fig.set_dpi(100)
+        fig.set_size_inches(9, 6)
+        _DrawChart(fig, title, x_time, datacols, colnums, labels, colors,
+            unit, ylim, autoscale, events, None, dataset.starttime, False)
+      else:
         fname = "%s.%s" % (title, "png")
-        pylab.savefig(fname, format="png")
+        pool.Submit(_RenderChart, fname, title, x_time, datacols, colnums,
+            labels, colors, unit, ylim, autoscale, events, pyramid,
+            dataset.starttime)
         names.append(fname)
-        pylab.cla()
     else:
       break
+  pool.Wait()
   return names
 
 
+def _RenderChart(fname, *args):
+  from matplotlib import figure
+  from matplotlib.backends import backend_agg
+  fig = figure.Figure(figsize=(9, 6), dpi=100)
+  backend_agg.FigureCanvasAgg(fig)
+  _DrawChart(fig, *args)
+  fig.savefig(fname, format="png")
+
+
+def _DrawChart(fig, title, x_time, datacols, colnums, labels, colors, unit,
+      ylim, autoscale, events, pyramid, starttime, decimated=True):
+  """Draw one time domain chart on the figure."""
+  from matplotlib.font_manager import FontProperties
+  if len(x_time) < 100:
+    mrk = "."
+    ls = "-"
+  else:
+    mrk = ","
+    ls = "None"
+  ax = fig.gca()
+  pixels = GetPixelWidth(fig)
+  for col, colnum, label, color in itertools.izip(datacols, colnums,
+        labels, colors):
+    if not decimated: # keep every sample, for zooming in.
+      envelope = None
+    elif pyramid is not None:
+      envelope = pyramid.GetEnvelope(starttime + x_time[0],
+          starttime + x_time[-1], pixels, colnum)
+      if envelope is not None:
+        envelope = (envelope[0] - starttime,) + envelope[1:]
+    else:
+      envelope = decimate.Envelope(x_time, col, pixels)
+    PlotTrace(ax, x_time, col, color, label, ls, mrk, envelope)
+  ax.set_xlabel("Time (s)")
+  if not autoscale:
+    _SetYLimit(ax, ylim, unit)
+  ax.set_ylabel(unit)
+
+  if events is not None:
+    for row in events:
+      ax.axvline(row[0], color="rgbymc"[int(row[1]) % 6])
+
+  ax.set_title(title, fontsize="x-small")
+  font = FontProperties(size="x-small")
+  ax.legend(prop=font)
+
+
 def _GetColumns(datacolumns, header, columns):
   if columns is not None: # should be tuple of column numbers, or int.
     datacols = []
@@ -512,72 +1065,146 @@ def _GetColumns(datacolumns, header, columns):
   return datacols, [HEADER_RE.search(h).group(1) for h in headers]
 
 
-def CCDFChart(filename, timemarks=None, ylim=None, interactive=False):
-  pass
+def GetHistograms(filename, bins="D", columns=None, timemarks=None,
+      data=None):
+  """Get fixed-edge histograms of columns of a data file.
+
+  Without timemarks, the histogram of each whole column is loaded from its
+  sidecar file, if that is up to date. The missing ones are all computed
+  in one pass, reading the data file in chunks, and saved.
+
+  Args:
+    bins: a histogram.GetEdges bin scheme.
+    columns (list of int, optional): column numbers. Default is all data
+    columns.
+    timemarks (string, optional): time span (the first two marks) to take
+    the histograms of.
+    data (tuple, optional): (header, array) already read from the file,
+    used instead of reading it again.
+
+  Returns:
+    tuple of (header list, list of histogram.Histogram, one per column).
+  """
+  name, edges = histogram.GetEdges(bins)
+  if data is None:
+    header, chunks = ReadArrayChunks(filename)
+  else:
+    header, measurements = data
+    chunks = [measurements]
+  columns = _GetColumnNumbers(header, columns)
+  hists = [histogram.Histogram(edges, name) for n in columns]
+  if timemarks:
+    if data is None:
+      header, measurements = ReadArray(filename)
+    timemarks = TimeMarksGenerator(timemarks)
+    measurements = TimeSlice(measurements, timemarks.next(),
+        timemarks.next())
+    for hist, n in zip(hists, columns):
+      hist.Add(measurements[:, n])
+    return header, hists
+  mtime = os.path.getmtime(filename)
+  missing = []
+  for i, n in enumerate(columns):
+    sidecar = histogram.GetSidecarName(filename, name, n)
+    try:
+      if os.path.getmtime(sidecar) >= mtime:
+        hists[i] = histogram.LoadHistogram(sidecar)
+        continue
+    except (OSError, IOError):
+      pass
+    missing.append(i)
+  if missing:
+    for chunk in chunks:
+      for i in missing:
+        hists[i].Add(chunk[:, columns[i]])
+    for i in missing:
+      try:
+        hists[i].Save(histogram.GetSidecarName(filename, name, columns[i]))
+      except (OSError, IOError):
+        pass # read-only data directory, just don't cache it.
+  return header, hists
+
+
+def _GetColumnNumbers(header, columns):
+  if columns is None:
+    return range(1, len(header))
+  if type(columns) in (tuple, list):
+    return list(columns)
+  return [int(columns)]
+
+
+def _CollectHistograms(filenames, bins, columns, timemarks, legenddata,
+      merge, loaded=None):
+  """Get the histograms of files, for plotting.
+
+  Args:
+    loaded (dict, optional): maps file names to (header, array) already
+    read from them.
+
+  Returns:
+    tuple of (first file's metadata, unit, list of (label, histogram)).
+  """
+  first = None
+  unit = None
+  rv = []
+  merged = None
+  for filename in filenames:
+    metadata = catalog.GetMetadata(filename)
+    if loaded:
+      data = loaded.get(filename)
+    else:
+      data = None
+    header, hists = GetHistograms(filename, bins, columns, timemarks, data)
+    if first is None:
+      first = metadata
+      unit = HEADER_RE.search(header[1]).group(2)
+      names = [HEADER_RE.search(header[n]).group(1) for n in
+          _GetColumnNumbers(header, columns)]
+    if merge:
+      if merged is None:
+        merged = [hist.Copy() for hist in hists]
+      else:
+        for total, hist in zip(merged, hists):
+          total.Merge(hist)
+    else:
+      for colname, hist in zip(names, hists):
+        rv.append(("%s-%s" % (colname, metadata.GetStateString(*legenddata)),
+            hist))
+  if merged is not None:
+    for colname, hist in zip(names, merged):
+      rv.append(("%s-%d files" % (colname, len(filenames)), hist))
+  return first, unit, rv
 
 
 def PlotHistogram(filenames, timemarks=None, columns=None, bins=2000, 
-      interactive=False, legenddata=(), autoscale=False):
+      interactive=False, legenddata=(), autoscale=False, merge=False,
+      loaded=None):
+  """Plot histograms of data files.
+
+  Args:
+    bins: a histogram.GetEdges bin scheme.
+    merge (bool): plot one histogram, per column, of all the files
+    together, rather than one per file.
+    loaded (dict, optional): maps file names to (header, array) already
+    read from them.
+  """
   import pylab
   from matplotlib.font_manager import FontProperties
   if not interactive:
     pylab.ioff()
-  try:
-    bins = int(bins)
-    brange = (-0.05, 2.5)
-    binname = str(bins)
-  except ValueError:
-    binname = bins.upper()
-    if binname.startswith("D"): # detailed
-      bins = (list(aid.frange(0.0, 0.05, 0.0005)) + 
-              list(aid.frange(0.05, 1.0, 0.001)) + 
-              list(aid.frange(1.0, 2.6, 0.002))
-              )
-      brange = (-0.05, 2.5)
-    elif binname.startswith("M"): # medium detail
-      bins = (list(aid.frange(0.0, 0.05, 0.0005)) + 
-              list(aid.frange(0.05, 1.1, 0.001))
-              )
-      brange = (-0.05, 1.0)
-    elif binname.startswith("Z"): # zoom at lower end
-      bins = (list(aid.frange(0.0, 0.05, 0.0005)) + 
-              list(aid.frange(0.05, 0.51, 0.001))
-              )
-      brange = (-0.05, 0.5)
-    elif binname.startswith("S"): # super zoom at lower end
-      bins = (list(aid.frange(0.0, 0.05, 0.0005)) + 
-              list(aid.frange(0.05, 0.16, 0.001))
-              )
-      brange = (-0.05, 0.15)
-  ts = None
-  unit = None
-  for filename in filenames:
-    metadata = datafile.DecodeFullPathName(filename)
-    if ts is None:
-      ts = metadata.timestamp.strftime("%m%d%H%M%S")
-    header, measurements = ReadArray(filename)
-    if unit is None:
-      unit = HEADER_RE.search(header[1]).group(2)
-    measurements = NormalizeTime(measurements)
-    if timemarks:
-      timemarks = TimeMarksGenerator(timemarks)
-      measurements = TimeSlice(measurements, 
-          timemarks.next(),
-          timemarks.next())
-    datacolumns = measurements.transpose()
-    datacols, headers = _GetColumns(datacolumns, header, columns)
-    for col, colname, color in itertools.izip(datacols, headers, color_cycler):
-      label = "%s-%s" % (colname, metadata.GetStateString(*legenddata))
-      hist, edges = numpy.histogram(col, bins, brange, False)
-      pylab.plot(edges, hist, color=color, label=label) # plot it
+  metadata, unit, hists = _CollectHistograms(filenames, bins, columns,
+      timemarks, legenddata, merge, loaded)
+  for (label, hist), color in itertools.izip(hists, color_cycler):
+    pylab.plot(hist.edges[:-1], hist.counts, color=color, label=label)
 
   pylab.axis(xmin=-0.005, ymin=-100)
   pylab.setp(pylab.gcf(), dpi=100, size_inches=(9,6))
-  title = "histogram-%s-%s" % (ts, "bins%s" % binname)
+  title = "histogram-%s-%s" % (metadata.timestamp.strftime("%m%d%H%M%S"),
+      "bins%s" % hists[0][1].name)
   pylab.title(title, fontsize="x-small")
   if unit is not None:
     pylab.xlabel(unit)
-  if legenddata:
+  if legenddata or merge:
     font = FontProperties(size="x-small")
     pylab.legend(prop=font)
   if interactive:
@@ -590,6 +1217,45 @@ def PlotHistogram(filenames, timemarks=None, columns=None, bins=2000,
   return fname
 
 
+def CCDFChart(filenames, timemarks=None, ylim=None, interactive=False,
+      bins="D", columns=None, legenddata=(), merge=False, loaded=None):
+  """Plot the complementary cumulative distribution (the fraction of
+  samples at or above each value) of data files.
+
+  The distributions are taken from the files' histograms, so charts of
+  many files are cheap once their histograms are cached. Arrays already
+  read may be given in loaded, as for PlotHistogram.
+  """
+  import pylab
+  from matplotlib.font_manager import FontProperties
+  if not interactive:
+    pylab.ioff()
+  metadata, unit, hists = _CollectHistograms(filenames, bins, columns,
+      timemarks, legenddata, merge, loaded)
+  for (label, hist), color in itertools.izip(hists, color_cycler):
+    edges, ccdf = hist.GetCCDF()
+    pylab.semilogy(edges, ccdf, color=color, label=label)
+  if ylim is not None:
+    pylab.ylim(*ylim)
+  pylab.setp(pylab.gcf(), dpi=100, size_inches=(9,6))
+  title = "ccdf-%s-%s" % (metadata.timestamp.strftime("%m%d%H%M%S"),
+      "bins%s" % hists[0][1].name)
+  pylab.title(title, fontsize="x-small")
+  if unit is not None:
+    pylab.xlabel(unit)
+  pylab.ylabel("Fraction at or above")
+  font = FontProperties(size="x-small")
+  pylab.legend(prop=font)
+  if interactive:
+    pylab.show()
+    fname = None
+  else:
+    fname = "%s.%s" % (title, "png")
+    pylab.savefig(fname, format="png")
+    pylab.cla()
+  return fname
+
+
 def _SetYLimit(ax, ylim, unit):
   if ylim is None:
     if unit == "V":
@@ -613,17 +1279,18 @@ def TwoSetPlot(ds1, ds2, ylim1=None, ylim2=None, autoscale=False, interactive=Fa
   ax1 = pylab.subplot(111)
   x_time1, datacols1, labels1 = ds1.GetColumns(1)
   x_time2, datacols2, labels2 = ds2.GetColumns(1)
+  pixels = GetPixelWidth(pylab.gcf())
   if not autoscale:
     _SetYLimit(ax1, ylim1, ds1.unit)
-  pylab.plot(x_time1, datacols1[0], 
-      color=color_cycler.next(), label=labels1[0], ls="None", marker=",")
+  PlotTrace(ax1, x_time1, datacols1[0], color_cycler.next(), labels1[0],
+      "None", ",", decimate.Envelope(x_time1, datacols1[0], pixels))
   pylab.xlabel("Time (s)")
   pylab.ylabel(ds1.unit)
   ax2 = pylab.twinx()
   if not autoscale:
     _SetYLimit(ax2, ylim2, ds2.unit)
-  pylab.plot(x_time2, datacols2[0], 
-      color=color_cycler.next(), label=labels2[0], ls="None", marker=",")
+  PlotTrace(ax2, x_time2, datacols2[0], color_cycler.next(), labels2[0],
+      "None", ",", decimate.Envelope(x_time2, datacols2[0], pixels))
   pylab.ylabel(ds2.unit)
   ax2.yaxis.tick_right()
   pylab.legend(prop=font)
@@ -827,29 +1494,104 @@ def MultiBuildBatteryBarChart(report_list, interactive=False, autoscale=False,
     return fname
 
 
+def RollupSegments(times, span):
+  """Find the rows where each span of time starts.
+
+  Spans are measured from the first time stamp, and spans with no rows
+  in them are skipped.
+
+  Args:
+    times (array): sorted time stamps, in seconds.
+    span (float): length of each span, in seconds.
+
+  Returns:
+    array of the starting row index of each span.
+  """
+  if len(times) == 0:
+    return numpy.zeros((0,), numpy.intp)
+  spanidx = numpy.floor((times - times[0]) / span)
+  return numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(spanidx)) + 1))
+
+
+def RollupArray(measurements, span, column=1):
+  """Roll up a column of measurements into spans of time.
+
+  Uses segmented (reduceat) reductions, so there is one pass over the data
+  for each statistic, no matter how many spans.
+
+  Args:
+    measurements (array): array organized in rows, time stamps in the
+    first column.
+    span (float): length of each span, in seconds.
+    column (int): column to roll up.
+
+  Returns:
+    An array organized in rows, with columns: the last time stamp in the
+    span, mean, minimum, maximum, median, and crest factor.
+  """
+  times = measurements[:,0]
+  values = measurements[:,column]
+  starts = RollupSegments(times, span)
+  table = numpy.empty((len(starts), 6), numpy.float64)
+  if len(starts) == 0:
+    return table
+  counts = numpy.diff(numpy.concatenate((starts, [len(values)])))
+  table[:,0] = times[starts + counts - 1]
+  table[:,1] = numpy.add.reduceat(values, starts) / counts
+  table[:,2] = numpy.minimum.reduceat(values, starts)
+  table[:,3] = numpy.maximum.reduceat(values, starts)
+  # Sort values within each span, then pick the middle ones.
+  spanids = numpy.repeat(numpy.arange(len(starts)), counts)
+  ordered = values[numpy.lexsort((values, spanids))]
+  table[:,4] = (ordered[starts + (counts - 1) // 2] + 
+      ordered[starts + counts // 2]) / 2.0
+  olderr = numpy.seterr(divide="ignore", invalid="ignore")
+  try:
+    table[:,5] = table[:,3] / table[:,1]
+  finally:
+    numpy.seterr(**olderr)
+  return table
+
+
+# Default spans for DoRollupTable.
+ROLLUP_SPANS = ("1s", "1minute", "15minute", "1hour")
+
+
 def RollupTable(filename, timespan="1minute"):
-  timemarks = TimeMarksGenerator("0s,%s,..." % timespan)
-  newfilename = "%s-%s.dat" % (os.path.splitext(filename)[0], timespan)
-  header, arr = ReadArray(filename)
-  header = header[:2] # timestamp and average value
+  """Create one rolled up data file. Returns the new file name."""
+  return RollupTables(filename, [timespan])[0]
 
-  ctx = dictlib.AttrDict()
-  ctx.datafilename = newfilename
-  report = flatfile.GnuplotReport(ctx)
-  report.Initialize()
-  report.SetColumns(*header)
-
-  start = timemarks.next()
-  for end in timemarks:
-    minute = TimeSlice(arr, start, end)
-    if len(minute) > 0:
-      minutecolumns = minute.transpose()
-      report.WriteRecord(minutecolumns[0][-1], numpy.average(minutecolumns[1]))
-      start = end
-    else:
-      break
-  report.Finalize()
-  return newfilename
+
+def RollupTables(filename, timespans=ROLLUP_SPANS, column=1, data=None):
+  """Create rolled up data files, one for each time span.
+
+  The source file is read once (not at all if its header and array are
+  given as data). Each rolled up file is named after the source file with
+  the time span appended.
+
+  Returns:
+    list of new file names.
+  """
+  if data is None:
+    header, arr = ReadArray(filename)
+  else:
+    header, arr = data
+  unit = SplitHeaders(header)[1][column]
+  newheader = [header[0], header[column], "Minimum (%s)" % unit,
+      "Maximum (%s)" % unit, "Median (%s)" % unit, "CrestFactor (1)"]
+  names = []
+  for timespan in timespans:
+    span = timespec.parse_timespan(timespan)
+    newfilename = "%s-%s.dat" % (os.path.splitext(filename)[0], timespan)
+    ctx = dictlib.AttrDict()
+    ctx.datafilename = newfilename
+    report = flatfile.GnuplotReport(ctx)
+    report.Initialize()
+    report.SetColumns(*newheader)
+    report.WriteArray(RollupArray(arr, span, column))
+    report.Finalize()
+    names.append(newfilename)
+  return names
 
 
 class TimeSpan(object):
@@ -885,9 +1627,62 @@ class TimeSpan(object):
     return PQ(self._seconds, "s")
 
 
+def CumulativeCharge(times, currents):
+  """Integrate current over time with the trapezoid rule.
+
+  Args:
+    times (array): time stamps, in seconds.
+    currents (array): current values, in A, at those times.
+
+  Returns:
+    An array, the same length as times, of the charge (in C) that flowed
+    from the first time to each time.
+  """
+  charge = numpy.zeros(len(times), numpy.float64)
+  if len(times) > 1:
+    numpy.cumsum((currents[1:] + currents[:-1]) * 0.5 * numpy.diff(times),
+        out=charge[1:])
+  return charge
+
+
+def FindChargeCrossing(cumulative, charge):
+  """Find the first index where the cumulative charge reaches a value.
+
+  The cumulative charge does not have to be monotonic (current may flow
+  either way), the first crossing is found.
+
+  Returns:
+    index, or None if the value is never reached.
+  """
+  if len(cumulative) == 0:
+    return None
+  runmax = numpy.maximum.accumulate(cumulative)
+  index = runmax.searchsorted(charge)
+  if index < len(runmax):
+    return int(index)
+  return None
+
+
+def _CheckNaN(times, values, end, strict):
+  """Count the NaN values that took part in a computation.
+
+  Returns the count of NaN values up to and including the end index. If
+  strict, raise ValueError at the first of them instead.
+  """
+  nans = numpy.flatnonzero(numpy.isnan(values[:end + 1]))
+  if len(nans) and strict:
+    nexttime = PQ(times[nans[0]], "s")
+    raise ValueError( "NaN value in data: at time %s (offset %s)." % (
+        nexttime, nexttime - PQ(times[0], "s")))
+  return len(nans)
+
+
 def BatteryLifeByCurrent(measurements, unit="A", battery="DREA160", strict=True):
   """Remove charge from the battery using the measured discrete time intervals.
 
+  The charge is integrated over the whole array at once (trapezoid rule),
+  and the point where the battery capacity is used up is searched for.
+
   Args:
     measurements (array): An array with timestamps in the first column,
     and average current measurement in the second column. The array should
@@ -900,70 +1695,48 @@ def BatteryLifeByCurrent(measurements, unit="A", battery="DREA160", strict=True)
     A BatteryLifeReport containing the time span and remaining battery
     charge.
   """
-  charge = BATTERIES[battery][0].inUnitsOf("C")
-  charge_consumed = PQ(0.0, "C")
-  zeroC = PQ(0.0, "C")
-  measurements_iter = iter(measurements)
-  firstrow  = measurements_iter.next()
-  starttime = timeval = PQ(firstrow[0], "s")
-  errcount = 0 
-
-  for row in measurements_iter:
-    nexttime = PQ(row[0], "s")
-    rawvalue = row[1] # Column 1 is averaged samples from instrument.
-    if numpy.isnan(rawvalue):
-      if strict:
-        raise ValueError( "NaN value in data: at time %s (offset %s)." % (
-            nexttime, nexttime - starttime))
-      else:
-        # some overflow happened, so pick some arbitrary high value.
-        rawvalue = 1.5 
-        errcount += 1
-    measurement = PQ(rawvalue, unit)
-    delta_t = nexttime - timeval
-    charge_interval = measurement * delta_t
-    charge -= charge_interval
-    charge_consumed += charge_interval
-    timeval = nexttime
-    if charge <= zeroC:
-      break
-  return BatteryLifeReport(battery, (nexttime - starttime).value, 
-      charge, charge_consumed, None, errcount)
+  capacity = BATTERIES[battery][0].inUnitsOf("C").value
+  times = measurements[:,0]
+  currents = measurements[:,1]
+  nans = numpy.isnan(currents)
+  if nans.any():
+    # some overflow happened, so pick some arbitrary high value.
+    currents = numpy.where(nans, 1.5, currents)
+  scale = PQ(1.0, unit).inUnitsOf("A").value
+  consumed = CumulativeCharge(times, currents * scale)
+  end = FindChargeCrossing(consumed, capacity)
+  if end is None:
+    end = len(times) - 1
+  errcount = _CheckNaN(times, measurements[:,1], end, strict)
+  charge_consumed = consumed[end]
+  return BatteryLifeReport(battery, times[end] - times[0], 
+      PQ(capacity - charge_consumed, "C"), PQ(charge_consumed, "C"),
+      None, errcount)
 
 
 def BatteryChargeTime(dataset, battery="DREA160", strict=True):
   """Compute charge time by counting DC current measurements.
 
+  Only the charging (negative) current is integrated.
   """
-  fullcharge = BATTERIES[battery][0].inUnitsOf("C")
-  charge_added = PQ(0.0, "C")
-  unit = dataset.unit
-
-  measurements_iter = iter(dataset.measurements)
-  firstrow  = measurements_iter.next()
-  starttime = timeval = PQ(firstrow[0], "s")
-  errcount = 0 
-
-  for row in measurements_iter:
-    nexttime = PQ(row[0], "s")
-    rawvalue = row[1]
-    if numpy.isnan(rawvalue):
-      if strict:
-        raise ValueError( "NaN value in data: at time %s (offset %s)." % (
-            nexttime, nexttime - starttime))
-      else:
-        # some overflow happened, so pick some arbitrary high value.
-        rawvalue = -0.1
-        errcount += 1
-    if rawvalue < 0.0: # DC charging measurements are negative
-      measurement = PQ(rawvalue, unit)
-      delta_t = nexttime - timeval
-      charge_added -= measurement * delta_t 
-      timeval = nexttime
-      if charge_added >= fullcharge:
-        break
-  return BatteryChargeReport(battery, (nexttime - starttime).value, 
-      charge_added, errcount)
+  fullcharge = BATTERIES[battery][0].inUnitsOf("C").value
+  measurements = dataset.measurements
+  times = measurements[:,0]
+  currents = measurements[:,1]
+  nans = numpy.isnan(currents)
+  if nans.any():
+    # some overflow happened, so pick some arbitrary value.
+    currents = numpy.where(nans, -0.1, currents)
+  # DC charging measurements are negative
+  charging = numpy.where(currents < 0.0, -currents, 0.0)
+  scale = PQ(1.0, dataset.unit).inUnitsOf("A").value
+  added = CumulativeCharge(times, charging * scale)
+  end = FindChargeCrossing(added, fullcharge)
+  if end is None:
+    end = len(times) - 1
+  errcount = _CheckNaN(times, measurements[:,1], end, strict)
+  return BatteryChargeReport(battery, times[end] - times[0], 
+      PQ(added[end], "C"), errcount)
 
 
 class BatteryChargeReport(object):
@@ -1007,21 +1780,29 @@ def BatteryLifeByVoltage(voltagemeasurements, battery="DREA160"):
   Return:
     A BatteryLifeReport containing the time span and cutoff voltage.
   """
-  cutoff_spec = BATTERIES[battery][1].value
-  voltagemeasurements = voltagemeasurements.transpose()
+  times = voltagemeasurements[:,0]
+  voltages = voltagemeasurements[:,1]
+  i = FindCutoff(voltages, BATTERIES[battery][1].value)
+  return BatteryLifeReport(battery, (times[i] - times[0]), None, None,
+      PQ(voltages[i], "V"))
+
+
+def FindCutoff(voltages, cutoff_spec):
+  """Find the index of the cutoff point in an array of battery voltages.
+
+  This is the first value at or below the cutoff voltage, or the first
+  minimum if the voltage never reaches the cutoff.
+  """
   # The DUT may turn off before the cutoff voltage is measured. But the
   # absolute minimum reading may be far past that, since the voltage is
   # held near zero sometimes by the DUT.
-  v_min = numpy.min(voltagemeasurements[1])
+  v_min = numpy.min(voltages)
   if v_min > cutoff_spec:
     cutoff_spec = v_min
-  for i, val in enumerate(voltagemeasurements[1]):
-    if val <= cutoff_spec:
-        break
-  start = voltagemeasurements[0][0]
-  end = voltagemeasurements[0][i]
-  cutoff = voltagemeasurements[1][i]
-  return BatteryLifeReport(battery, (end - start), None, None, PQ(cutoff, "V"))
+  below = voltages <= cutoff_spec
+  if below.any():
+    return int(below.argmax())
+  return len(voltages) - 1
 
 
 def GetBatteryLifeReportFromFile(fname, 
@@ -1035,6 +1816,50 @@ def GetBatteryLifeReportFromFile(fname,
   return GetBatteryLifeReport(data, battery, strict)
 
 
+def GetBatteryLifeReports(filenames, timemarks=None, battery=None,
+      extradata=None, strict=True, workers=1):
+  """Get the BatteryLifeReport of each of several data files.
+
+  Reports are taken from the resultcache if the file has not changed
+  since one was computed with the same battery, timemarks and strictness.
+  The others are computed by the given number of forked worker processes
+  (None means one per CPU), and cached.
+
+  Args:
+    extradata (dict, optional): added to the metadata of every report.
+
+  Returns:
+    list of reports, in the same order as the file names.
+  """
+  cache = resultcache.GetCache()
+  key = ("batterylife", BATTERY_LIFE_VERSION, battery, timemarks, strict)
+  reports = [None] * len(filenames)
+  missing = []
+  pool = workerpool.Pool(workers)
+  for i, fname in enumerate(filenames):
+    state = cache.Get(fname, key)
+    if state is None:
+      missing.append(i)
+      pool.Submit(_BatteryLifeJob, fname, timemarks, battery, strict)
+    else:
+      reports[i] = BatteryLifeReportFromState(state)
+  for i, rpt in zip(missing, pool.Wait()):
+    cache.Put(filenames[i], key, rpt.GetState())
+    reports[i] = rpt
+  for fname, rpt in zip(filenames, reports):
+    rpt.metadata = catalog.GetMetadata(fname)
+    if extradata:
+      rpt.metadata.update(extradata)
+  return reports
+
+
+def _BatteryLifeJob(fname, timemarks, battery, strict):
+  data = DataSet(filename=fname, timespec=timemarks)
+  rpt = GetBatteryLifeReport(data, battery, strict)
+  rpt.metadata = None # set again from the file name by the caller.
+  return rpt
+
+
 def GetBatteryLifeReport(dataset, battery=None, strict=True):
   unit = dataset.unit
   if unit == "V":
@@ -1047,6 +1872,11 @@ def GetBatteryLifeReport(dataset, battery=None, strict=True):
   return rpt
 
 
+# Version of the battery life computation. Change it when the results
+# change, so that cached ones are computed again.
+BATTERY_LIFE_VERSION = 2
+
+
 class BatteryLifeReport(object):
   """Report that holds a battery life.
 
@@ -1125,6 +1955,19 @@ class BatteryLifeReport(object):
         self.battery, self._lifetime, self.endcharge, self.consumed_charge, 
         self.cutoff, self.errorcount)
 
+  def GetState(self):
+    """The constructor arguments, as a dict of plain values (for the
+    result cache). The metadata is not included.
+    """
+    state = {"battery": self.battery, "time": float(self._lifetime),
+        "errorcount": int(self.errorcount)}
+    for name in ("endcharge", "consumed_charge", "cutoff"):
+      value = getattr(self, name)
+      if value is not None:
+        value = [float(value.value), value.unit.name()]
+      state[name] = value
+    return state
+
   def __str__(self):
     startcharge = BATTERIES[self.battery][0]
     lt = self._GetLifetime()
@@ -1143,6 +1986,18 @@ class BatteryLifeReport(object):
     return "\n".join(s)
 
 
+def BatteryLifeReportFromState(state):
+  """Make a BatteryLifeReport from what its GetState returned."""
+  quantities = {}
+  for name in ("endcharge", "consumed_charge", "cutoff"):
+    value = state[name]
+    if value is not None:
+      value = PQ(value[0], str(value[1]))
+    quantities[name] = value
+  return BatteryLifeReport(str(state["battery"]), state["time"],
+      errorcount=state["errorcount"], **quantities)
+
+
 class BatteryLifeEstimator(object):
   """
 Ic = in-call current
@@ -1183,18 +2038,28 @@ batterylife = tc + ts + tu + tuc
 
 # Functions for interactive reporting from command line.
 
+def _LoadDataSet(filename, timemarks=None, streaming=False):
+  if streaming:
+    return StreamingDataSet(filename, timespec=timemarks)
+  else:
+    return DataSet(filename=filename, timespec=timemarks)
+
+
 def DoGraph(filename, timemarks=None, columns=None, ylim=None,
-      autoscale=False, eventsfile=None):
+      autoscale=False, eventsfile=None, streaming=False, chartmarks="0s,9d",
+      workers=1):
   """Make a series of graphs from the the data in file split on the time
-  marks. 
+  marks (chartmarks). The graphs are rendered by the given number of
+  worker processes (None means one per CPU).
   """
-  data = DataSet(filename=filename, timespec=timemarks)
+  data = _LoadDataSet(filename, timemarks, streaming)
   if eventsfile is not None:
     events = DataSet(filename=eventsfile)
   else:
     events = None
-  names = MakeCharts(data, columns=columns, ylim=ylim, 
-      events=events, autoscale=autoscale)
+  names = MakeCharts(data, chartmarks, columns=columns, ylim=ylim, 
+      events=events, autoscale=autoscale, pyramid=GetPyramid(filename),
+      workers=workers)
   for name in names:
     print "PNG file saved to:", name
 
@@ -1208,29 +2073,94 @@ def DoTwoSetPlot(filename1, filename2, timemarks=None, ylim1=None,
   print TwoSetPlot(ds1, ds2, ylim1, ylim2, autoscale)
 
 
-def DoCCDFChart(filename, timemarks=None):
-  pass
+def DoPowerTable(voltagefile, currentfile, timemarks=None, method=None,
+      period=None):
+  """Join a voltage and a current data file on one time base, and write a
+  data file with their power and cumulative energy as well.
+
+  Args:
+    method (string, optional): the streamjoin method, "interpolate"
+    (default) or "asof".
+    period (float, optional): time between rows, in seconds. Default is
+    the voltage file's time stamps.
+    timemarks (string, optional): the span of time to keep, relative to
+    the start of the joined data.
+
+  Raises ValueError if the files have no samples in common.
+  """
+  from droid import streamjoin
+  voltage = DataSet(filename=voltagefile)
+  current = DataSet(filename=currentfile)
+  power = streamjoin.GetPowerDataSet(voltage, current,
+      method or streamjoin.INTERPOLATE, period, timemarks)
+  newfilename = "%s-power.dat" % (os.path.splitext(currentfile)[0],)
+  ctx = dictlib.AttrDict()
+  ctx.datafilename = newfilename
+  report = flatfile.GnuplotReport(ctx)
+  report.Initialize()
+  report.SetColumns(*["%s (%s)" % lu for lu in zip(power.labels,
+      power.units)])
+  report.WriteArray(power.measurements)
+  report.Finalize()
+  print newfilename
+  columns = power.measurements
+  print "Mean power: %s" % PQ(numpy.mean(columns[:, -2][
+      ~numpy.isnan(columns[:, -2])]), "W")
+  print "Energy: %s" % PQ(columns[-1, -1], "J").inUnitsOf("mW*h")
+
+
+def DoCCDFChart(filenames, timemarks=None, ylim=None, bins="D",
+      columns=None, legenddata=(), merge=False):
+  print CCDFChart(filenames, timemarks, ylim, bins=bins, columns=columns,
+      legenddata=legenddata, merge=merge)
 
 
 def DoRollupTable(filenames, summary, timespan):
-  """Create a new data set consisting of averages for one minute
-  intervals.
+  """Create new data sets consisting of averages (and other statistics)
+  for intervals of time.
+
+  Args:
+    timespan (string): interval, or comma separated intervals, such as
+    "1minute" or "1s,1minute,15minute,1hour". All intervals are produced
+    from one read of each file.
   """
+  if type(timespan) is str:
+    timespan = [ts.strip() for ts in timespan.split(",")]
   for fname in filenames:
-    newname = RollupTable(fname, timespan)
-    if summary:
-      DoSummary(newname)
-    print newname
+    for newname in RollupTables(fname, timespan):
+      if summary:
+        DoSummary(newname)
+      print newname
 
 
-def DoSummary(fname, timemarks=None):
-  data = DataSet(filename=fname, timespec=timemarks)
-  rptfname =data.metadata.GetFileName("summary")
+def DoSummary(fname, timemarks=None, streaming=False):
+  data = _LoadDataSet(fname, timemarks, streaming)
+  print WriteSummary(data)
+
+
+def DoSummaries(filenames, timemarks=None, streaming=False, workers=1):
+  """Write the summaries of several files, with the given number of
+  worker processes (None means one per CPU).
+  """
+  pool = workerpool.Pool(workers)
+  for fname in filenames:
+    pool.Submit(_SummaryJob, fname, timemarks, streaming)
+  for rptfname in pool.Wait():
+    print rptfname
+
+
+def _SummaryJob(fname, timemarks, streaming):
+  return WriteSummary(_LoadDataSet(fname, timemarks, streaming))
+
+
+def WriteSummary(data):
+  """Write the summary of a data set to a file. Returns the file name."""
+  rptfname = data.metadata.GetFileName("summary")
   stream = open(rptfname, "w")
   stream.write(str(data))
   stream.write("\n")
   stream.close()
-  print rptfname
+  return rptfname
 
 
 def DoBattery(fname, timemarks=None, battery=None, strict=True):
@@ -1238,14 +2168,7 @@ def DoBattery(fname, timemarks=None, battery=None, strict=True):
   """
   data = DataSet(filename=fname, timespec=timemarks)
   rpt = GetBatteryLifeReport(data, battery, strict)
-  rptfname = data.metadata.GetFileName("batterylife")
-  stream = open(rptfname, "w")
-  stream.write(str(data.metadata))
-  stream.write("\n")
-  stream.write(str(rpt))
-  stream.write("\n")
-  stream.close()
-  print rptfname
+  print WriteReport(data, rpt, "batterylife")
 
 
 def DoBatteryCharge(fname, timemarks=None, battery=None, strict=True):
@@ -1253,26 +2176,28 @@ def DoBatteryCharge(fname, timemarks=None, battery=None, strict=True):
   """
   data = DataSet(filename=fname, timespec=timemarks)
   rpt = BatteryChargeTime(data, battery, strict)
-  rptfname = data.metadata.GetFileName("batterycharge")
+  print WriteReport(data, rpt, "batterycharge")
+
+
+def WriteReport(data, rpt, name):
+  """Write the metadata of a data set, and a report about it, to a file
+  named for the data set and the kind of report. Returns the file name.
+  """
+  rptfname = data.metadata.GetFileName(name)
   stream = open(rptfname, "w")
   stream.write(str(data.metadata))
   stream.write("\n")
   stream.write(str(rpt))
   stream.write("\n")
   stream.close()
-  print rptfname
+  return rptfname
 
 
 def DoFullBatteryChart(filenames, timemarks=None, battery=None, 
-      autoscale=False, legenddata=None, extradata=None, strict=True):
-  reports = []
-  for fname in filenames:
-    metadata = datafile.DecodeFullPathName(fname)
-    if extradata:
-      metadata.update(extradata)
-    rpt = GetBatteryLifeReportFromFile(fname, timemarks, 
-        battery, metadata, strict)
-    reports.append(rpt)
+      autoscale=False, legenddata=None, extradata=None, strict=True,
+      workers=1):
+  reports = GetBatteryLifeReports(filenames, timemarks, battery, extradata,
+      strict, workers)
   print BatteryBarChart(reports, autoscale=autoscale, legenddata=legenddata)
 
 
@@ -1296,28 +2221,25 @@ class _MetaKeyGenerator(object):
 
 
 def DoFullMultiBatteryChart(filenames, timemarks=None, battery=None, 
-      autoscale=False, legenddata=None, extradata=None, strict=True):
-  reports = []
-  for fname in filenames:
-    dataset = DataSet(filename=fname, timespec=timemarks)
-    if extradata:
-      dataset.metadata.update(extradata)
-    rpt = GetBatteryLifeReport(dataset, battery, strict)
-    reports.append(rpt)
+      autoscale=False, legenddata=None, extradata=None, strict=True,
+      workers=1):
+  reports = GetBatteryLifeReports(filenames, timemarks, battery, extradata,
+      strict, workers)
   # sort by selected metadata
   reports.sort(key=_MetaKeyGenerator(legenddata, strict))
   print MultiBatteryBarChart(reports, legenddata=legenddata)
 
 
 def DoCrossBuildBatteryChart(filenames, timemarks=None, battery=None, 
-      autoscale=False, legenddata=None, extradata=None, strict=True):
-  reports = []
-  first_metadata = datafile.DecodeFullPathName(filenames[0])
+      autoscale=False, legenddata=None, extradata=None, strict=True,
+      workers=1):
+  matching = []
+  first_metadata = catalog.GetMetadata(filenames[0])
   filenames.sort()
   for fname in filenames:
     # filter reports state that matches the first one.
     try:
-      metadata = datafile.DecodeFullPathName(fname)
+      metadata = catalog.GetMetadata(fname)
     except OSError, err:
       print err
       continue
@@ -1326,10 +2248,161 @@ def DoCrossBuildBatteryChart(filenames, timemarks=None, battery=None,
     if not first_metadata.CompareData(metadata, legenddata, missingok=True):
       print "Warning:", fname, "does not match state of first file."
       continue
-    rpt = GetBatteryLifeReportFromFile(fname, timemarks, battery, metadata, strict)
-    reports.append(rpt)
+    matching.append(fname)
+  reports = GetBatteryLifeReports(matching, timemarks, battery, extradata,
+      strict, workers)
   print MultiBuildBatteryBarChart(reports, autoscale=autoscale, 
       legenddata=legenddata)
 
 
+class ReportBatch(object):
+  """Produce several kinds of report of each data file, reading each file
+  only once.
+
+  The reports, by pdreport mode letter, are: G (graphs), H (histogram), X
+  (CCDF chart), R (rollup tables), S (summary), B (battery life) and D
+  (battery charge time). They all share the one array read from the file,
+  and the time slice of it (and its time index and statistics) the
+  timemarks select. The time spent in each stage is kept in timings.
+
+  Args:
+    modes (string or list): mode letters, e.g. "GSRB" or ["G", "S"].
+    Other keyword arguments are the options of the Do* functions of the
+    same modes.
+  """
+  STAGES = {
+    "G": "graph",
+    "H": "histogram",
+    "X": "ccdf",
+    "R": "rollup",
+    "S": "summary",
+    "B": "battery",
+    "D": "charge",
+  }
+
+  def __init__(self, modes, timemarks=None, columns=None, ylim=None,
+        autoscale=False, eventsfile=None, chartmarks="0s,9d", workers=1,
+        bins="D", legenddata=(), rollup=ROLLUP_SPANS, summary=False,
+        battery="DREA160", strict=True):
+    self.modes = [m.upper() for m in modes]
+    for mode in self.modes:
+      if mode not in self.STAGES:
+        raise ValueError("ReportBatch: no batch mode %r." % (mode,))
+    self.timemarks = timemarks
+    self.columns = columns
+    self.ylim = ylim
+    self.autoscale = autoscale
+    self.eventsfile = eventsfile
+    self.chartmarks = chartmarks
+    self.workers = workers
+    self.bins = bins
+    self.legenddata = legenddata
+    if type(rollup) is str:
+      rollup = [ts.strip() for ts in rollup.split(",")]
+    self.rollup = rollup
+    self.summary = summary
+    self.battery = battery
+    self.strict = strict
+    self.timings = {} # stage name: [count, seconds]
+
+  def _Time(self, stage, func, *args, **kwargs):
+    start = time.time()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      timing = self.timings.setdefault(stage, [0, 0.0])
+      timing[0] += 1
+      timing[1] += time.time() - start
+
+  def Run(self, filenames):
+    """Make the reports of each file.
 
+    Returns:
+      list of the names of the files written.
+    """
+    names = []
+    for filename in filenames:
+      names.extend(self.RunFile(filename))
+    return names
+
+  def RunFile(self, filename):
+    header, measurements = self._Time("load", ReadArray, filename)
+    data = self._Time("dataset", self._MakeDataSet, filename, header,
+        measurements)
+    loaded = {filename: (header, measurements)}
+    names = []
+    for mode in self.modes:
+      stage = self.STAGES[mode]
+      if mode == "G":
+        rv = self._Time(stage, self._Graph, filename, data, measurements)
+      elif mode == "H":
+        rv = [self._Time(stage, PlotHistogram, [filename],
+            timemarks=self.timemarks, columns=self.columns, bins=self.bins,
+            legenddata=self.legenddata, autoscale=self.autoscale,
+            loaded=loaded)]
+      elif mode == "X":
+        rv = [self._Time(stage, CCDFChart, [filename],
+            timemarks=self.timemarks, ylim=self.ylim, bins=self.bins,
+            columns=self.columns, legenddata=self.legenddata,
+            loaded=loaded)]
+      elif mode == "R":
+        rv = self._Time(stage, RollupTables, filename, self.rollup,
+            data=(header, measurements))
+        if self.summary:
+          rv += [self._Time("summary", self._RollupSummary, name)
+              for name in rv]
+      elif mode == "S":
+        rv = [self._Time(stage, WriteSummary, data)]
+      elif mode == "B":
+        rv = [self._Time(stage, self._Report, data, GetBatteryLifeReport,
+            "batterylife")]
+      elif mode == "D":
+        rv = [self._Time(stage, self._Report, data, BatteryChargeTime,
+            "batterycharge")]
+      names.extend(rv)
+    return names
+
+  def _MakeDataSet(self, filename, header, measurements):
+    whole = DataSet(array=measurements, headers=header)
+    whole.metadata = catalog.GetMetadata(filename)
+    if self.timemarks:
+      return DataSet(dataset=whole, timespec=self.timemarks)
+    return whole
+
+  def _Graph(self, filename, data, measurements):
+    if self.eventsfile is not None:
+      events = DataSet(filename=self.eventsfile)
+    else:
+      events = None
+    return MakeCharts(data, self.chartmarks, columns=self.columns,
+        ylim=self.ylim, events=events, autoscale=self.autoscale,
+        pyramid=GetPyramid(filename, measurements), workers=self.workers)
+
+  def _RollupSummary(self, filename):
+    return WriteSummary(DataSet(filename=filename))
+
+  def _Report(self, data, reporter, name):
+    rpt = reporter(data, self.battery, self.strict)
+    return WriteReport(data, rpt, name)
+
+  def GetTimingReport(self):
+    """Get a table of the time spent in each stage."""
+    s = ["%-10s %5s %10s" % ("stage", "count", "seconds")]
+    total = 0.0
+    for stage, (count, seconds) in sorted(self.timings.items(),
+          key=lambda item: -item[1][1]):
+      s.append("%-10s %5d %10.3f" % (stage, count, seconds))
+      total += seconds
+    s.append("%-10s %5s %10.3f" % ("total", "", total))
+    return "\n".join(s)
+
+
+def DoBatch(filenames, modes, **kwargs):
+  """Produce the reports of several modes for each file, reading each file
+  once (see ReportBatch), and print the file names and stage timings.
+  """
+  batch = ReportBatch(modes, **kwargs)
+  for name in batch.Run(filenames):
+    if name is not None:
+      print name
+  print batch.GetTimingReport()
@@ -0,0 +1,486 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Performance benchmarks.
+
+Each benchmark is a function that takes keyword options and returns a
+BenchmarkReport. They are run from the command line with the pdbench
+tool.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import os
+import time
+import itertools
+import shutil
+import tempfile
+
+import numpy
+
+
+class BenchmarkReport(object):
+  """Holds named timings, in seconds, and some free form notes."""
+
+  def __init__(self, name):
+    self.name = name
+    self.timings = []
+    self.notes = []
+
+  def AddTiming(self, label, seconds, count=None, unit="rows"):
+    self.timings.append((label, seconds, count, unit))
+
+  def AddNote(self, text):
+    self.notes.append(text)
+
+  def __str__(self):
+    s = ["Benchmark: %s" % self.name]
+    for label, seconds, count, unit in self.timings:
+      if count:
+        s.append("  %-30.30s %10.3f s  %14.0f %s/s" % (
+            label, seconds, count / seconds, unit))
+      else:
+        s.append("  %-30.30s %10.3f s" % (label, seconds))
+    for note in self.notes:
+      s.append("  %s" % note)
+    return "\n".join(s)
+
+
+def TimeCall(func, *args, **kwargs):
+  """Call a function and return a tuple of (elapsed time, result)."""
+  start = time.time()
+  rv = func(*args, **kwargs)
+  return time.time() - start, rv
+
+
+def MakeSyntheticCurrent(rows, period=0.0625, start=None, columns=5,
+      nanrate=0.0001):
+  """Make an array of fake current measurements, organized in rows.
+
+  The first column is the time stamp, the rest are currents in A. A small
+  fraction of values are the SCPI overflow value.
+  """
+  if start is None:
+    start = time.time()
+  a = numpy.empty((rows, columns + 1), numpy.float64)
+  a[:,0] = start + numpy.arange(rows) * period
+  a[:,1:] = numpy.random.exponential(0.1, (rows, columns))
+  nans = numpy.random.random_sample((rows, columns)) < nanrate
+  a[:,1:][nans] = 9.91E+37
+  return a
+
+
+_HEADINGS = ("timestamp (s)", "Average (A)", "Low (A)", "High (A)",
+        "Minimum (A)", "Maximum (A)")
+
+
+def WriteSyntheticFile(filename, rows, chunk=1000000, truncate=False):
+  """Write a text data file, in the same format the flatfile reports
+  produce, with synthetic data.
+  """
+  unused_, filetype = os.path.splitext(filename)
+  headings = _HEADINGS
+  fo = open(filename, "w")
+  try:
+    if filetype == ".csv":
+      sep = ","
+      fo.write(",".join(headings))
+    elif filetype == ".dat":
+      sep = "\t"
+      fo.write("# " + "\t".join(map(repr, headings)))
+    else:
+      sep = "\t"
+      fo.write("\t".join(map(repr, headings)))
+    fo.write("\n")
+    start = time.time()
+    for offset in xrange(0, rows, chunk):
+      a = MakeSyntheticCurrent(min(chunk, rows - offset),
+          start=start + offset * 0.0625, columns=len(headings) - 1)
+      numpy.savetxt(fo, a, fmt="%.12g", delimiter=sep)
+    if truncate:
+      fo.write("%r%s0.01" % (start + rows * 0.0625, sep))
+  finally:
+    fo.close()
+
+
+def _LegacyReadArray(filename):
+  """The element-at-a-time loader that ingest.ReadTextArray replaced."""
+  from droid import analyze
+  def _ReadCSV(fileobj):
+    for line in fileobj:
+      for el in line.split(","):
+        yield float(el)
+  unused_, filetype = os.path.splitext(filename)
+  fo = open(filename, "rU")
+  try:
+    if filetype == ".txt":
+      header = map(eval, fo.readline().split("\t"))
+      a = numpy.fromfile(fo, dtype="f8", sep="\n\t")
+    elif filetype == ".csv":
+      header = map(str.strip, fo.readline().split(","))
+      a = numpy.fromiter(_ReadCSV(fo), numpy.float64)
+    else:
+      line1 = fo.readline()[2:].split("\t")
+      header = map(eval, line1)
+      a = numpy.fromfile(fo, dtype="f8", sep="\n")
+  finally:
+    fo.close()
+  a = numpy.fromiter(itertools.imap(analyze.ValueCheck, a), numpy.float64)
+  a.shape = (-1, len(header))
+  return header, a
+
+
+def IngestBenchmark(rows=10000000, directory=None, keep=False, legacy=True):
+  """Compare the block text reader with the original ReadArray loader.
+
+  Writes a synthetic file of each text type, reads it with both loaders,
+  and checks that they agree.
+  """
+  from droid import ingest
+  rpt = BenchmarkReport("text ingestion, %d rows" % rows)
+  directory = directory or tempfile.gettempdir()
+  for ext in ingest.FILETYPES:
+    fname = os.path.join(directory, "ingestbench-%d%s" % (os.getpid(), ext))
+    elapsed, unused_ = TimeCall(WriteSyntheticFile, fname, rows)
+    rpt.AddTiming("write %s" % ext, elapsed, rows)
+    try:
+      elapsed, (header, new) = TimeCall(ingest.ReadTextArray, fname)
+      rpt.AddTiming("ReadTextArray %s" % ext, elapsed, rows)
+      if legacy:
+        elapsed, (header, old) = TimeCall(_LegacyReadArray, fname)
+        rpt.AddTiming("legacy ReadArray %s" % ext, elapsed, rows)
+        if old.shape != new.shape or not _ArraysMatch(old, new):
+          rpt.AddNote("MISMATCH between loaders for %s" % ext)
+        del old
+      del new
+      # truncated trailing line must be dropped.
+      WriteSyntheticFile(fname, 1000, truncate=True)
+      header, new = ingest.ReadTextArray(fname)
+      if new.shape != (1000, len(header)):
+        rpt.AddNote("Truncated line not recovered for %s: %s" % (ext,
+            new.shape))
+    finally:
+      if not keep:
+        os.unlink(fname)
+  return rpt
+
+
+def ChartBenchmark(hours=24, span="1h", workers=None, directory=None,
+      keep=False):
+  """Compare serial and parallel rendering of time sliced charts.
+
+  A synthetic capture is charted once per span of time: on pylab's global
+  figure, as MakeCharts did before it rendered in workers, then serially,
+  and then by a pool of worker processes. The PNG files must be the same.
+  """
+  from droid import analyze
+  from droid.util import workers as workerpool
+  if workers is None:
+    workers = workerpool.GetCPUCount()
+  rows = int(hours * 3600 * 16)
+  rpt = BenchmarkReport("chart rendering, %s hours in %s slices, %d workers"
+      % (hours, span, workers))
+  directory = directory or tempfile.mkdtemp(prefix="chartbench")
+  fname = os.path.join(directory, "chartbench-0101000000.dat")
+  WriteSyntheticFile(fname, rows)
+  cwd = os.getcwd()
+  results = {}
+  try:
+    dataset = analyze.DataSet(filename=fname)
+    for label, count in (("pylab", 0), ("serial", 1), ("parallel", workers)):
+      subdir = os.path.join(directory, label)
+      os.mkdir(subdir)
+      os.chdir(subdir)
+      analyze.color_cycler = itertools.cycle(analyze.PLOT_COLORS)
+      if count:
+        elapsed, names = TimeCall(analyze.MakeCharts, dataset,
+            timemarks="0s,%s,..." % span, columns=1, workers=count)
+      else:
+        elapsed, names = TimeCall(_PylabCharts, dataset,
+            timemarks="0s,%s,..." % span, columns=1)
+      rpt.AddTiming("MakeCharts %s" % label, elapsed, len(names), "charts")
+      results[label] = [open(name, "rb").read() for name in names]
+      os.chdir(cwd)
+    for label in ("serial", "parallel"):
+      if results[label] != results["pylab"]:
+        rpt.AddNote("MISMATCH between pylab and %s charts." % label)
+      else:
+        rpt.AddNote("%d charts, pylab and %s identical." % (
+            len(results[label]), label))
+  finally:
+    os.chdir(cwd)
+    if not keep:
+      shutil.rmtree(directory, ignore_errors=True)
+  return rpt
+
+
+def _PylabCharts(dataset, timemarks="0s,9d", ylim=None, columns=None,
+      autoscale=False, pyramid=None):
+  """MakeCharts as it was before it rendered in workers, for reference."""
+  from droid import analyze
+  from droid import decimate
+  import pylab
+  from matplotlib.font_manager import FontProperties
+  pylab.ioff()
+  names = []
+  dataset.NormalizeTime()
+  unit = dataset.unit
+  if columns is None:
+    colnums = range(1, len(dataset.labels))
+  elif type(columns) in (tuple, list):
+    colnums = columns
+  else:
+    colnums = [int(columns)]
+
+  for subset, start, end in dataset.GetTimeSlices(timemarks):
+    if len(subset) > 0:
+      x_time, datacols, labels = subset.GetColumns(columns)
+      if len(x_time) < 100:
+        mrk = "."
+        ls = "-"
+      else:
+        mrk = ","
+        ls = "None"
+      pylab.setp(pylab.gcf(), dpi=100, size_inches=(9,6))
+      ax = pylab.gca()
+      pixels = analyze.GetPixelWidth(pylab.gcf())
+      for col, colnum, label, color in itertools.izip(datacols, colnums,
+            labels, analyze.color_cycler):
+        if pyramid is not None:
+          envelope = pyramid.GetEnvelope(dataset.starttime + x_time[0],
+              dataset.starttime + x_time[-1], pixels, colnum)
+          if envelope is not None:
+            envelope = (envelope[0] - dataset.starttime,) + envelope[1:]
+        else:
+          envelope = decimate.Envelope(x_time, col, pixels)
+        analyze.PlotTrace(ax, x_time, col, color, label, ls, mrk, envelope)
+      pylab.xlabel("Time (s)")
+      if not autoscale:
+        analyze._SetYLimit(pylab.gca(), ylim, unit)
+      pylab.ylabel(unit)
+
+      metadata = subset.metadata
+      title = "%s-%s-%s-%ss-%ss" % (metadata.testcase, 
+          metadata.timestamp.strftime("%m%d%H%M%S"),
+          "-".join(labels),
+          int(start), 
+          int(end))
+      pylab.title(title, fontsize="x-small")
+      font = FontProperties(size="x-small")
+      pylab.legend(prop=font)
+
+      fname = "%s.%s" % (title, "png")
+      pylab.savefig(fname, format="png")
+      names.append(fname)
+      pylab.cla()
+    else:
+      break
+  return names
+
+
+def ParseCacheBenchmark(rows=2000000, directory=None, keep=False):
+  """Compare reading a text file with an empty and a current parse cache.
+
+  The cached array must be the same as the parsed one.
+  """
+  from droid import analyze
+  from droid import parsecache
+  rpt = BenchmarkReport("parsed data cache, %d rows" % rows)
+  directory = directory or tempfile.mkdtemp(prefix="cachebench")
+  fname = os.path.join(directory, "cachebench-0101000000.dat")
+  WriteSyntheticFile(fname, rows)
+  cache = parsecache.GetCache()
+  try:
+    cache.Remove(fname)
+    elapsed, (header, parsed) = TimeCall(analyze.ReadArray, fname)
+    rpt.AddTiming("ReadArray, miss", elapsed, rows)
+    elapsed, (header, cached) = TimeCall(analyze.ReadArray, fname)
+    rpt.AddTiming("ReadArray, hit", elapsed, rows)
+    elapsed, unused_ = TimeCall(numpy.add.reduce, cached[:,1])
+    rpt.AddTiming("first pass over cached column", elapsed, rows)
+    if parsed.shape != cached.shape or not _ArraysMatch(parsed, cached):
+      rpt.AddNote("MISMATCH between parsed and cached arrays.")
+    rpt.AddNote("cache counters: %s" % (cache.counters,))
+    del parsed, cached
+  finally:
+    if not keep:
+      cache.Remove(fname)
+      shutil.rmtree(directory, ignore_errors=True)
+  return rpt
+
+
+def WriterBenchmark(rows=1000000, blocksize=4096, directory=None,
+      keep=False):
+  """Compare writing sample arrays record by record and block by block.
+
+  Each report file type is written as an instrument's sample arrays
+  would be: WriteRecord per sample, then WriteBlock per array. The two
+  files must be the same.
+  """
+  from pycopia import dictlib
+  from droid.reports import core as reportcore
+  rpt = BenchmarkReport("report writers, %d rows in blocks of %d" % (
+      rows, blocksize))
+  directory = directory or tempfile.mkdtemp(prefix="writerbench")
+  interval = 0.0001
+  start = time.time()
+  values = MakeSyntheticCurrent(rows, columns=1)[:,1]
+  try:
+    for ext in (".txt", ".csv", ".dat", ".pdc"):
+      contents = []
+      for label, method in (("WriteRecord", "record"), ("WriteBlock",
+            "block")):
+        ctx = dictlib.AttrDict()
+        ctx.datafilename = os.path.join(directory, "%s%s" % (method, ext))
+        report = reportcore.GetDatafile(ctx)
+        report.Initialize()
+        report.SetColumns("timestamp (s)", "Current (A)")
+        elapsed, unused_ = TimeCall(_WriteBlocks, report, method, start,
+            interval, values, blocksize)
+        report.Finalize()
+        rpt.AddTiming("%s %s" % (label, ext), elapsed, rows)
+        contents.append(open(report.filename, "rb").read())
+      if contents[0] != contents[1]:
+        rpt.AddNote("MISMATCH between record and block writes for %s" % ext)
+  finally:
+    if not keep:
+      shutil.rmtree(directory, ignore_errors=True)
+  return rpt
+
+
+def _WriteBlocks(report, method, start, interval, values, blocksize):
+  for offset in xrange(0, len(values), blocksize):
+    timestamp = start + offset * interval
+    block = values[offset:offset + blocksize]
+    if method == "block":
+      report.WriteBlock(timestamp, interval, block)
+    else:
+      # The loop SpecialCurrentMeasurer.Raw used before WriteBlock.
+      for samp in block:
+        report.WriteRecord(timestamp, samp)
+        timestamp += interval
+
+
+def GpibThreadBenchmark(instruments="ps1", threads=4, count=200,
+      query="*IDN?", tick=0.001):
+  """Stress GPIB access from many threads, and time it.
+
+  Each instrument (names from powerdroid.conf, comma separated) is first
+  asked the query count times from one thread. Then threads per
+  instrument share that many queries, all at once. Every response must
+  be the same as the first, or transfers were mixed. Meanwhile another
+  thread, doing no bus I/O, sleeps tick seconds at a time; the longest
+  it waits shows how long the bus calls hold the interpreter lock.
+  """
+  import threading
+  from droid.instruments import core as instrumentcore
+  names = [name.strip() for name in str(instruments).split(",")]
+  devices = [instrumentcore.GetInstrument(name) for name in names]
+  expected = [dev.fetch(query) for dev in devices]
+  rpt = BenchmarkReport("GPIB threads, %d per instrument, %d x %r on %s" % (
+      threads, count, query, ", ".join(names)))
+
+  def _Ask(dev, n, results):
+    for i in xrange(n):
+      results.append(dev.fetch(query))
+
+  def _Tick(stop, gaps):
+    last = time.time()
+    while not stop.isSet():
+      time.sleep(tick)
+      now = time.time()
+      gaps.append(now - last)
+      last = now
+
+  for label, nthreads in (("one thread", 1), ("%d threads" % threads,
+        threads)):
+    stop = threading.Event()
+    gaps = []
+    ticker = threading.Thread(target=_Tick, args=(stop, gaps))
+    ticker.start()
+    workers = []
+    allresults = []
+    for dev in devices:
+      for n in xrange(nthreads):
+        results = []
+        allresults.append(results)
+        workers.append(threading.Thread(target=_Ask,
+            args=(dev, count // nthreads, results)))
+    start = time.time()
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+    elapsed = time.time() - start
+    stop.set()
+    ticker.join()
+    queries = sum(map(len, allresults))
+    rpt.AddTiming("%s, all instruments" % label, elapsed, queries, "queries")
+    if gaps:
+      rpt.AddNote("%s: longest wait of the idle thread %.1f ms." % (
+          label, max(gaps) * 1000.0))
+    for index, results in enumerate(allresults):
+      expect = expected[index // nthreads]
+      bad = len([r for r in results if r != expect])
+      if bad:
+        rpt.AddNote("MISMATCH: %s, %d of %d responses of %s differ." % (
+            label, bad, len(results), names[index // nthreads]))
+  return rpt
+
+
+def ErrorCheckBenchmark(instrument="ps1", count=100):
+  """Time power supply setters with each error check strategy.
+
+  Each setter writes, then checks for errors. The instrument (a name from
+  powerdroid.conf) is left with its own strategy afterwards.
+  """
+  from droid.instruments import core as instrumentcore
+  from droid.instruments import gpib
+  dev = instrumentcore.GetInstrument(instrument)
+  original = dev.errorcheck
+  voltage = dev.GetVoltage()
+  rpt = BenchmarkReport("Error checks, %d setters on %s" % (count, instrument))
+  try:
+    for errorcheck in gpib.ERRORCHECKS:
+      dev.SetErrorCheck(errorcheck)
+      elapsed, unused = TimeCall(_RepeatSetVoltage, dev, voltage, count)
+      rpt.AddTiming("SetVoltage, %s" % errorcheck, elapsed, count, "calls")
+      rpt.AddNote("%s: %.2f ms per setter." % (errorcheck,
+          elapsed * 1000.0 / count))
+      elapsed, unused = TimeCall(_RepeatErrors, dev, count)
+      rpt.AddTiming("Errors, %s" % errorcheck, elapsed, count, "checks")
+  finally:
+    dev.SetErrorCheck(original)
+  return rpt
+
+
+def _RepeatSetVoltage(dev, voltage, count):
+  for i in xrange(count):
+    dev.SetVoltage(voltage)
+
+
+def _RepeatErrors(dev, count):
+  for i in xrange(count):
+    dev.Errors()
+
+
+def _ArraysMatch(a, b):
+  nans = numpy.isnan(a)
+  if not numpy.all(nans == numpy.isnan(b)):
+    return False
+  return numpy.all(a[~nans] == b[~nans])
+
+
+# name: benchmark function
+BENCHMARKS = {
+  "ingest": IngestBenchmark,
+  "charts": ChartBenchmark,
+  "parsecache": ParseCacheBenchmark,
+  "writers": WriterBenchmark,
+  "gpibthreads": GpibThreadBenchmark,
+  "errorcheck": ErrorCheckBenchmark,
+}
+
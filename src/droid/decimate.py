@@ -0,0 +1,155 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Min/max decimation of large traces for plotting.
+
+A trace with many more samples than the plot is wide, in pixels, is drawn
+as a min/max envelope instead: one vertical line per bucket of samples.
+Peaks stay visible, and the time to draw depends on the width of the
+plot, not the number of samples. NaN samples (SCPI overflow) are skipped,
+so a bucket is only NaN if all of its samples are.
+
+A Pyramid holds envelopes of a whole data file at several levels of
+detail, each coarser by FACTOR. It may be saved next to the data file
+(see SIDECAR_EXTENSION) so it is only computed once.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import numpy
+
+
+BUCKET = 16      # samples per bucket at the finest level
+FACTOR = 4       # buckets merged into one at each coarser level
+MINBUCKETS = 256 # coarsest level has at least this many buckets
+
+SIDECAR_EXTENSION = ".lod.npz"
+
+
+def Envelope(times, values, pixels):
+  """Decimate a trace to about the given number of min/max buckets.
+
+  Returns:
+    tuple of (bucket start times, minima, maxima), or None if the trace
+    is short enough to plot as is.
+  """
+  n = len(values)
+  if n <= 2 * pixels:
+    return None
+  size = -(-n // pixels) # ceiling
+  starts = numpy.arange(0, n, size)
+  return (times[starts], numpy.fmin.reduceat(values, starts),
+      numpy.fmax.reduceat(values, starts))
+
+
+class Pyramid(object):
+  """Min/max envelopes of all data columns at several levels of detail.
+
+  Args:
+    levels: list of (bucket size, times, minima, maxima) tuples, finest
+    level first. The minima and maxima are arrays organized in rows, with
+    one column for each data column (time column excluded).
+  """
+  def __init__(self, levels):
+    self.levels = levels
+
+  def __len__(self):
+    return len(self.levels)
+
+  def GetEnvelope(self, start, end, pixels, column=1):
+    """Get the envelope of a column between two (absolute) times.
+
+    The coarsest level that still has at least one bucket per pixel is
+    used.
+
+    Returns:
+      tuple of (bucket start times, minima, maxima), or None if there are
+      too few samples in the span to need decimation.
+    """
+    best = None
+    for index in range(len(self.levels)):
+      envelope = self.GetLevelEnvelope(index, start, end, column)
+      if len(envelope[0]) >= pixels:
+        best = envelope
+      else:
+        break
+    return best
+
+  def GetLevelEnvelope(self, index, start, end, column=1):
+    """Get the envelope of a column between two times from one level."""
+    size, times, mins, maxs = self.levels[index]
+    lo = times.searchsorted(start)
+    hi = times.searchsorted(end)
+    return times[lo:hi], mins[lo:hi, column - 1], maxs[lo:hi, column - 1]
+
+  def Save(self, filename):
+    arrays = {"sizes": numpy.array([level[0] for level in self.levels])}
+    for i, (size, times, mins, maxs) in enumerate(self.levels):
+      arrays["times%d" % i] = times
+      arrays["mins%d" % i] = mins
+      arrays["maxs%d" % i] = maxs
+    fo = open(filename, "wb")
+    try:
+      numpy.savez(fo, **arrays)
+    finally:
+      fo.close()
+
+
+def LoadPyramid(filename):
+  npz = numpy.load(filename)
+  try:
+    levels = []
+    for i, size in enumerate(npz["sizes"]):
+      levels.append((int(size), npz["times%d" % i], npz["mins%d" % i],
+          npz["maxs%d" % i]))
+  finally:
+    npz.close()
+  return Pyramid(levels)
+
+
+def BuildPyramid(chunks, bucket=BUCKET, factor=FACTOR, minbuckets=MINBUCKETS):
+  """Build a Pyramid from arrays of rows, such as a data file read in
+  chunks.
+
+  Only the finest level is built from the rows, the others are built from
+  the level below.
+  """
+  times = []
+  mins = []
+  maxs = []
+  carry = None
+  for chunk in chunks:
+    if carry is not None and len(carry):
+      chunk = numpy.concatenate((carry, chunk))
+    whole = len(chunk) - len(chunk) % bucket
+    carry = chunk[whole:].copy()
+    if whole:
+      _ReduceRows(chunk[:whole], bucket, times, mins, maxs)
+  if carry is not None and len(carry):
+    _ReduceRows(carry, bucket, times, mins, maxs)
+  if not times:
+    return Pyramid([])
+  times = numpy.concatenate(times)
+  mins = numpy.concatenate(mins)
+  maxs = numpy.concatenate(maxs)
+  size = bucket
+  levels = [(size, times, mins, maxs)]
+  while len(times) > minbuckets * factor:
+    starts = numpy.arange(0, len(times), factor)
+    times = times[starts]
+    mins = numpy.fmin.reduceat(mins, starts, axis=0)
+    maxs = numpy.fmax.reduceat(maxs, starts, axis=0)
+    size *= factor
+    levels.append((size, times, mins, maxs))
+  return Pyramid(levels)
+
+
+def _ReduceRows(rows, bucket, times, mins, maxs):
+  starts = numpy.arange(0, len(rows), bucket)
+  times.append(rows[starts, 0])
+  mins.append(numpy.fmin.reduceat(rows[:,1:], starts, axis=0))
+  maxs.append(numpy.fmax.reduceat(rows[:,1:], starts, axis=0))
+
@@ -0,0 +1,52 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Tests for the decimate module."""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import unittest
+
+import numpy
+
+from droid import decimate
+
+
+class EnvelopeTest(unittest.TestCase):
+
+  def setUp(self):
+    n = 100000
+    self.times = numpy.arange(n) * 0.001
+    self.values = numpy.sin(self.times)
+    self.values[::1000] = numpy.nan # SCPI overflow values
+    self.values[54321] = 25.0 # peak
+    self.rows = numpy.column_stack((self.times, self.values))
+
+  def testEnvelopeSkipsNaN(self):
+    times, mins, maxs = decimate.Envelope(self.times, self.values, 700)
+    self.assertFalse(numpy.isnan(mins).any())
+    self.assertFalse(numpy.isnan(maxs).any())
+    self.assertEqual(maxs.max(), 25.0)
+
+  def testPyramidKeepsPeak(self):
+    chunks = [self.rows[i:i + 30000] for i in range(0, len(self.rows), 30000)]
+    pyramid = decimate.BuildPyramid(chunks)
+    self.assertTrue(len(pyramid) > 1)
+    for size, times, mins, maxs in pyramid.levels:
+      self.assertFalse(numpy.isnan(mins).any())
+      self.assertFalse(numpy.isnan(maxs).any())
+      self.assertEqual(maxs.max(), 25.0)
+
+  def testAllNaNBucket(self):
+    values = numpy.ones(1000)
+    values[:100] = numpy.nan
+    times, mins, maxs = decimate.Envelope(numpy.arange(1000.0), values, 100)
+    self.assertTrue(numpy.isnan(maxs[0]))
+    self.assertFalse(numpy.isnan(maxs[10:]).any())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Fixed-edge histograms that can be merged.
+
+The bin edges are fixed by a named scheme (see GetEdges), not derived from
+the data, so histograms of different files with the same scheme may be
+added together. A histogram of a whole file is small, and may be saved
+next to the data file (see SIDECAR_EXTENSION), so distributions and CCDF
+charts of many captures are made without reading the samples again.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import numpy
+
+
+SIDECAR_EXTENSION = ".hist.npz"
+
+DEFAULT_RANGE = (-0.05, 2.5)
+
+# scheme name: list of (start, stop, step) segments. The low end always
+# has more detail, since that is where idle currents fall.
+SCHEMES = {
+  "D": [(0.0, 0.05, 0.0005), (0.05, 1.0, 0.001), (1.0, 2.6, 0.002)],
+  "M": [(0.0, 0.05, 0.0005), (0.05, 1.1, 0.001)],
+  "Z": [(0.0, 0.05, 0.0005), (0.05, 0.51, 0.001)],
+  "S": [(0.0, 0.05, 0.0005), (0.05, 0.16, 0.001)],
+}
+
+
+class Error(Exception):
+  pass
+
+
+def GetEdges(bins):
+  """Get the bin edges for a scheme.
+
+  Args:
+    bins: an integer number of equal width bins over DEFAULT_RANGE, or a
+    string naming a scheme (only the first letter counts): "D"etailed,
+    "M"edium, "Z"oom or "S"uper zoom.
+
+  Returns:
+    tuple of (scheme name, edges array).
+  """
+  try:
+    bins = int(bins)
+  except ValueError:
+    name = bins[0].upper()
+    try:
+      segments = SCHEMES[name]
+    except KeyError:
+      raise Error("No histogram bin scheme %r." % (bins,))
+    edges = numpy.concatenate([numpy.arange(start, stop, step)
+        for start, stop, step in segments])
+    return name, edges
+  else:
+    return str(bins), numpy.linspace(DEFAULT_RANGE[0], DEFAULT_RANGE[1],
+        bins + 1)
+
+
+class Histogram(object):
+  """Counts of values in fixed bins.
+
+  Values below the first edge, or at or above the last one, are counted
+  as underflow and overflow. NaN values are counted as invalid.
+
+  Args:
+    edges (array): the bin edges, increasing.
+    name (string, optional): the scheme name, for titles and sidecar
+    file names.
+  """
+  def __init__(self, edges, name=None):
+    self.edges = numpy.asarray(edges, numpy.float64)
+    self.name = name
+    self.counts = numpy.zeros((len(self.edges) - 1,), numpy.int64)
+    self.underflow = 0
+    self.overflow = 0
+    self.invalid = 0
+
+  def __len__(self):
+    return len(self.counts)
+
+  def GetTotal(self):
+    """Number of valid values counted, including under and overflow."""
+    return int(self.counts.sum()) + self.underflow + self.overflow
+
+  total = property(GetTotal)
+
+  def Add(self, values):
+    """Count an array of values."""
+    values = numpy.asarray(values).ravel()
+    nans = numpy.isnan(values)
+    if nans.any():
+      self.invalid += int(nans.sum())
+      values = values[~nans]
+    # bin i holds edges[i] <= x < edges[i+1]
+    index = self.edges.searchsorted(values, side="right") - 1
+    self.underflow += int((index < 0).sum())
+    self.overflow += int((index >= len(self.counts)).sum())
+    inside = index[(index >= 0) & (index < len(self.counts))]
+    if len(inside):
+      counts = numpy.bincount(inside)
+      self.counts[:len(counts)] += counts
+
+  def Merge(self, other):
+    """Add the counts of another histogram, with the same edges, to this
+    one.
+    """
+    if len(other.edges) != len(self.edges) or not numpy.all(
+        other.edges == self.edges):
+      raise Error("Cannot merge histograms with different bin edges.")
+    self.counts += other.counts
+    self.underflow += other.underflow
+    self.overflow += other.overflow
+    self.invalid += other.invalid
+    return self
+
+  def __iadd__(self, other):
+    return self.Merge(other)
+
+  def __add__(self, other):
+    new = self.Copy()
+    return new.Merge(other)
+
+  def Copy(self):
+    new = Histogram(self.edges, self.name)
+    new.counts = self.counts.copy()
+    new.underflow = self.underflow
+    new.overflow = self.overflow
+    new.invalid = self.invalid
+    return new
+
+  def GetCCDF(self):
+    """Get the complementary cumulative distribution.
+
+    Returns:
+      tuple of (edges, fraction of values at or above each edge).
+    """
+    total = self.GetTotal()
+    tail = numpy.empty((len(self.edges),), numpy.float64)
+    tail[-1] = self.overflow
+    tail[:-1] = self.counts[::-1].cumsum()[::-1] + self.overflow
+    if total:
+      tail /= total
+    return self.edges, tail
+
+  def Save(self, filename):
+    fo = open(filename, "wb")
+    try:
+      numpy.savez(fo, edges=self.edges, counts=self.counts,
+          extra=numpy.array([self.underflow, self.overflow, self.invalid]),
+          name=numpy.array(self.name or ""))
+    finally:
+      fo.close()
+
+
+def LoadHistogram(filename):
+  npz = numpy.load(filename)
+  try:
+    hist = Histogram(npz["edges"], str(npz["name"]) or None)
+    hist.counts = npz["counts"].astype(numpy.int64)
+    hist.underflow, hist.overflow, hist.invalid = map(int, npz["extra"])
+  finally:
+    npz.close()
+  return hist
+
+
+def MergeHistograms(histograms):
+  """Return a new histogram that is the sum of the given ones."""
+  histograms = iter(histograms)
+  try:
+    rv = histograms.next().Copy()
+  except StopIteration:
+    raise Error("No histograms to merge.")
+  for hist in histograms:
+    rv.Merge(hist)
+  return rv
+
+
+def GetSidecarName(filename, name, column):
+  return "%s.%s-%d%s" % (filename, name, column, SIDECAR_EXTENSION)
@@ -0,0 +1,188 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Block oriented reader for text data files.
+
+Reads the text files produced by the droid.reports.flatfile module (.txt,
+.csv, and .dat) in large blocks. Each block is parsed by numpy in one call,
+and the special SCPI values are converted to their numpy equivalents in
+one pass over the whole array.
+
+A truncated (partially written) last line, such as a capture interrupted
+by a crash or power loss leaves, is dropped. A block with a malformed line,
+one without exactly one value per column, is parsed line by line instead,
+and the bad lines are skipped.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import os
+
+import numpy
+
+
+BLOCKSIZE = 4 * 1024 * 1024 # bytes
+
+# IEEE-488 special values
+SCPI_NAN = 9.91E+37
+SCPI_INF = 9.9E+37
+
+FILETYPES = (".txt", ".csv", ".dat")
+
+
+def ReadHeader(fo, filetype):
+  """Read the header line from a data file.
+
+  The file is left positioned at the start of the data.
+
+  Returns:
+    list of column headers.
+  """
+  if filetype == ".txt":
+    header = map(eval, fo.readline().split("\t"))
+  elif filetype == ".csv":
+    header = map(str.strip, fo.readline().split(","))
+  elif filetype == ".dat": # gnuplot style data
+    line1 = fo.readline()[2:].split("\t")
+    try:
+      header = map(eval, line1)
+    except (ValueError, SyntaxError): # assume no header line
+      header = line1
+      fo.seek(0)
+  else:
+    raise ValueError(
+      "ReadHeader: Invalid file type. need .txt, .csv, or .dat (got %r)." %
+      filetype)
+  return header
+
+
+def ReadTextArray(filename, blocksize=BLOCKSIZE):
+  """Reads an array from a text data file.
+
+  Returns:
+    tuple of (header list, array organized in rows).
+  """
+  unused_, filetype = os.path.splitext(filename)
+  fo = open(filename, "rU")
+  try:
+    header = ReadHeader(fo, filetype)
+    ncols = len(header)
+    blocks = [block for block in
+        ReadBlocks(fo, ncols, filetype == ".csv", blocksize) if len(block)]
+  finally:
+    fo.close()
+  if blocks:
+    a = numpy.concatenate(blocks)
+  else:
+    a = numpy.zeros((0,), numpy.float64)
+  MaskSpecialValues(a)
+  a.shape = (-1, ncols)
+  return header, a
+
+
+def ReadTextChunks(filename, blocksize=BLOCKSIZE):
+  """Read a text data file a block at a time.
+
+  Only one block is held in memory at a time. The file is not opened
+  for the data until iteration starts.
+
+  Returns:
+    tuple of (header list, iterator of arrays organized in rows).
+  """
+  unused_, filetype = os.path.splitext(filename)
+  fo = open(filename, "rU")
+  try:
+    header = ReadHeader(fo, filetype)
+  finally:
+    fo.close()
+  return header, _IterTextChunks(filename, filetype, len(header), blocksize)
+
+
+def _IterTextChunks(filename, filetype, ncols, blocksize):
+  fo = open(filename, "rU")
+  try:
+    ReadHeader(fo, filetype)
+    for block in ReadBlocks(fo, ncols, filetype == ".csv", blocksize):
+      if len(block):
+        MaskSpecialValues(block)
+        block.shape = (-1, ncols)
+        yield block
+  finally:
+    fo.close()
+
+
+def ReadBlocks(fo, ncols, csv=False, blocksize=BLOCKSIZE):
+  """Generate flat arrays of values parsed from blocks of an open file.
+
+  Each block ends on a line boundary, so each array holds whole rows.
+  """
+  remainder = ""
+  while 1:
+    text = fo.read(blocksize)
+    if not text:
+      break
+    text = remainder + text
+    end = text.rfind("\n") + 1
+    remainder = text[end:]
+    if end:
+      yield _ParseBlock(text[:end], ncols, csv)
+  # Any remainder is a last line that was not terminated. The writer ends
+  # every row with a newline, so it was cut off, and its last value may
+  # be missing digits even if it has all its fields. It is dropped.
+
+
+def _ParseBlock(text, ncols, csv):
+  if csv:
+    text = text.replace(",", " ")
+  values = numpy.fromstring(text, dtype=numpy.float64, sep=" ")
+  if len(values) == text.count("\n") * ncols and _CheckFields(text, ncols):
+    return values
+  # Some line is malformed (or blank), find the good ones.
+  rows = []
+  for line in text.splitlines():
+    row = _ParseLine(line, ncols, False)
+    if row is not None:
+      rows.append(row)
+  if rows:
+    return numpy.concatenate(rows)
+  return numpy.zeros((0,), numpy.float64)
+
+
+def _CheckFields(text, ncols):
+  """Check that every line of a block has ncols fields.
+
+  The total count alone would pass a line with an extra value next to one
+  with a missing value.
+  """
+  b = numpy.frombuffer(text, numpy.uint8)
+  space = b <= 32 # the separators, and line ends.
+  starts = space[:-1] > space[1:] # a field starts after each of these.
+  fields = numpy.flatnonzero(starts).searchsorted(
+      numpy.flatnonzero(b == 10))
+  counts = numpy.diff(fields)
+  return fields[0] + int(not space[0]) == ncols and (counts == ncols).all()
+
+
+def _ParseLine(line, ncols, csv):
+  """Parse one line, return None if it does not hold a full row."""
+  if csv:
+    line = line.replace(",", " ")
+  try:
+    values = map(float, line.split())
+  except ValueError:
+    return None
+  if len(values) != ncols:
+    return None
+  return numpy.array(values, numpy.float64)
+
+
+def MaskSpecialValues(a):
+  """Convert SCPI special values to numpy NaN and INF, in place."""
+  a[a == SCPI_NAN] = numpy.nan
+  a[a == SCPI_INF] = numpy.inf
+  a[a == -SCPI_INF] = -numpy.inf
+  return a
+
@@ -10,15 +10,102 @@
 """
 
 import array
+import time
+import threading
 
+import numpy
 from pycopia import aid
+from pycopia import dictlib
 
-import _gpib
-GpibError = _gpib.GpibError
+try:
+  import _gpib as _linuxgpib
+except ImportError: # no linux-gpib here, so only simulated instruments.
+  _linuxgpib = None
 
 from droid.instruments import core
 
 
+if _linuxgpib is None:
+  class GpibError(Exception):
+    pass
+else:
+  GpibError = _linuxgpib.GpibError
+
+
+class _GpibBus(object):
+  """Calls the _gpib module, or a simulator for the descriptors attached
+  to one (see droid.instruments.simulators).
+
+  It has the same functions as _gpib, so the rest of this module does
+  not know the difference.
+  """
+  SIMULATED = 0x10000 # first simulated descriptor, above any real one.
+
+  def __init__(self, module):
+    self._module = module
+    self._simulators = {} # descriptor: simulator
+    self._nextid = self.SIMULATED
+    self._local = threading.local() # which one this thread used last.
+    self.GpibError = GpibError
+
+  def Attach(self, simulator):
+    """Get a descriptor for a simulated device."""
+    ud = self._nextid
+    self._nextid += 1
+    self._simulators[ud] = simulator
+    return ud
+
+  def __getattr__(self, name):
+    func = getattr(self._module, name, None)
+    simulators = self._simulators
+    local = self._local
+    def _Call(ud, *args):
+      simulator = simulators.get(ud)
+      if simulator is None:
+        local.simulator = None
+        if func is None:
+          raise GpibError("%s: no GPIB support here." % (name,))
+        return func(ud, *args)
+      local.simulator = simulator
+      return getattr(simulator, name)(*args)
+    setattr(self, name, _Call) # look it up once.
+    return _Call
+
+  def close(self, ud):
+    simulator = self._simulators.pop(ud, None)
+    if simulator is None:
+      self._module.close(ud)
+
+  def ibdev(self, board, pad):
+    if self._module is None:
+      raise GpibError("ibdev: no GPIB support here.")
+    return self._module.ibdev(board, pad)
+
+  def find(self, name):
+    if self._module is None:
+      raise GpibError("find: no GPIB support here.")
+    return self._module.find(name)
+
+  def ibsta(self):
+    simulator = getattr(self._local, "simulator", None)
+    if simulator is not None:
+      return simulator.ibsta()
+    if self._module is None:
+      return 0
+    return self._module.ibsta()
+
+  def ibcnt(self):
+    simulator = getattr(self._local, "simulator", None)
+    if simulator is not None:
+      return simulator.ibcnt()
+    if self._module is None:
+      return 0
+    return self._module.ibcnt()
+
+
+_gpib = _GpibBus(_linuxgpib)
+
+
 Enum = aid.Enum
 Enums = aid.Enums
 
@@ -31,6 +118,27 @@ TIMEOUTS = Enums( "TNever", "T10us", "T30us", "T100us", "T300us",
 T1ms, T3ms, T10ms, T30ms, T100ms, T300ms,
 T1s, T3s, T10s, T30s, T100s, T300s, T1000s) = TIMEOUTS
 
+# The timeouts in seconds, in the same order. None is never.
+TIMEOUT_SECONDS = (None, 10e-6, 30e-6, 100e-6, 300e-6,
+  1e-3, 3e-3, 10e-3, 30e-3, 0.1, 0.3,
+  1.0, 3.0, 10.0, 30.0, 100.0, 300.0, 1000.0)
+
+# IEEE-488.2 status byte bits.
+EAV = 0x04 # error available (SCPI)
+MAV = 0x10 # message available
+ESB = 0x20 # event status summary
+MSS = 0x40 # master summary status, requesting service
+OSS = 0x80 # operation status summary (SCPI)
+
+# standard event status register bits.
+OPC = 0x01 # operation complete
+ESR_ERRORS = 0x3c # query, device dependent, execution and command errors
+
+# How GpibInstrument.Errors finds out if there are errors.
+ERRORCHECK_QUERY = "query" # read the error queue until it is empty.
+ERRORCHECK_POLL = "poll" # serial poll, and read the queue only if flagged.
+ERRORCHECKS = (ERRORCHECK_QUERY, ERRORCHECK_POLL)
+
 # Status (sta) bits.
 # http://linux-gpib.sourceforge.net/doc_html/r625.html
 DCAS =  Enum(0x1, "DCAS")
@@ -97,6 +205,578 @@ Rsv = 0x21 #Sets the current status byte this board will use to respond to seria
 BNA = 0x200 #Changes the GPIB interface board used to access a device.  The setting specifies the board index of the new access board. This configuration option is similar to ibbna() except the new board is specified by its board index instead of a name.   device
 
 
+# IEEE-488.2 binary block transfer. FORM REAL,<size> with FORM:BORD NORM
+# sends arrays as big-endian IEEE floats in a definite length block.
+BLOCK_TYPES = {
+  32: numpy.dtype(">f4"),
+  64: numpy.dtype(">f8"),
+}
+
+# The special IEEE-488 values (see core.ValueCheck), and what they mean.
+SPECIAL_VALUES = (
+  (9.91E+37, numpy.nan),
+  (9.9E+37, numpy.inf),
+  (-9.9E+37, -numpy.inf),
+)
+
+
+def GetBlockLength(data):
+  """Get the size of an IEEE-488.2 block from its header.
+
+  Args:
+    data (string): the start of a response, at least the whole header.
+
+  Returns:
+    tuple of (header length, data length). The data length is None for
+    an indefinite length ("#0") block, which runs to the end of the
+    message.
+
+  Raises:
+    ValueError if the data does not start with a block header.
+  """
+  if len(data) < 2 or data[0] != "#" or not data[1].isdigit():
+    raise ValueError("Not a binary block: %r" % (data[:12],))
+  digits = int(data[1])
+  if digits == 0:
+    return 2, None
+  lengthstring = data[2:2 + digits]
+  if len(lengthstring) != digits or not lengthstring.isdigit():
+    raise ValueError("Bad binary block header: %r" % (data[:2 + digits],))
+  return 2 + digits, int(lengthstring)
+
+
+def DecodeBlock(data, dtype=BLOCK_TYPES[64]):
+  """Decode a response holding an IEEE-488.2 block of floats.
+
+  Args:
+    data (string): the whole response.
+    dtype (numpy.dtype): the type of the values, including byte order.
+
+  Returns:
+    float64 array of the values, with the special IEEE-488 values
+    replaced by NaN and INF, as core.ValueCheck does.
+  """
+  dtype = numpy.dtype(dtype)
+  headerlength, length = GetBlockLength(data)
+  if length is None:
+    length = len(data) - headerlength
+    length -= length % dtype.itemsize # the terminator
+  elif len(data) < headerlength + length:
+    raise ValueError("Short binary block: got %d of %d bytes." % (
+        len(data) - headerlength, length))
+  if length % dtype.itemsize:
+    raise ValueError("Binary block of %d bytes is not a whole number of %s." %
+        (length, dtype))
+  values = numpy.frombuffer(data, dtype, length // dtype.itemsize,
+      headerlength).astype(numpy.float64)
+  for special, value in SPECIAL_VALUES:
+    # compare at the transfer precision, so float32 specials match too.
+    values[values == numpy.array(special, dtype).astype(numpy.float64)] = value
+  return values
+
+
+# Changed when the bus is reset, or its remote enable line changes, since
+# then any instrument may have been set from its front panel.
+_busgeneration = 0
+
+
+def _NewBusGeneration():
+  global _busgeneration
+  _busgeneration += 1
+
+
+class StateCache(object):
+  """Last known settings of one instrument.
+
+  Holds query responses by command header (such as "SOUR:VOLT"). Which
+  headers may be cached, and how a write to one updates it, is up to the
+  instrument class (see GpibInstrument.STATE_QUERIES). The cache is
+  emptied when the instrument's settings may have changed some other way:
+  reset, device clear, errors, or local control.
+  """
+  def __init__(self):
+    self.counters = dictlib.AttrDict(hits=0, misses=0, invalidations=0)
+    self._values = {}
+    self._generation = _busgeneration
+
+  def __len__(self):
+    return len(self._values)
+
+  def Get(self, header):
+    """Get a cached response, or None."""
+    if self._generation != _busgeneration:
+      self.Clear()
+    try:
+      value = self._values[header]
+    except KeyError:
+      self.counters.misses += 1
+      return None
+    self.counters.hits += 1
+    return value
+
+  def Put(self, header, value):
+    self._values[header] = value
+
+  def Remove(self, header):
+    self._values.pop(header, None)
+
+  def Clear(self):
+    self._values.clear()
+    self._generation = _busgeneration
+    self.counters.invalidations += 1
+
+
+class DeviceState(object):
+  """What every instrument object opened on one device shares.
+
+  Several objects may use one device address, each with its own
+  descriptor (such as a power supply and its DVM), besides clones. The
+  device has one output format and one set of settings, whichever
+  object set them, and works on one query at a time, whichever object
+  sent it.
+
+  Attributes:
+    blocktype: numpy dtype of binary array responses, or None for ASCII.
+    request: the outstanding AsyncRequest, or None.
+    statecache: the StateCache, or None (see
+    GpibInstrument.EnableStateCache).
+  """
+  def __init__(self):
+    self.blocktype = None
+    self.request = None
+    self.statecache = None
+
+
+_devices = {} # (simulator, board, pad): DeviceState
+
+
+def _GetDeviceState(devspec):
+  key = (devspec.get("simulator"), devspec.get("gpibboard"),
+      devspec.get("gpibpad"))
+  try:
+    return _devices[key]
+  except KeyError:
+    state = _devices[key] = DeviceState()
+    return state
+
+
+# Conversions of a written argument to the query response, for
+# GpibInstrument.STATE_QUERIES.
+def SameValue(arg):
+  """The response is the argument, such as an enumerated value."""
+  return arg.upper()
+
+
+def NumericValue(arg):
+  """The response is the number, without a unit suffix."""
+  arg = arg.rstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
+  return repr(float(arg))
+
+
+def BooleanValue(arg):
+  """The response is 1 or 0, for ON/OFF or 1/0 written."""
+  return aid.IF(core.GetBoolean(arg), "1", "0")
+
+
+def _GetQueryHeader(string):
+  """The header of a single query, or None if it isn't one."""
+  string = string.strip().lstrip(":")
+  if not string.endswith("?") or ";" in string or " " in string:
+    return None
+  return string[:-1].upper()
+
+
+class AsyncRequest(object):
+  """A query sent to an instrument, whose response is read later.
+
+  Made by GpibInstrument.begin_ask. Other instruments may be sent
+  queries, or be read, while this instrument works on its response.
+
+  Attributes:
+    response: the response, once complete.
+    done (bool): true once complete.
+  """
+  def __init__(self, instrument, query, length, callback=None):
+    self.instrument = instrument
+    self.query = query
+    self.length = length
+    self.callback = callback
+    self.response = None
+    self.done = False
+    self.started = time.time()
+    timeout = TIMEOUT_SECONDS[int(instrument.timeout)]
+    self.deadline = aid.IF(timeout is None, None, self.started + timeout)
+
+  def __repr__(self):
+    return "%s(%r, %r)" % (self.__class__.__name__, self.instrument,
+        self.query)
+
+  def IsReady(self):
+    """True if the response may be read without waiting.
+
+    Checks by serial poll, which the instrument answers while busy. After
+    the deadline (the instrument's timeout), it is ready too, so that
+    complete gets the timeout error.
+    """
+    if self.done:
+      return True
+    if self.instrument.poll() & MAV:
+      return True
+    return self.deadline is not None and time.time() > self.deadline
+
+  def complete(self):
+    """Read the response, waiting for it if need be.
+
+    The callback, if any, is called with the response.
+
+    Returns:
+      the response string.
+    """
+    if self.done:
+      return self.response
+    self.done = True
+    inst = self.instrument
+    if inst._device.request is self:
+      inst._device.request = None
+    self.response = _gpib.readbin(inst._id, self.length)
+    header = _GetQueryHeader(self.query)
+    if inst._statecache is not None and header in inst.STATE_QUERIES:
+      inst._statecache.Put(header, self.response.strip())
+    if self.callback is not None:
+      self.callback(self.response)
+    return self.response
+
+
+class _CompletedRequest(AsyncRequest):
+  """A request answered without asking (from the state cache)."""
+  def __init__(self, query, response, callback=None):
+    self.query = query
+    self.callback = callback
+    self.response = response
+    self.done = True
+    if callback is not None:
+      callback(response)
+
+  def __repr__(self):
+    return "%s(%r)" % (self.__class__.__name__, self.query)
+
+
+def CompleteReady(requests):
+  """Complete the requests that are ready, without waiting for the others.
+
+  Returns:
+    list of the requests not yet complete.
+  """
+  pending = []
+  for req in requests:
+    if req.done:
+      continue
+    if req.IsReady():
+      req.complete()
+    else:
+      pending.append(req)
+  return pending
+
+
+def CompleteAll(requests, interval=0.0005):
+  """Complete requests to several instruments, in the order they are
+  ready, so the wait is about the longest instrument latency, not the
+  sum of them.
+
+  Args:
+    requests (list): AsyncRequest objects.
+    interval (float): seconds to sleep between serial poll rounds.
+
+  Returns:
+    list of the responses, in the order of the requests.
+  """
+  pending = CompleteReady(requests)
+  while pending:
+    time.sleep(interval)
+    pending = CompleteReady(pending)
+  return [req.response for req in requests]
+
+
+def GetTimeout(seconds):
+  """The shortest of the TIMEOUTS that is at least the given seconds."""
+  for value, limit in zip(TIMEOUTS[1:], TIMEOUT_SECONDS[1:]):
+    if limit >= seconds:
+      return value
+  return TIMEOUTS[-1]
+
+
+class Completion(object):
+  """An operation that the instrument signals the end of by service
+  request.
+
+  Made by GpibInstrument.StartOperation, or StartStatusWait for the end
+  of something the status byte shows otherwise. It may be waited for (Wait),
+  waited for by another thread (WaitInBackground), or completed with
+  AsyncRequest objects by CompleteAll. The bus, and other instruments,
+  may be used in the meantime. This instrument should not be, until done.
+
+  Attributes:
+    response: the list of instrument errors, once complete.
+    status: the response to the finishing query (*ESR? by default), once
+    complete.
+    done (bool): true once complete.
+    event (threading.Event): set once complete, even if it failed.
+    error: the exception, if completing failed.
+  """
+  def __init__(self, instrument, command, timeout, callback=None,
+      summary=ESB, finish="*ESR?"):
+    self.instrument = instrument
+    self.command = command
+    self.timeout = timeout
+    self.callback = callback
+    self.summary = summary
+    self.finish = finish
+    self.response = None
+    self.status = None
+    self.done = False
+    self.error = None
+    self.event = threading.Event()
+    self._finished = False
+    self.started = time.time()
+    seconds = TIMEOUT_SECONDS[int(timeout)]
+    self.deadline = aid.IF(seconds is None, None, self.started + seconds)
+
+  def __repr__(self):
+    return "%s(%r, %r)" % (self.__class__.__name__, self.instrument,
+        self.command)
+
+  def IsReady(self):
+    """True if the operation has finished, or the deadline has passed.
+
+    Checks the summary bits (ESB) by serial poll. They stay set until
+    complete reads the event registers.
+    """
+    if self.done or self._finished:
+      return True
+    if self.instrument.poll() & self.summary:
+      self._finished = True
+      return True
+    return self.deadline is not None and time.time() > self.deadline
+
+  def Wait(self):
+    """Wait for the operation to finish, without polling.
+
+    The wait is in ibwait, for the service request, which needs the
+    board's automatic serial polling (the linux-gpib default).
+
+    Returns:
+      the list of instrument errors.
+    """
+    return self.complete()
+
+  def WaitInBackground(self):
+    """Wait in another thread. The callback is called from that thread.
+
+    Returns:
+      the event, which is set once complete.
+    """
+    thread = threading.Thread(target=self._Run,
+        name="Completion %s" % (self.command,))
+    thread.setDaemon(True)
+    thread.start()
+    return self.event
+
+  def _Run(self):
+    try:
+      self.complete()
+    except GpibError, err:
+      self.error = err
+
+  def _Block(self):
+    inst = self.instrument
+    oldtimeout = inst.timeout
+    inst.timeout = self.timeout
+    try:
+      _gpib.wait(inst._id, RQS | TIMO)
+    finally:
+      inst.timeout = oldtimeout
+
+  def complete(self):
+    """Finish the operation, waiting for it if need be.
+
+    Disables the service request, clears the event status register (sends
+    the finishing query), and reads the error queue. The callback, if any, is called with the list
+    of errors.
+
+    Returns:
+      the list of instrument errors.
+
+    Raises:
+      GpibError if the instrument did not finish in the timeout.
+    """
+    if self.done:
+      return self.response
+    inst = self.instrument
+    try:
+      if not self.IsReady():
+        self._Block()
+      self.done = True
+      if not self._finished and not inst.poll() & self.summary:
+        _gpib.write(inst._id, "*SRE 0;*ESE %d" % (inst._eventmask,))
+        self.error = GpibError("%r did not complete in time." % (self,))
+        raise self.error
+      self.status = _gpib.fetch(inst._id, 256, "*SRE 0;*ESE %d;%s" % (
+          inst._eventmask, self.finish)).strip()
+      self.response = inst._ReadErrors()
+    except:
+      self.event.set()
+      raise
+    if self.callback is not None:
+      self.callback(self.response)
+    self.event.set()
+    return self.response
+
+
+class TransactionError(GpibError):
+  """A transaction had instrument errors.
+
+  The argument is a list of (command, DeviceError) tuples. The command is
+  the whole message sent if the error could not be tied to one command
+  of it.
+  """
+
+
+class Transaction(object):
+  """Writes of one instrument, queued to be sent together.
+
+  Commands are sent as few ';' joined messages, each at most maxlength
+  bytes, when a read needs their results, or at Commit. Errors are
+  checked after each message, and reported at Commit. A reset command
+  (see GpibInstrument.RESET_COMMANDS) always starts a new message.
+
+  Args:
+    instrument (GpibInstrument): what to send the commands to.
+    maxlength (int): largest message to send, in bytes. Must fit in the
+    instrument's input buffer.
+  """
+  def __init__(self, instrument, maxlength):
+    self._instrument = instrument
+    self.maxlength = maxlength
+    self.queued = []
+    self.failed = [] # (message, commands, errors)
+
+  def Add(self, command):
+    self.queued.append(command)
+
+  def Flush(self):
+    """Send the queued commands, checking for errors after each message."""
+    queued = self.queued
+    self.queued = []
+    inst = self._instrument
+    group = []
+    for command in queued:
+      if group and inst._IsReset(command):
+        self._Send(group)
+        group = []
+      group.append(command)
+    if group:
+      self._Send(group)
+
+  def _Send(self, commands):
+    inst = self._instrument
+    for message, part in _JoinGroups(commands, self.maxlength):
+      _gpib.write(inst._id, message)
+      errors = inst.Errors()
+      if errors:
+        self.failed.append((message, part, errors))
+
+  def Discard(self):
+    """Forget the queued commands."""
+    self.queued = []
+
+  def Commit(self):
+    """Send the queued commands, and report the errors they had.
+
+    Errors of a message with several commands are tied to their commands
+    by sending halves of it again, with an error check after each, down
+    to single commands. Only commands of messages with errors are sent
+    again, and never reset commands.
+
+    Raises:
+      TransactionError if there were errors.
+    """
+    self.Flush()
+    if not self.failed:
+      return
+    inst = self._instrument
+    found = []
+    for message, commands, errors in self.failed:
+      if len(commands) == 1:
+        found.extend([(commands[0], err) for err in errors])
+        continue
+      commands = [cmd for cmd in commands if not inst._IsReset(cmd)]
+      located = self._Locate(commands, False)
+      if not located: # not repeatable
+        located = [(message, err) for err in errors]
+      found.extend(located)
+    raise TransactionError(found)
+
+  def _Locate(self, commands, send=True):
+    """Find the commands with errors by sending them again, halving.
+
+    If send is false, the commands are known to have errors, so only
+    their halves are sent.
+    """
+    if not commands:
+      return []
+    if send:
+      inst = self._instrument
+      for message in JoinCommands(commands, self.maxlength):
+        _gpib.write(inst._id, message)
+      errors = inst.Errors()
+      if not errors:
+        return []
+      if len(commands) == 1:
+        return [(commands[0], err) for err in errors]
+    half = len(commands) // 2
+    return self._Locate(commands[:half]) + self._Locate(commands[half:])
+
+
+def _JoinGroups(commands, maxlength):
+  """Like JoinCommands, but yields (message, commands in it) tuples."""
+  current = ""
+  group = []
+  for command in commands:
+    stripped = command.strip()
+    if not stripped:
+      continue
+    if not current:
+      current = stripped
+      group = [command]
+      continue
+    if stripped[0] in "*:":
+      joined = "%s;%s" % (current, stripped)
+    else:
+      joined = "%s;:%s" % (current, stripped)
+    if len(joined) > maxlength:
+      yield current, group
+      current = stripped
+      group = [command]
+    else:
+      current = joined
+      group.append(command)
+  if current:
+    yield current, group
+
+
+def JoinCommands(commands, maxlength):
+  """Join SCPI commands into messages of at most maxlength bytes.
+
+  Each command is full path, so is sent after ";:" to go back to the root
+  of the command tree, except common ("*") commands. A command longer than
+  maxlength is sent alone.
+
+  Returns:
+    list of message strings.
+  """
+  return [message for message, group in _JoinGroups(commands, maxlength)]
+
+
 class GpibDevice(object):
   """Abstract base class for all GPIB device nodes."""
   _id = None # in case _gpib.find throws exception in constructor.
@@ -109,14 +789,21 @@ class GpibDevice(object):
     """A device on a GPIB/IEEE-488.1 bus.
 
     The context must have an attribute "gpibname", matching a name in the
-    /etc/gpib.conf file.
+    /etc/gpib.conf file. Or, a "simulator" attribute naming a simulated
+    instrument (see droid.instruments.simulators).
     """
     if devspec is not None:
-      self._id = _gpib.ibdev(devspec.gpibboard, devspec.gpibpad)
+      if devspec.get("simulator"):
+        from droid.instruments import simulators
+        self._id = _gpib.Attach(simulators.GetSimulator(devspec))
+      else:
+        self._id = _gpib.ibdev(devspec.gpibboard, devspec.gpibpad)
+      self._device = _GetDeviceState(devspec)
       self._set_timeout(T3s)
       self.Initialize(devspec, **kwargs)
     else:
       self._id = None
+      self._device = DeviceState() # a clone gets the device's.
     self._gpib_module = _gpib # hold a ref here to make GC at exit cleaner.
 
   def __del__(self):
@@ -146,6 +833,9 @@ class GpibDevice(object):
     inst = subinstrument(None)
     inst._id = self._id
     inst._timeout = self._timeout
+    inst._device = self._device # same device format
+    inst._errorcheck = getattr(self, "_errorcheck", ERRORCHECK_QUERY)
+    inst._eventmask = getattr(self, "_eventmask", 0)
     inst.close = aid.NULL # Don't allow clones/subinstruments to close descriptor.
     return inst
 
@@ -201,12 +891,15 @@ class GpibController(GpibDevice):
   def clear(self):
     """Assert IFC on the bus to reset the GPIB bus."""
     _gpib.ifc(self._id)
+    _NewBusGeneration()
 
   def remote_enable(self):
     _gpib.ren(self._id, 1)
+    _NewBusGeneration()
 
   def remote_disable(self):
     _gpib.ren(self._id, 0)
+    _NewBusGeneration()
 
   def SendCommands(self, commands):
     _gpib.cmd(self._id, commands)
@@ -230,6 +923,20 @@ class GpibController(GpibDevice):
 
 
 class GpibInstrument(GpibDevice):
+  _transaction = None # the open Transaction, if any.
+  _transactiondepth = 0
+  MAXMESSAGE = 256 # bytes per message in a transaction (see Begin).
+  _statecache = property(lambda self: self._device.statecache)
+  # Setting queries whose responses may be kept in the state cache, by
+  # header. The value is a function that takes the argument of a write to
+  # that header, and returns the response a query would then get. If it
+  # is None, a write just removes the cached response.
+  STATE_QUERIES = {}
+  # Commands that set all settings.
+  RESET_COMMANDS = ("*RST", "*RCL", "SYST:PRES", "SYSTEM:PRESET")
+  ERRORCHECK = ERRORCHECK_QUERY # default for the class (see SetErrorCheck).
+  _errorcheck = ERRORCHECK_QUERY
+  _eventmask = 0 # *ESE setting, other than during StartOperation.
 
   completed = property(lambda self: _gpib.ibsta() & CMPL)
   end = property(lambda self: _gpib.ibsta() & END)
@@ -237,13 +944,184 @@ class GpibInstrument(GpibDevice):
   error = property(lambda self: _gpib.ibsta() & ERR)
   servicerequest = property(lambda self: _gpib.ibsta() & RQS)
 
+  def __init__(self, devspec, **kwargs):
+    """A SCPI instrument on the GPIB bus.
+
+    If the device spec has a "binarytransfer" attribute of 32 or 64, array
+    responses are sent in binary of that size (see SetBinaryTransfer).
+    An "errorcheck" attribute selects the Errors strategy (see
+    SetErrorCheck).
+    """
+    super(GpibInstrument, self).__init__(devspec, **kwargs)
+    if devspec is not None and devspec.get("binarytransfer"):
+      self.SetBinaryTransfer(True, devspec.binarytransfer)
+    if devspec is not None and devspec.get("maxmessage"):
+      self.MAXMESSAGE = int(devspec.maxmessage)
+    if devspec is not None and devspec.get("statecache"):
+      self.EnableStateCache()
+    if devspec is not None: # clones get the device's from Clone.
+      errorcheck = devspec.get("errorcheck") or self.ERRORCHECK
+      if errorcheck != ERRORCHECK_QUERY:
+        self.SetErrorCheck(errorcheck)
+
+  # state cache
+  def EnableStateCache(self, enable=True):
+    """Keep the settings in STATE_QUERIES, so their getters need not
+    query the instrument. Setters write through the cache.
+
+    The cache is the device's, so every object using the device (see
+    DeviceState) updates and clears it.
+    """
+    device = self._device
+    if enable:
+      if device.statecache is None:
+        device.statecache = StateCache()
+    else:
+      device.statecache = None
+
+  statecache = property(lambda self: self._statecache,
+      doc="The StateCache, with counters of hits and misses, or None.")
+
+  def InvalidateState(self):
+    """Forget the cached settings."""
+    if self._statecache is not None:
+      self._statecache.Clear()
+
+  def _IsReset(self, string):
+    """True if a write has a command in RESET_COMMANDS."""
+    for command in string.split(";"):
+      header = command.strip().lstrip(":").upper()
+      for reset in self.RESET_COMMANDS:
+        if header.startswith(reset):
+          return True
+    return False
+
+  def _WriteState(self, string):
+    cache = self._statecache
+    if ";" in string and ('"' in string or "'" in string):
+      cache.Clear() # a string argument may hold a ';'.
+      return
+    path = "" # a header after ';' is relative to the previous one's.
+    for command in string.split(";"):
+      command = command.strip()
+      if command.startswith(":"):
+        command = command.lstrip(":")
+        path = ""
+      if not command:
+        continue
+      parts = command.split(None, 1)
+      header = parts[0].upper()
+      if not header.startswith("*"):
+        header = path + header
+        path = header[:header.rfind(":") + 1]
+      if header.endswith("?"):
+        continue
+      for reset in self.RESET_COMMANDS:
+        if header.startswith(reset):
+          cache.Clear()
+          break
+      else:
+        # a clone may have cached a header this class does not know.
+        convert = self.STATE_QUERIES.get(header)
+        if convert is None or len(parts) < 2:
+          cache.Remove(header)
+        else:
+          try:
+            cache.Put(header, convert(parts[1].strip()))
+          except ValueError:
+            cache.Remove(header)
+
+  # transactions
+  def Begin(self):
+    """Start a transaction.
+
+    Until the matching Commit, writes are queued and sent later, joined
+    into a few messages, and CheckErrors does nothing. Reads send the
+    queued writes first, so they still see their effects. Transactions
+    may be nested; only the outermost Commit sends and checks.
+
+    Use like this:
+      inst.Begin()
+      try:
+        inst.SetVoltage(3.8)
+        ...
+      except:
+        inst.Abort()
+        raise
+      inst.Commit()
+    """
+    if self._transaction is None:
+      self._transaction = Transaction(self, self.MAXMESSAGE)
+    self._transactiondepth += 1
+
+  def Commit(self):
+    """End a transaction. Send the queued writes, and check for errors.
+
+    Raises:
+      TransactionError, with the commands that had errors.
+    """
+    if self._transaction is None:
+      raise GpibError("Commit without Begin.")
+    self._transactiondepth -= 1
+    if self._transactiondepth > 0:
+      return
+    transaction = self._transaction
+    self._transaction = None
+    transaction.Commit()
+
+  def Abort(self):
+    """End all transactions, dropping writes not yet sent.
+
+    The state cache has the dropped writes, so it is cleared.
+    """
+    if self._transaction is not None:
+      if self._transaction.queued:
+        self.InvalidateState()
+      self._transaction.Discard()
+    self._transaction = None
+    self._transactiondepth = 0
+
+  intransaction = property(lambda self: self._transaction is not None)
+
+  def _Flush(self):
+    if self._device.request is not None:
+      self._device.request.complete()
+    if self._transaction is not None:
+      self._transaction.Flush()
+
+  def write(self, string):
+    if self._statecache is not None:
+      self._WriteState(string)
+    if self._transaction is None:
+      if self._device.request is not None: # don't interrupt the query.
+        self._device.request.complete()
+      _gpib.write(self._id, string)
+    else:
+      self._transaction.Add(string)
+
+  def read(self, len=4096):
+    self._Flush()
+    return _gpib.read(self._id, len)
+
+  def readbin(self, len=4096):
+    self._Flush()
+    return _gpib.readbin(self._id, len)
+
   def Prepare(self, measurecontext):
     return 0.05 # default (only bus transer time)
 
   # basic interface wrapper
   def clear(self):
     """Sends the clear command to the device."""
+    self._Flush()
     _gpib.clear(self._id)
+    self.InvalidateState()
+
+  def local(self):
+    """Return the device to local (front panel) control."""
+    self._Flush()
+    _gpib.loc(self._id)
+    self.InvalidateState()
 
   def wait(self):
     _gpib.wait(self._id, RQS)
@@ -254,52 +1132,240 @@ class GpibInstrument(GpibDevice):
 
   def trigger(self):
     """Sends a GET (group execute trigger) command to the device."""
+    self._Flush()
     _gpib.trg(self._id)
 
   def fetch(self, string, length=65536):
+    cache = self._statecache
+    if cache is not None:
+      header = _GetQueryHeader(string)
+      if header in self.STATE_QUERIES:
+        value = cache.Get(header)
+        if value is None:
+          self._Flush()
+          value = _gpib.fetch(self._id, length, string).strip()
+          cache.Put(header, value)
+        return value
+    self._Flush()
     return _gpib.fetch(self._id, length, string)
   ask = fetch # Deprecated method name, this is a alias that will eventually be removed.
 
   def send(self, string):
+    self._Flush()
+    if self._statecache is not None:
+      self._WriteState(string)
     _gpib.wait(self._id, CMPL)
     _gpib.writea(self._id, string)
 
   def receive(self, length=65536):
+    self._Flush()
     _gpib.wait(self._id, CMPL)
     return _gpib.readbin(self._id, length)
 
+  def begin_ask(self, string, length=65536, callback=None):
+    """Send a query, and return at once, without the response.
+
+    The device may have one outstanding query. Any other use of it, by
+    this or another object opened on its address, first completes that
+    one.
+
+    Args:
+      string (string): the query.
+      length (int): largest response to read.
+      callback (callable, optional): called with the response string,
+      when complete.
+
+    Returns:
+      an AsyncRequest. Get the response with its complete method, this
+      instrument's complete method, or CompleteAll for several at once.
+    """
+    cache = self._statecache
+    if cache is not None:
+      header = _GetQueryHeader(string)
+      if header in self.STATE_QUERIES:
+        value = cache.Get(header)
+        if value is not None:
+          return _CompletedRequest(string, value, callback)
+    self._Flush()
+    _gpib.write(self._id, string)
+    request = self._device.request = AsyncRequest(self, string, length,
+        callback)
+    return request
+
+  def complete(self):
+    """Complete the outstanding query (see begin_ask).
+
+    Returns:
+      the response string.
+    """
+    request = self._device.request
+    if request is None:
+      raise GpibError("No query to complete.")
+    return request.complete()
+
   def read_values(self, length=65536):
-    text = _gpib.readbin(self._id, length)
+    """Read an array response.
+
+    Returns:
+      array of floats. With binary transfer enabled (see
+      SetBinaryTransfer), a numpy float64 array.
+    """
+    blocktype = self._device.blocktype
+    if blocktype is not None:
+      return DecodeBlock(self.read_block(length), blocktype)
+    text = self.readbin(length)
     arr = array.array("d")
     for valstring in text.split(","):
       arr.append(core.ValueCheck(valstring))
     return arr
 
+  def read_block(self, length=65536):
+    """Read a response holding an IEEE-488.2 binary block.
+
+    Reads until the whole block has arrived, even if it is larger than
+    length.
+
+    Returns:
+      the response string, with header.
+    """
+    data = self.readbin(length)
+    try:
+      headerlength, blocklength = GetBlockLength(data)
+    except ValueError:
+      if len(data) >= 12: # a header is at most 11 bytes.
+        raise
+      data += self.readbin(length)
+      headerlength, blocklength = GetBlockLength(data)
+    if blocklength is None:
+      while not self.end:
+        data += self.readbin(length)
+      return data
+    parts = [data]
+    got = len(data)
+    needed = headerlength + blocklength
+    while got < needed:
+      part = self.readbin(max(length, needed - got))
+      if not part:
+        raise GpibError("Binary block ended after %d of %d bytes." % (
+            got - headerlength, blocklength))
+      parts.append(part)
+      got += len(part)
+    return "".join(parts)
+
+  def SetBinaryTransfer(self, enable=True, size=64):
+    """Select binary (FORM REAL) or ASCII array responses.
+
+    The format is the device's, so it changes for every object using the
+    device. In a transaction, the FORM commands are sent at once, with
+    the writes queued before them, and errors are checked at Commit.
+
+    Args:
+      enable (bool): use binary blocks if true, else ASCII.
+      size (int): 32 or 64, the bits per value. Single precision halves
+      the bus time, but keeps only about 7 digits.
+    """
+    if enable:
+      try:
+        blocktype = BLOCK_TYPES[int(size)]
+      except (KeyError, ValueError):
+        raise ValueError("Binary transfer size must be 32 or 64, not %r." %
+            (size,))
+      self.write("FORM REAL,%d" % (int(size),))
+      self.write("FORM:BORD NORM")
+    else:
+      blocktype = None
+      self.write("FORM ASC")
+    self._Flush() # so an Abort can't drop them.
+    self.CheckErrors()
+    self._device.blocktype = blocktype
+
+  def GetBinaryTransfer(self):
+    """The bits per value of binary transfer, or 0 if it is not enabled."""
+    blocktype = self._device.blocktype
+    if blocktype is None:
+      return 0
+    return blocktype.itemsize * 8
+
+  binary = property(GetBinaryTransfer)
+
   def identify(self):
     return core.Identity(self.fetch("*IDN?", 1024))
 
   def Reset(self):
     self.clear()
     self.write("*RST")
+    self._ResetFormat()
+
+  def _ResetFormat(self):
+    """Set binary transfer again, after a *RST set ASCII."""
+    if self._device.blocktype is not None:
+      self.write("FORM REAL,%d" % (self.GetBinaryTransfer(),))
+      self.write("FORM:BORD NORM")
 
   def GetError(self):
     errs = self.fetch("SYST:ERR?", 4096)
     code, string = errs.split(",", 1)
     return core.DeviceError(int(code), string.strip()[1:-1])
 
+  def SetErrorCheck(self, errorcheck):
+    """Select how Errors finds out if there are errors.
+
+    ERRORCHECK_QUERY reads the error queue (SYST:ERR?) until it is empty,
+    which is one query when there are none. ERRORCHECK_POLL enables the
+    error bits of the event status register (*ESE), and then serial polls
+    first: the queue is only read if the status byte has the error
+    available (EAV) or event status (ESB) bit set. A serial poll takes
+    much less time than a query.
+
+    Anything else writing *ESE (other than StartOperation), or a power
+    cycle, stops the poll from seeing errors.
+    """
+    if errorcheck not in ERRORCHECKS:
+      raise ValueError("Error check must be one of %s, not %r." % (
+          ", ".join(ERRORCHECKS), errorcheck))
+    self._Flush()
+    if errorcheck == ERRORCHECK_POLL:
+      self._eventmask = ESR_ERRORS
+    else:
+      self._eventmask = 0
+    _gpib.write(self._id, "*ESE %d" % (self._eventmask,))
+    self._ReadErrors() # start with the event register and queue empty.
+    self._errorcheck = errorcheck
+
+  def GetErrorCheck(self):
+    return self._errorcheck
+
+  errorcheck = property(GetErrorCheck, SetErrorCheck)
+
   def Errors(self):
     """Return a list of all queued errors from the device.
 
     The side effect is the instrument's error queue is emptied.
     """
+    if self._errorcheck == ERRORCHECK_POLL:
+      if not self.poll() & (EAV | ESB):
+        return []
+    return self._ReadErrors()
+
+  def _ReadErrors(self):
+    if self._eventmask:
+      self.fetch("*ESR?") # clear the event bits first, so new ones show.
     rv = []
     err = self.GetError()
     while err.code != 0:
       rv.append(err)
       err = self.GetError()
+    if rv: # a setting may not have been made.
+      self.InvalidateState()
     return rv
 
   def CheckErrors(self):
+    """Raise GpibError if the instrument has errors queued.
+
+    In a transaction, errors are checked at Commit instead.
+    """
+    if self._transaction is not None:
+      return
     errors = self.Errors()
     if errors:
       raise GpibError, errors
@@ -311,14 +1377,75 @@ class GpibInstrument(GpibDevice):
   def Options(self):
     return self.fetch("*OPT?").split(",")
 
-  def WaitToComplete(self):
-    oto = self.timeout
-    self.timeout = T300s
-    try:
-      val = self.fetch("*OPC?")
-    finally:
-      self.timeout = oto
-    return self.Errors()
+  def StartOperation(self, command=None, timeout=T300s, callback=None):
+    """Send a command, and have the instrument request service when it
+    and all other pending operations are done.
+
+    Sets up the event status enable (*ESE) and service request enable
+    (*SRE) registers so that the *OPC sent after the command raises SRQ.
+    The event status register is cleared first, but not the error queue.
+
+    Args:
+      command (string, optional): the command starting the operation.
+      Default is to wait for operations already started.
+      timeout (TIMEOUTS): how long the operation may take.
+      callback (callable, optional): called with the list of instrument
+      errors, when complete.
+
+    Returns:
+      a Completion.
+    """
+    self._Flush()
+    _gpib.fetch(self._id, 64, "*ESR?")
+    commands = ["*ESE %d" % OPC, "*SRE %d" % ESB]
+    if command:
+      if self._statecache is not None:
+        self._WriteState(command)
+      commands.append(command)
+    commands.append("*OPC")
+    for message in JoinCommands(commands, self.MAXMESSAGE):
+      _gpib.write(self._id, message)
+    return Completion(self, command, timeout, callback)
+
+  def StartStatusWait(self, summary, finish, command=None, timeout=T300s,
+      callback=None):
+    """Send a command, and have the instrument request service when
+    status byte bits are set.
+
+    For an end that *OPC does not show, which the instrument's SCPI status
+    registers have been set up to sum up to the status byte, usually in
+    the operation status summary (OSS).
+
+    Args:
+      summary (int): the status byte bits (for *SRE).
+      finish (string): a query that clears the events summed up, such as
+      the event registers' EVENt? queries, sent when complete. Its
+      response is the Completion's status.
+      command (string, optional): the command starting the operation.
+      timeout (TIMEOUTS): how long the operation may take.
+      callback (callable, optional): called with the list of instrument
+      errors, when complete.
+
+    Returns:
+      a Completion.
+    """
+    self._Flush()
+    commands = ["*SRE %d" % summary]
+    if command:
+      if self._statecache is not None:
+        self._WriteState(command)
+      commands.append(command)
+    for message in JoinCommands(commands, self.MAXMESSAGE):
+      _gpib.write(self._id, message)
+    return Completion(self, command, timeout, callback, summary, finish)
+
+  def WaitToComplete(self, timeout=T300s):
+    """Wait for pending operations to finish.
+
+    Returns:
+      the list of instrument errors.
+    """
+    return self.StartOperation(None, timeout).Wait()
 
   def _set_SRE(self, val):
     self.write("*SRE %d" % int(val))
@@ -6,6 +6,8 @@
 
 """Mock instruments used for unit testing.
 
+For instruments that keep state and take time, to run and profile whole
+measurements, see the simulators module.
 """
 
 
@@ -18,6 +18,16 @@ class PowerSupply(gpib.GpibInstrument):
   WINDOW_HANNING = "HANN"
   WINDOW_RECTANGLE = "RECT"
 
+  STATE_QUERIES = {
+    "SENS:WIND": gpib.SameValue,
+    "SOUR:VOLT": gpib.NumericValue,
+    "SOUR:VOLT2": gpib.NumericValue,
+    "OUTP1:STAT": gpib.BooleanValue,
+    "OUTP2:STAT": gpib.BooleanValue,
+    "SENS:CURR:RANG": None, # the instrument picks the range.
+    "SENS:CURR:DET": gpib.SameValue,
+  }
+
   def SetWindow(self, wind):
     self.write("SENS:WIND %s" % wind.upper())
     self.CheckErrors()
@@ -29,7 +39,9 @@ class PowerSupply(gpib.GpibInstrument):
 
   def Reset(self):
     self.clear()
-    self.write("*RST; :STATUS:PRESET; *CLS; *SRE 0; *ESE 0")
+    self.write("*RST; :STATUS:PRESET; *CLS; *SRE 0; *ESE %d" % (
+        self._eventmask,))
+    self._ResetFormat()
 
   def SetVoltage(self, voltage):
     self.write("SOUR:VOLT %sV" % float(voltage))
@@ -94,6 +106,13 @@ class PowerSupply(gpib.GpibInstrument):
   def MeasureDCVoltage(self):
     return core.GetUnit(self.ask("MEAS:VOLT?"), "V")
 
+  def BeginMeasureDCVoltage(self, callback):
+    """Start MeasureDCVoltage without waiting for it (see begin_ask). The
+    callback gets the voltage.
+    """
+    return self.begin_ask("MEAS:VOLT?",
+        callback=lambda resp: callback(core.GetUnit(resp, "V")))
+
   def MeasureDCCurrent(self):
     return core.GetUnit(self.ask("MEAS:CURR?"), "A")
 
@@ -198,6 +217,13 @@ class PowerSupply(gpib.GpibInstrument):
     resp = self.ask('MEAS:CURR:ACDC?;:FETC:CURR:LOW?;HIGH?;MIN?;MAX?')
     return resp.split(";")
 
+  def BeginMeasureAllCurrentAsText(self, callback):
+    """Start MeasureAllCurrentAsText without waiting for it (see
+    begin_ask). The callback gets the list of readings.
+    """
+    return self.begin_ask('MEAS:CURR:ACDC?;:FETC:CURR:LOW?;HIGH?;MIN?;MAX?',
+        callback=lambda resp: callback(resp.split(";")))
+
   def MeasureAllDCCurrentAsText(self):
     """Return electric current reading using DC detector.
 
@@ -236,14 +262,20 @@ class Ag66319D(PowerSupply):
     assert myctx.subsampleinterval >= 15.6e-6
     self.clear()
     self.timeout = myctx.timeout
-    self.SetVoltage(myctx.voltage)
-    self.On()
-    self.ChargerOn()
-    self.SetDetector(myctx.detector)
-    self.SetCurrentRange(myctx.maxcurrent)
-    self.SetWindow(myctx.window)
-    self.write("SENS:SWE:POIN %s" % myctx.subsamples)
-    self.write("SENS:SWE:TINT %.2E" % myctx.subsampleinterval)
+    self.Begin() # send the settings in a few messages, check errors once.
+    try:
+      self.SetVoltage(myctx.voltage)
+      self.On()
+      self.ChargerOn()
+      self.SetDetector(myctx.detector)
+      self.SetCurrentRange(myctx.maxcurrent)
+      self.SetWindow(myctx.window)
+      self.write("SENS:SWE:POIN %s" % myctx.subsamples)
+      self.write("SENS:SWE:TINT %.2E" % myctx.subsampleinterval)
+    except:
+      self.Abort()
+      raise
+    self.Commit()
     samps = myctx.subsamples
     # XXX needs work. non-linear. calibrated to 4096 samples.
     return (samps * myctx.subsampleinterval) + (samps * 1.85e-5)
@@ -267,6 +299,13 @@ class Ag66319dDVM(gpib.GpibInstrument):
   def MeasureDCVoltage(self):
     return core.GetUnit(self.ask("MEAS:DVM:DC?"), "V")
 
+  def BeginMeasureDCVoltage(self, callback):
+    """Start MeasureDCVoltage without waiting for it (see begin_ask). The
+    callback gets the voltage.
+    """
+    return self.begin_ask("MEAS:DVM:DC?",
+        callback=lambda resp: callback(core.GetUnit(resp, "V")))
+
   def MeasureACDCVoltage(self):
     return core.GetUnit(self.ask("MEAS:DVM:ACDC?"), "V")
 
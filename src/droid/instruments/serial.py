@@ -35,12 +35,16 @@ class SerialInstrument(object):
   _exp = None
 
   def __init__(self, devspec, logfile=None, **kwargs):
-    fo = tty.SerialPort(devspec.port)
-    fo.set_serial(devspec.serial)
     self._timeout = devspec.get("timeout", 30.0)
-    self._exp = expect.Expect(fo, prompt=devspec.prompt,
-        timeout=self._timeout,
-        logfile=logfile)
+    if devspec.get("simulator"): # see droid.instruments.simulators
+      from droid.instruments import simulators
+      self._exp = simulators.GetSimulator(devspec)
+    else:
+      fo = tty.SerialPort(devspec.port)
+      fo.set_serial(devspec.serial)
+      self._exp = expect.Expect(fo, prompt=devspec.prompt,
+          timeout=self._timeout,
+          logfile=logfile)
     self.Initialize(devspec, **kwargs)
 
   def __del__(self):
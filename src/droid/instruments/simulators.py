@@ -0,0 +1,1253 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Simulated instruments, for running and profiling measurements without
+the instruments.
+
+A simulator takes the place of an instrument below its driver: a GPIB
+instrument at the _gpib call level (see gpib._GpibBus), the Fluke 45 at
+its serial port. So the driver classes, with their transactions, state
+caches, binary transfers and error checks, run just as they do with the
+real instruments. A simulator keeps the settings written to it, has an
+error queue and status registers, makes up measurements, and takes time
+to answer, from a latency model.
+
+Select one by adding a "simulator" attribute, the name of a simulator in
+SIMULATORS, to an instrument's entry in powerdroid.conf. Entries with
+the same simulator and address (gpibpad) share one instrument, as the
+power supply and its DVM do. These optional attributes set the latency
+model, in seconds:
+
+  latency: time of each bus transfer, message or response.
+  perbyte: additional time per byte transferred.
+  jitter: standard deviation of a random additional time per transfer.
+  polltime: time of a serial poll.
+  measuretime: time a measurement takes, beside any sweep.
+  seed: random seed, for repeatable runs.
+
+For example:
+
+  "ps1": AttrDict(
+        object="droid.instruments.powersupply.Ag66319D",
+        simulator="Ag66319D", gpibpad=7,
+        latency=0.002, jitter=0.0005, current=0.15),
+
+The simulators' own attributes are in their class documentation.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import re
+import time
+import random
+import threading
+
+import numpy
+
+from droid.instruments import gpib
+
+
+DEFAULT_LATENCY = 0.002
+DEFAULT_PERBYTE = 2e-6 # about 500 kB/s
+DEFAULT_POLLTIME = 0.0003
+SERIAL_PERBYTE = 1.0 / 960 # 9600 baud
+
+# standard event status register bits, by error class.
+QYE = 0x04 # query error
+DDE = 0x08 # device dependent error
+EXE = 0x10 # execution error
+CME = 0x20 # command error
+
+NAN = 9.91e37 # what SCPI instruments send for "not a number".
+
+
+class LatencyModel(object):
+  """The time simulated instruments take.
+
+  Args:
+    latency (float): seconds of each bus transfer.
+    perbyte (float): additional seconds per byte transferred.
+    jitter (float): standard deviation of random additional seconds. A
+    delay is never negative.
+    seed (optional): random seed.
+  """
+  def __init__(self, latency=DEFAULT_LATENCY, perbyte=DEFAULT_PERBYTE,
+      jitter=0.0, seed=None):
+    self.latency = float(latency)
+    self.perbyte = float(perbyte)
+    self.jitter = float(jitter)
+    self._random = random.Random(seed)
+    self.elapsed = 0.0 # total of the delays, in seconds.
+
+  def GetDelay(self, nbytes=0, extra=0.0):
+    delay = self.latency + nbytes * self.perbyte + extra
+    if self.jitter:
+      delay += self._random.gauss(0.0, self.jitter)
+    return max(delay, 0.0)
+
+  def Delay(self, nbytes=0, extra=0.0):
+    """Sleep for one transfer of nbytes, plus extra seconds."""
+    delay = self.GetDelay(nbytes, extra)
+    self.elapsed += delay
+    time.sleep(delay)
+
+
+def _GetLatencyModel(devspec, perbyte):
+  return LatencyModel(devspec.get("latency", DEFAULT_LATENCY),
+      devspec.get("perbyte", perbyte), devspec.get("jitter", 0.0),
+      devspec.get("seed"))
+
+
+class SCPIError(Exception):
+  """An error for the error queue. Arguments are the code and message."""
+
+
+# parsing
+
+_NODE_RE = re.compile(r"^([A-Za-z_]+)(\d*)$")
+
+
+def GetShortNode(node):
+  """The short form of a header node, as in "VOLTage" -> "VOLT".
+
+  A numeric suffix of 1 is the same as none, so is dropped.
+  """
+  mo = _NODE_RE.match(node)
+  if mo is None:
+    return node.upper()
+  name = mo.group(1).upper()
+  suffix = mo.group(2)
+  if len(name) > 4:
+    if name[3] in "AEIOU":
+      name = name[:3]
+    else:
+      name = name[:4]
+  if suffix == "1":
+    suffix = ""
+  return name + suffix
+
+
+def GetShortHeader(header):
+  """The short form of a full header path, without the leading colon."""
+  if header.startswith("*"):
+    return header.upper()
+  return ":".join([GetShortNode(node) for node in
+      header.lstrip(":").split(":")])
+
+
+def ShortHeaders(table):
+  """Copy of a dictionary, with the headers it is keyed by in short form."""
+  rv = {}
+  for header, value in table.items():
+    rv[GetShortHeader(header)] = value
+  return rv
+
+
+def SplitMessage(message):
+  """Split a SCPI program message into its commands.
+
+  A command not starting with a colon is relative to the path of the one
+  before it in the message, as in "FETC:CURR:HIGH?;LOW?".
+
+  Returns:
+    list of (header, argument, query) tuples. The header is the full
+    path in short form, the argument a string, empty if there is none,
+    and query is true for a query.
+  """
+  rv = []
+  path = []
+  for unit in _SplitUnits(message):
+    unit = unit.strip()
+    if not unit:
+      continue
+    parts = unit.split(None, 1)
+    header = parts[0]
+    if len(parts) > 1:
+      argument = parts[1].strip()
+    else:
+      argument = ""
+    query = header.endswith("?")
+    if query:
+      header = header[:-1]
+    if header.startswith("*"):
+      rv.append((header.upper(), argument, query))
+      continue
+    if header.startswith(":"):
+      nodes = header[1:].split(":")
+    else:
+      nodes = path + header.split(":")
+    nodes = [GetShortNode(node) for node in nodes]
+    path = nodes[:-1]
+    rv.append((":".join(nodes), argument, query))
+  return rv
+
+
+def _SplitUnits(message):
+  """Split on semicolons, except in quoted strings."""
+  if '"' not in message and "'" not in message:
+    return message.split(";")
+  units = []
+  current = []
+  quote = None
+  for c in message:
+    if quote:
+      if c == quote:
+        quote = None
+    elif c in "\"'":
+      quote = c
+    elif c == ";":
+      units.append("".join(current))
+      current = []
+      continue
+    current.append(c)
+  units.append("".join(current))
+  return units
+
+
+# argument converters, for SETTINGS. Each takes the argument of a command,
+# and returns the response a query of the setting then gets.
+
+_UNIT_RE = re.compile(r"[A-Za-z]*$")
+
+
+def Numeric(low, high):
+  """Converter for a number from low to high. A unit suffix is ignored."""
+  def _Convert(argument):
+    value = argument.strip()
+    upper = value.upper()
+    if upper in ("MIN", "MINIMUM"):
+      value = low
+    elif upper in ("MAX", "MAXIMUM"):
+      value = high
+    else:
+      value = float(_UNIT_RE.sub("", value))
+    if value < low or value > high:
+      raise SCPIError(-222, "Data out of range")
+    return FormatNumber(value)
+  return _Convert
+
+
+def Integer(low, high):
+  """Converter for an integer from low to high."""
+  def _Convert(argument):
+    value = int(float(argument))
+    if value < low or value > high:
+      raise SCPIError(-222, "Data out of range")
+    return "%+d" % (value,)
+  return _Convert
+
+
+def Boolean(argument):
+  value = argument.strip().upper()
+  if value in ("1", "ON"):
+    return "1"
+  if value in ("0", "OFF"):
+    return "0"
+  raise ValueError(argument)
+
+
+def Choice(*choices):
+  """Converter for one of some keywords. A short form of one will do."""
+  def _Convert(argument):
+    value = argument.strip().upper()
+    for choice in choices:
+      if choice.startswith(value) and len(value) >= min(3, len(choice)):
+        return choice
+    raise ValueError(argument)
+  return _Convert
+
+
+def FormatNumber(value):
+  return "%+.5E" % (value,)
+
+
+class SimulatedInstrument(object):
+  """Base class of simulated SCPI instruments on the GPIB bus.
+
+  Its methods, other than the CamelCase ones, are the _gpib functions of
+  the same name, without the descriptor.
+
+  Subclasses list what they understand, by header (short forms are made
+  at class definition by ShortHeaders):
+    SETTINGS: header: (default response, converter). The converter
+    takes a command's argument, and returns the response a query then
+    gets. It raises ValueError (or SCPIError) for a bad argument. A
+    converter of None takes any argument.
+    COMMANDS: header: name of a method called with the argument.
+    QUERIES: header: name of a method called with the argument, that
+    returns the response.
+    ALIASES: header: the header it is the same as, for optional nodes.
+  A command that is none of these gets an "Undefined header" error, or,
+  if STORE_ANY is true, is kept as a setting that it may then query.
+
+  The methods may call Busy(seconds), to take that long before answering
+  or taking another command, or Pending(seconds), for an overlapped
+  operation that sets the operation complete bit (for *OPC) when done.
+  """
+  IDENTITY = "Simulated,Instrument,0,0"
+  OPTIONS = "0"
+  MAXERRORS = 30
+  PERBYTE = DEFAULT_PERBYTE
+  MEASURETIME = 0.0
+  STORE_ANY = False
+  SETTINGS = {}
+  ALIASES = {}
+  COMMANDS = {
+    "*RST": "_Reset",
+    "*CLS": "_ClearStatus",
+    "*ESE": "_SetESE",
+    "*SRE": "_SetSRE",
+    "*OPC": "_ArmOPC",
+    "*WAI": "_WaitPending",
+    "*TRG": "_Nothing",
+    "STAT:PRES": "_Nothing",
+  }
+  QUERIES = {
+    "*IDN": "_Identify",
+    "*OPT": "_Options",
+    "*ESE": "_GetESE",
+    "*SRE": "_GetSRE",
+    "*ESR": "_GetESR",
+    "*STB": "_GetSTB",
+    "*OPC": "_QueryOPC",
+    "SYST:ERR": "_GetError",
+  }
+
+  def __init__(self, devspec):
+    self.model = _GetLatencyModel(devspec, self.PERBYTE)
+    self.polltime = float(devspec.get("polltime", DEFAULT_POLLTIME))
+    self.measuretime = float(devspec.get("measuretime", self.MEASURETIME))
+    self.random = numpy.random.RandomState(devspec.get("seed"))
+    self.timeout = 3.0
+    self._lock = threading.Lock() # one call at a time, as on the bus.
+    self._status = threading.local() # ibsta and ibcnt, per thread.
+    self.errors = []
+    self.esr = 0
+    self.ese = 0
+    self.sre = 0
+    self.output = ""
+    self._busyuntil = 0.0
+    self._pendinguntil = 0.0
+    self._opcarmed = False
+    self.settings = {}
+    self.Reset()
+
+  def Reset(self):
+    """Set the settings to their defaults."""
+    self.settings.clear()
+    for header, (default, convert) in self.SETTINGS.items():
+      self.settings[header] = default
+
+  # the error queue and status registers
+  def AddError(self, code, message):
+    if len(self.errors) >= self.MAXERRORS:
+      self.errors[-1] = (-350, "Queue overflow")
+    else:
+      self.errors.append((code, message))
+    if -200 < code <= -100:
+      self.esr |= CME
+    elif -300 < code <= -200:
+      self.esr |= EXE
+    elif -500 < code <= -400:
+      self.esr |= QYE
+    else:
+      self.esr |= DDE
+
+  def GetStatusByte(self):
+    now = time.time()
+    if self._opcarmed and now >= max(self._busyuntil, self._pendinguntil):
+      self._opcarmed = False
+      self.esr |= gpib.OPC
+    stb = 0
+    if self.errors:
+      stb |= gpib.EAV
+    if self.output and now >= self._busyuntil:
+      stb |= gpib.MAV
+    if self.esr & self.ese:
+      stb |= gpib.ESB
+    if stb & self.sre:
+      stb |= gpib.MSS
+    return stb
+
+  def Busy(self, seconds):
+    """Take seconds more before answering, or taking another command."""
+    self._busyuntil = max(self._busyuntil, time.time()) + seconds
+
+  def Pending(self, seconds):
+    """Start an overlapped operation that takes seconds."""
+    self._pendinguntil = max(self._pendinguntil, time.time() + seconds)
+
+  # executing messages
+  def Execute(self, message):
+    if self.output: # the response to the last one was not read.
+      self.output = ""
+      self.AddError(-410, "Query INTERRUPTED")
+    responses = []
+    for header, argument, query in SplitMessage(message):
+      header = self.ALIASES.get(header, header)
+      try:
+        if query:
+          responses.append(self._Query(header, argument))
+        else:
+          self._Command(header, argument)
+      except SCPIError, err:
+        code, text = err.args
+        self.AddError(code, text)
+        if code > -200: # command errors end the message.
+          break
+    if responses:
+      self.output = ";".join(responses) + "\n"
+
+  def _Query(self, header, argument):
+    method = self.QUERIES.get(header)
+    if method is not None:
+      return getattr(self, method)(argument)
+    try:
+      return self.settings[header]
+    except KeyError:
+      raise SCPIError(-113, "Undefined header")
+
+  def _Command(self, header, argument):
+    method = self.COMMANDS.get(header)
+    if method is not None:
+      getattr(self, method)(argument)
+      return
+    try:
+      default, convert = self.SETTINGS[header]
+    except KeyError:
+      if not self.STORE_ANY:
+        raise SCPIError(-113, "Undefined header")
+      convert = None
+    if convert is None:
+      self.settings[header] = argument
+      return
+    if not argument:
+      raise SCPIError(-109, "Missing parameter")
+    try:
+      self.settings[header] = convert(argument)
+    except ValueError:
+      raise SCPIError(-224, "Illegal parameter value")
+
+  def FormatArray(self, values):
+    """Format an array response, in ASCII or binary as FORM says."""
+    form = self.settings.get("FORM", "ASC")
+    if form == "ASC":
+      return ",".join(map(FormatNumber, values))
+    dtype = gpib.BLOCK_TYPES[int(form.split(",")[1])]
+    if self.settings.get("FORM:BORD") == "SWAP":
+      dtype = dtype.newbyteorder()
+    data = numpy.asarray(values, numpy.float64).astype(dtype).tostring()
+    length = str(len(data))
+    return "#%d%s%s" % (len(length), length, data)
+
+  def _Nothing(self, argument):
+    pass
+
+  def _Reset(self, argument):
+    self.Reset()
+
+  def _ClearStatus(self, argument):
+    self.errors = []
+    self.esr = 0
+    self._opcarmed = False
+
+  def _SetESE(self, argument):
+    self.ese = int(float(argument)) & 0xff
+
+  def _GetESE(self, argument):
+    return str(self.ese)
+
+  def _SetSRE(self, argument):
+    self.sre = int(float(argument)) & 0xbf
+
+  def _GetSRE(self, argument):
+    return str(self.sre)
+
+  def _GetESR(self, argument):
+    self.GetStatusByte() # sets the OPC bit, if due.
+    esr = self.esr
+    self.esr = 0
+    return str(esr)
+
+  def _GetSTB(self, argument):
+    return str(self.GetStatusByte())
+
+  def _ArmOPC(self, argument):
+    self._opcarmed = True
+
+  def _QueryOPC(self, argument):
+    self._WaitPending(argument)
+    return "1"
+
+  def _WaitPending(self, argument):
+    self._busyuntil = max(self._busyuntil, self._pendinguntil)
+
+  def _Identify(self, argument):
+    return self.IDENTITY
+
+  def _Options(self, argument):
+    return self.OPTIONS
+
+  def _GetError(self, argument):
+    if not self.errors:
+      return '+0,"No error"'
+    code, message = self.errors.pop(0)
+    return '%+d,"%s"' % (code, message)
+
+  # the _gpib interface
+  def _SetStatus(self, sta, cnt=0):
+    self._status.sta = sta
+    self._status.cnt = cnt
+
+  def ibsta(self):
+    return getattr(self._status, "sta", 0)
+
+  def ibcnt(self):
+    return getattr(self._status, "cnt", 0)
+
+  def write(self, string):
+    self._lock.acquire()
+    try:
+      self._Write(string)
+    finally:
+      self._lock.release()
+    return len(string)
+
+  writea = write
+
+  def writebin(self, string, length):
+    return self.write(string[:length])
+
+  def _Write(self, string):
+    self._WaitBusy()
+    self.model.Delay(len(string))
+    self.Execute(string)
+    self._SetStatus(gpib.CMPL, len(string))
+
+  def read(self, length=4096):
+    self._lock.acquire()
+    try:
+      return self._Read(length)
+    finally:
+      self._lock.release()
+
+  readbin = read
+
+  def _Read(self, length):
+    if not self.output:
+      time.sleep(self.timeout)
+      self.AddError(-420, "Query UNTERMINATED")
+      self._SetStatus(gpib.ERR | gpib.TIMO | gpib.CMPL)
+      raise gpib.GpibError("read: timeout")
+    self._WaitBusy()
+    data = self.output[:length]
+    self.output = self.output[length:]
+    self.model.Delay(len(data))
+    sta = gpib.CMPL
+    if not self.output:
+      sta |= gpib.END
+    self._SetStatus(sta, len(data))
+    return data
+
+  def fetch(self, length, string):
+    self._lock.acquire()
+    try:
+      self._Write(string)
+      return self._Read(length)
+    finally:
+      self._lock.release()
+
+  def _WaitBusy(self):
+    wait = self._busyuntil - time.time()
+    if wait > 0:
+      time.sleep(wait)
+
+  def rsp(self):
+    self._lock.acquire()
+    try:
+      time.sleep(self.polltime)
+      self._SetStatus(gpib.CMPL)
+      return chr(self.GetStatusByte())
+    finally:
+      self._lock.release()
+
+  def wait(self, mask):
+    """Wait for RQS (service request), or return at once."""
+    self._lock.acquire()
+    try:
+      sta = gpib.CMPL
+      if mask & gpib.RQS:
+        deadline = time.time() + self.timeout
+        while not self.GetStatusByte() & gpib.MSS:
+          ready = max(self._busyuntil, self._pendinguntil)
+          now = time.time()
+          if now >= deadline or (now >= ready and not self._opcarmed):
+            break # nothing more will come.
+          time.sleep(max(min(ready, deadline) - now, 0.0001))
+        if self.GetStatusByte() & gpib.MSS:
+          sta |= gpib.RQS
+        else:
+          sta |= gpib.TIMO
+      self._SetStatus(sta)
+      return sta
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self.model.Delay()
+      self.output = ""
+      self._opcarmed = False
+      self._SetStatus(gpib.CMPL)
+    finally:
+      self._lock.release()
+
+  def trg(self):
+    self.model.Delay()
+    self._SetStatus(gpib.CMPL)
+
+  def loc(self):
+    self._SetStatus(gpib.CMPL)
+
+  def tmo(self, value):
+    seconds = gpib.TIMEOUT_SECONDS[int(value)]
+    if seconds is None:
+      seconds = 1e6
+    self.timeout = seconds
+
+  def ibask(self, option):
+    return 0
+
+  def ibconfig(self, option, setting):
+    pass
+
+
+def _Format(argument):
+  value = argument.replace(" ", "").upper()
+  if value.startswith("ASC"):
+    return "ASC"
+  if value.startswith("REAL"):
+    if value.endswith(",64"):
+      return "REAL,64"
+    if value in ("REAL", "REAL,32"):
+      return "REAL,32"
+  raise ValueError(argument)
+
+
+def _CurrentRange(argument):
+  value = float(_UNIT_RE.sub("", argument.strip()))
+  for limit in (0.02, 1.0, 3.0):
+    if value <= limit:
+      return FormatNumber(limit)
+  raise SCPIError(-222, "Data out of range")
+
+
+class Ag66319D(SimulatedInstrument):
+  """Agilent 66319D, with a phone as its load, and its DVM.
+
+  Device spec attributes, beside the latency model:
+    current (float): mean load current, in A (default 0.15).
+    noise (float): standard deviation of the load current (default 0.005).
+    pulse (float): added current of periodic pulses, in A (default 0).
+    period (float): seconds from one pulse to the next (default 4.615 ms,
+    a GSM frame).
+    duty (float): fraction of the period a pulse lasts (default 0.125).
+    dvmvoltage (float): voltage at the DVM input (default 0).
+  A current measurement takes measuretime plus the sweep time (points
+  times interval), as the real one does.
+  """
+  IDENTITY = "Agilent Technologies,66319D,0,A.01.01"
+  MEASURETIME = 0.02
+  SETTINGS = ShortHeaders({
+    "SOUR:VOLT": (FormatNumber(0.0), Numeric(0.0, 15.0)),
+    "SOUR:VOLT2": (FormatNumber(0.0), Numeric(0.0, 12.0)),
+    "OUTP:STAT": ("0", Boolean),
+    "OUTP2:STAT": ("0", Boolean),
+    "INST:COUP:OUTP:STAT": ("NONE", Choice("ALL", "NONE")),
+    "SENS:WIND": ("RECT", Choice("HANN", "RECT")),
+    "SENS:CURR:RANG": (FormatNumber(3.0), _CurrentRange),
+    "SENS:CURR:DET": ("ACDC", Choice("ACDC", "DC")),
+    "SENS:SWE:POIN": ("+2048", Integer(1, 4096)),
+    "SENS:SWE:TINT": (FormatNumber(15.6e-6), Numeric(15.6e-6, 31200e-6)),
+    "FORM": ("ASC", _Format),
+    "FORM:BORD": ("NORM", Choice("NORM", "SWAP")),
+  })
+  ALIASES = ShortHeaders({
+    "VOLT": "SOUR:VOLT",
+    "VOLT2": "SOUR:VOLT2",
+    "SOUR:VOLT:LEV": "SOUR:VOLT",
+    "OUTP": "OUTP:STAT",
+    "OUTP2": "OUTP2:STAT",
+    "FORM:DATA": "FORM",
+    "MEAS:VOLT:DC": "MEAS:VOLT",
+    "MEAS:CURR:DC": "MEAS:CURR",
+    "FETC:VOLT:DC": "FETC:VOLT",
+    "FETC:CURR:DC": "FETC:CURR",
+    "MEAS:DVM:DC": "MEAS:DVM",
+  })
+  QUERIES = dict(SimulatedInstrument.QUERIES)
+  QUERIES.update(ShortHeaders({
+    "MEAS:VOLT": "_MeasureVoltage",
+    "FETC:VOLT": "_FetchVoltage",
+    "MEAS:CURR": "_MeasureCurrent",
+    "FETC:CURR": "_FetchCurrent",
+    "MEAS:CURR:ACDC": "_MeasureCurrentRMS",
+    "FETC:CURR:ACDC": "_FetchCurrentRMS",
+    "FETC:CURR:MAX": "_FetchMaximum",
+    "FETC:CURR:MIN": "_FetchMinimum",
+    "FETC:CURR:HIGH": "_FetchHigh",
+    "FETC:CURR:LOW": "_FetchLow",
+    "MEAS:ARR:CURR": "_MeasureCurrentArray",
+    "FETC:ARR:CURR": "_FetchCurrentArray",
+    "MEAS:ARR:VOLT": "_MeasureVoltageArray",
+    "FETC:ARR:VOLT": "_FetchVoltageArray",
+    "MEAS:DVM": "_MeasureDVM",
+    "MEAS:DVM:ACDC": "_MeasureDVM",
+  }))
+
+  def __init__(self, devspec):
+    self.current = float(devspec.get("current", 0.15))
+    self.noise = float(devspec.get("noise", 0.005))
+    self.pulse = float(devspec.get("pulse", 0.0))
+    self.period = float(devspec.get("period", 4.615e-3))
+    self.duty = float(devspec.get("duty", 0.125))
+    self.dvmvoltage = float(devspec.get("dvmvoltage", 0.0))
+    self._currents = None # the last sweep.
+    self._voltages = None
+    super(Ag66319D, self).__init__(devspec)
+
+  def Reset(self):
+    super(Ag66319D, self).Reset()
+    self._currents = None
+    self._voltages = None
+
+  def _Sweep(self):
+    points = int(self.settings["SENS:SWE:POIN"])
+    interval = float(self.settings["SENS:SWE:TINT"])
+    self.Busy(self.measuretime + points * interval)
+    rand = self.random
+    if self.settings["OUTP:STAT"] == "1":
+      voltage = float(self.settings["SOUR:VOLT"])
+      currents = self.current + rand.normal(0.0, self.noise, points)
+      if self.pulse:
+        times = rand.uniform(0.0, self.period) + numpy.arange(points) * interval
+        currents += self.pulse * (times % self.period <
+            self.duty * self.period)
+    else:
+      voltage = 0.0
+      currents = rand.normal(0.0, 1e-6, points)
+    self._currents = currents
+    self._voltages = voltage + rand.normal(0.0, 0.0005, points)
+
+  def _GetCurrents(self):
+    if self._currents is None:
+      raise SCPIError(-230, "Data corrupt or stale")
+    return self._currents
+
+  def _GetVoltages(self):
+    if self._voltages is None:
+      raise SCPIError(-230, "Data corrupt or stale")
+    return self._voltages
+
+  def _MeasureVoltage(self, argument):
+    self._Sweep()
+    return self._FetchVoltage(argument)
+
+  def _FetchVoltage(self, argument):
+    return FormatNumber(self._GetVoltages().mean())
+
+  def _MeasureCurrent(self, argument):
+    self._Sweep()
+    return self._FetchCurrent(argument)
+
+  def _FetchCurrent(self, argument):
+    return FormatNumber(self._GetCurrents().mean())
+
+  def _MeasureCurrentRMS(self, argument):
+    self._Sweep()
+    return self._FetchCurrentRMS(argument)
+
+  def _FetchCurrentRMS(self, argument):
+    currents = self._GetCurrents()
+    return FormatNumber(numpy.sqrt(numpy.dot(currents, currents) /
+        len(currents)))
+
+  def _FetchMaximum(self, argument):
+    return FormatNumber(self._GetCurrents().max())
+
+  def _FetchMinimum(self, argument):
+    return FormatNumber(self._GetCurrents().min())
+
+  def _GetHighLow(self):
+    """Averages of the samples above and below the middle of the span."""
+    currents = self._GetCurrents()
+    middle = (currents.max() + currents.min()) / 2.0
+    high = currents[currents >= middle]
+    low = currents[currents < middle]
+    if not len(low):
+      low = high
+    return high.mean(), low.mean()
+
+  def _FetchHigh(self, argument):
+    return FormatNumber(self._GetHighLow()[0])
+
+  def _FetchLow(self, argument):
+    return FormatNumber(self._GetHighLow()[1])
+
+  def _MeasureCurrentArray(self, argument):
+    self._Sweep()
+    return self._FetchCurrentArray(argument)
+
+  def _FetchCurrentArray(self, argument):
+    return self.FormatArray(self._GetCurrents())
+
+  def _MeasureVoltageArray(self, argument):
+    self._Sweep()
+    return self._FetchVoltageArray(argument)
+
+  def _FetchVoltageArray(self, argument):
+    return self.FormatArray(self._GetVoltages())
+
+  def _MeasureDVM(self, argument):
+    self.Busy(self.measuretime)
+    return FormatNumber(self.dvmvoltage + self.random.normal(0.0, 0.0005))
+
+
+class StatusRegister(object):
+  """An SCPI status register, with its transition filters, event and enable
+  registers.
+
+  The condition is that of the given function, if any, and of the summary
+  bits of the registers under it: a register sums up to the bit of its
+  parent given when added. The event register latches condition bits
+  rising through the positive transition filter (PTR), and falling through
+  the negative one (NTR), until read. Transitions are seen when the
+  register is updated, which the instrument does whenever status is read.
+  """
+  def __init__(self, condition=None):
+    self.condition = condition
+    self.children = [] # (register, bit)
+    self.Preset()
+
+  def Preset(self):
+    """As STAT:PRES sets it, and clears the event register."""
+    self.ptr = 32767
+    self.ntr = 0
+    self.enable = 0
+    self.event = 0
+    self._last = 0
+
+  def Add(self, register, bit):
+    self.children.append((register, bit))
+    return register
+
+  def Update(self):
+    """Latch the transitions since the last update, and return the
+    condition."""
+    if self.condition is None:
+      condition = 0
+    else:
+      condition = self.condition()
+    for register, bit in self.children:
+      register.Update()
+      if register.Summary():
+        condition |= bit
+    rose = condition & ~self._last
+    fell = self._last & ~condition
+    self.event |= (rose & self.ptr) | (fell & self.ntr)
+    self._last = condition
+    return condition
+
+  def Summary(self):
+    return bool(self.event & self.enable)
+
+  def ReadEvent(self):
+    event = self.event
+    self.event = 0
+    return event
+
+
+class Ag8960(SimulatedInstrument):
+  """Agilent 8960 test set, with the GSM lab application, and a phone
+  that answers calls and pings.
+
+  Any setting command is kept, and a query of it answers what was set, so
+  the many test set settings need not be listed here. Device spec
+  attributes, beside the latency model:
+    calltime (float): seconds from originating a call to its connection
+    (default 2.0).
+    pingtime (float): round trip time of a ping, in ms (default 80).
+    pingloss (float): fraction of pings lost (default 0).
+  The STAT:OPER:CALL:COMM:DATA register shows a running ping by its "ping
+  active" bit, and sums up through STAT:OPER:CALL:COMM and STAT:OPER:CALL
+  to STAT:OPER, and so the operation status summary bit of the status
+  byte. The summary bits within the chain are this simulator's own.
+  """
+  IDENTITY = "Agilent Technologies,8960 Series 10 E5515C,0,A.07.11"
+  PING_ACTIVE = 16384
+  MEASURETIME = 0.05
+  STORE_ANY = True
+  APPLICATIONS = ('"GSM/GPRS Lab App"', '"WCDMA Lab App"')
+  SETTINGS = ShortHeaders({
+    "CALL:BAND": ("PGSM", None),
+    "CALL:POW": (FormatNumber(-85.0), Numeric(-127.0, -10.0)),
+    "CALL:MS:TXL": ("+5", Integer(0, 31)),
+    "CALL:PDTCH:MS:TXL:BURS1": ("+5", Integer(0, 31)),
+    "CALL:PDTCH:MS:TXL:BURS2": ("+5", Integer(0, 31)),
+    "CALL:PDTCH:MS:TXL:BURS3": ("+5", Integer(0, 31)),
+    "CALL:PDTCH:MS:TXL:BURS4": ("+5", Integer(0, 31)),
+    "CALL:TCH:DOWN:SPE": ("NONE", None),
+    "CALL:TCH:DOWN:SPE:LOOP:DEL": (FormatNumber(0.0), Numeric(0.0, 5.0)),
+    "CALL:CELL:DTM": ("0", Boolean),
+    "CALL:CELL:OPER:MODE": ("CELL", Choice("CELL", "OFF", "GBTT", "TEST")),
+    "CALL:CELL:BCH:SCEL": ("GSM", Choice("GSM", "GPRS", "EGPRS")),
+    "CALL:FUNC:CONN:TYPE": ("AUTO", None),
+    "CALL:PDTC:MSL:CONF": ("D1U1", None),
+    "CALL:CELL:POW:STAT:GSM": ("1", Boolean),
+    "CALL:MS:PATT:STAT": ("0", Boolean),
+    "CALL:OPER:MODE": ("CALL", None),
+  })
+  COMMANDS = dict(SimulatedInstrument.COMMANDS)
+  COMMANDS.update(ShortHeaders({
+    "SYST:APPL:SEL:NAME": "_SelectApplication",
+    "CALL:ORIG": "_Originate",
+    "CALL:END": "_End",
+    "CALL:DATA:PING:START": "_StartPing",
+    "CALL:COUN:CLE:ALL": "_ClearCounters",
+    "CALL:COUN:CLE:MS:IP": "_ClearIPCounters",
+    "STAT:PRES": "_PresetStatus",
+  }))
+  QUERIES = dict(SimulatedInstrument.QUERIES)
+  QUERIES.update(ShortHeaders({
+    "SYST:APPL:CAT": "_GetApplications",
+    "SYST:CURR:TA:NAME": "_GetApplicationName",
+    "SYST:CURR:TA:MODEL": "_GetApplicationModel",
+    "SYST:CURR:TA:REV": "_GetApplicationRevision",
+    "CALL:CONN": "_IsConnected",
+    "CALL:ATT": "_IsAttached",
+    "CALL:STAT:DATA": "_GetDataState",
+    "CALL:DATA:PING": "_GetPingResults",
+    "CALL:COUN:MS:IP:ALL": "_GetIPCounters",
+    "CALL:COUN:CBUR": "_GetZero",
+    "CALL:COUN:CDER": "_GetZero",
+    "CALL:MS:REP:IMEI": "_GetIMEI",
+    "CALL:MS:REP:IMSI": "_GetIMSI",
+    "STAT:OPER:CALL:GSM:COND": "_GetZero",
+  }))
+
+  def __init__(self, devspec):
+    self.calltime = float(devspec.get("calltime", 2.0))
+    self.pingtime = float(devspec.get("pingtime", 80.0))
+    self.pingloss = float(devspec.get("pingloss", 0.0))
+    self.application = self.APPLICATIONS[0]
+    self._connectat = None # when the call connects, if one is made.
+    self._ping = [NAN] * 6
+    self._pingdone = 0.0 # when the running ping is done.
+    self._ipcounters = [0, 0, 0, 0]
+    self._operation = StatusRegister()
+    call = self._operation.Add(StatusRegister(), 2)
+    comm = call.Add(StatusRegister(), 4)
+    data = comm.Add(StatusRegister(self._GetDataCondition), 2)
+    self._registers = ShortHeaders({
+      "STAT:OPER": self._operation,
+      "STAT:OPER:CALL": call,
+      "STAT:OPER:CALL:COMM": comm,
+      "STAT:OPER:CALL:COMM:DATA": data,
+    })
+    super(Ag8960, self).__init__(devspec)
+
+  def GetStatusByte(self):
+    stb = super(Ag8960, self).GetStatusByte()
+    self._operation.Update()
+    if self._operation.Summary():
+      stb |= gpib.OSS
+      if stb & self.sre:
+        stb |= gpib.MSS
+    return stb
+
+  # the status registers, by their path and the last node.
+  def _Command(self, header, argument):
+    path, node = (header.rsplit(":", 1) + [""])[:2]
+    register = self._registers.get(path)
+    if register is None or node not in ("PTR", "NTR", "ENAB"):
+      super(Ag8960, self)._Command(header, argument)
+      return
+    try:
+      value = int(float(argument)) & 32767
+    except ValueError:
+      raise SCPIError(-224, "Illegal parameter value")
+    setattr(register, {"PTR": "ptr", "NTR": "ntr", "ENAB": "enable"}[node],
+        value)
+
+  def _Query(self, header, argument):
+    path, node = (header.rsplit(":", 1) + [""])[:2]
+    register = self._registers.get(path)
+    if register is None:
+      return super(Ag8960, self)._Query(header, argument)
+    self._operation.Update()
+    if node == "COND":
+      return "%+d" % (register.Update(),)
+    if node == "EVEN":
+      return "%+d" % (register.ReadEvent(),)
+    if node in ("PTR", "NTR", "ENAB"):
+      return "%+d" % (getattr(register,
+          {"PTR": "ptr", "NTR": "ntr", "ENAB": "enable"}[node]),)
+    raise SCPIError(-113, "Undefined header")
+
+  def _PresetStatus(self, argument):
+    for register in self._registers.values():
+      register.Preset()
+
+  def _SelectApplication(self, argument):
+    name = '"%s"' % (argument.strip().strip("'\""),)
+    if name not in self.APPLICATIONS:
+      raise SCPIError(-224, "Illegal parameter value")
+    self.application = name
+    self.Reset()
+    self.Busy(self.measuretime * 20) # it restarts.
+
+  def _GetApplications(self, argument):
+    return ",".join(self.APPLICATIONS)
+
+  def _GetApplicationName(self, argument):
+    return self.application
+
+  def _GetApplicationModel(self, argument):
+    return '"E1968A"'
+
+  def _GetApplicationRevision(self, argument):
+    return '"A.07.11"'
+
+  def _Originate(self, argument):
+    self._connectat = time.time() + self.calltime
+
+  def _End(self, argument):
+    self._connectat = None
+
+  def _IsConnected(self, argument):
+    if self._connectat is not None and time.time() >= self._connectat:
+      return "1"
+    return "0"
+
+  def _IsAttached(self, argument):
+    return "1"
+
+  def _GetDataState(self, argument):
+    return "PDP"
+
+  def _GetDataCondition(self):
+    if time.time() < self._pingdone:
+      return self.PING_ACTIVE
+    return 0
+
+  def _StartPing(self, argument):
+    count = int(float(self.settings.get("CALL:DATA:PING:SET:COUN", "4")))
+    size = int(float(self.settings.get("CALL:DATA:PING:SET:PACK", "32")))
+    timeout = float(self.settings.get("CALL:DATA:PING:SET:TIM", "3"))
+    times = self.random.normal(self.pingtime, self.pingtime * 0.1, count)
+    times = numpy.maximum(times, 1.0)
+    received = times[self.random.uniform(size=count) >= self.pingloss]
+    lost = count - len(received)
+    duration = (received.sum() + lost * timeout * 1000.0) / 1000.0
+    self._operation.Update() # the ping active bit rises now.
+    self._pingdone = time.time() + duration
+    self.Pending(duration)
+    if len(received):
+      stats = [received.min(), received.mean(), received.max()]
+    else:
+      stats = [NAN] * 3
+    self._ping = [count, len(received), 100.0 * lost / count] + stats
+    self._ipcounters[0] += count
+    self._ipcounters[1] += count * (size + 28)
+    self._ipcounters[2] += len(received)
+    self._ipcounters[3] += len(received) * (size + 28)
+
+  def _GetPingResults(self, argument):
+    return ",".join(map(FormatNumber, self._ping))
+
+  def _ClearCounters(self, argument):
+    self._ipcounters = [0, 0, 0, 0]
+
+  _ClearIPCounters = _ClearCounters
+
+  def _GetIPCounters(self, argument):
+    return ",".join(map(FormatNumber, self._ipcounters))
+
+  def _GetZero(self, argument):
+    return "+0"
+
+  def _GetIMEI(self, argument):
+    return '"354879010000005"'
+
+  def _GetIMSI(self, argument):
+    return '"001012345678901"'
+
+
+class Fluke45(object):
+  """Fluke 45 multimeter on its serial port, measuring a phone.
+
+  Stands in for the expect object of a serial.SerialInstrument. Device
+  spec attributes, beside the latency model (perbyte defaults to 9600
+  baud):
+    voltage (float): DC volts measured (default 3.8).
+    current (float): DC amperes measured (default 0.15).
+    noise (float): relative standard deviation of readings (default 1e-4).
+  A reading takes the time of the RATE setting, S, M or F.
+  """
+  IDENTITY = "FLUKE, 45, 0, 1.6 D1.0"
+  FUNCTIONS = ("VDC", "VAC", "VACDC", "ADC", "AAC", "AACDC", "OHMS", "FREQ",
+      "DIODE", "CONT")
+  RATES = {"S": 0.4, "M": 0.2, "F": 0.05} # seconds per reading
+
+  def __init__(self, devspec):
+    self.model = _GetLatencyModel(devspec, SERIAL_PERBYTE)
+    self.random = numpy.random.RandomState(devspec.get("seed"))
+    self.noise = float(devspec.get("noise", 1e-4))
+    voltage = float(devspec.get("voltage", 3.8))
+    current = float(devspec.get("current", 0.15))
+    self.values = {"VDC": voltage, "VAC": 0.0, "VACDC": voltage,
+        "ADC": current, "AAC": 0.0, "AACDC": current, "OHMS": 1e9,
+        "FREQ": 0.0, "DIODE": 3.0, "CONT": 1e9}
+    self._fo = self # for stty
+    self._lock = threading.Lock()
+    self._input = ""
+    self.output = ""
+    self._busyuntil = 0.0
+    self._Reset()
+
+  def _Reset(self):
+    self.function = "VDC"
+    self.rate = "S"
+
+  def stty(self, *args):
+    pass
+
+  def close(self):
+    pass
+
+  def write(self, data):
+    self._lock.acquire()
+    try:
+      self.model.Delay(len(data))
+      if "\x03" in data: # ^C, clear
+        self._input = ""
+        self.output = "=>\r\n"
+        data = data.split("\x03")[-1]
+      self._input += data
+      while "\n" in self._input:
+        line, self._input = self._input.split("\n", 1)
+        self.output += self._Execute(line.strip())
+    finally:
+      self._lock.release()
+    return len(data)
+
+  def _Execute(self, line):
+    responses = []
+    for command in line.split(";"):
+      command = command.strip().upper()
+      if not command:
+        continue
+      if command in self.FUNCTIONS:
+        self.function = command
+      elif command.startswith("RATE"):
+        rate = command[4:].strip()
+        if rate not in self.RATES:
+          return "!>\r\n"
+        self.rate = rate
+      elif command == "RATE?":
+        responses.append(self.rate)
+      elif command == "FUNC1?":
+        responses.append(self.function)
+      elif command in ("MEAS?", "MEAS1?", "VAL?", "VAL1?"):
+        responses.append(self._Measure())
+      elif command == "*IDN?":
+        responses.append(self.IDENTITY)
+      elif command == "*RST":
+        self._Reset()
+      elif command in ("*CLS", "AUTO") or command.startswith("RANGE"):
+        pass
+      else:
+        return "?>\r\n"
+    if responses:
+      return "%s\r\n=>\r\n" % (";".join(responses),)
+    return "=>\r\n"
+
+  def _Measure(self):
+    self._busyuntil = max(self._busyuntil, time.time()) + \
+        self.RATES[self.rate]
+    value = self.values[self.function]
+    value += self.random.normal(0.0, abs(value) * self.noise + 1e-9)
+    return "%+.4E" % (value,)
+
+  def _WaitBusy(self):
+    wait = self._busyuntil - time.time()
+    if wait > 0:
+      time.sleep(wait)
+
+  def expect(self, pattern, mtype=None, timeout=None):
+    """Consume output up to a match of the regular expression pattern.
+
+    Returns:
+      the match object, on the consumed output, or None if there is no
+      match.
+    """
+    self._lock.acquire()
+    try:
+      self._WaitBusy()
+      regex = re.compile(pattern)
+      mo = regex.search(self.output)
+      if mo is None:
+        return None
+      consumed = self.output[:mo.end()]
+      self.output = self.output[mo.end():]
+      self.model.Delay(len(consumed))
+      return regex.search(consumed)
+    finally:
+      self._lock.release()
+
+  def read(self, length, timeout=None):
+    self._lock.acquire()
+    try:
+      self._WaitBusy()
+      data = self.output[:length]
+      self.output = self.output[length:]
+      self.model.Delay(len(data))
+      return data
+    finally:
+      self._lock.release()
+
+
+# name: simulator class
+SIMULATORS = {
+  "Ag66319D": Ag66319D,
+  "Ag8960": Ag8960,
+  "Fluke45": Fluke45,
+}
+
+_simulators = {} # (name, gpibboard, gpibpad): simulator
+
+
+def GetSimulator(devspec):
+  """Get the simulator an instrument's device spec selects.
+
+  Device specs with the same simulator name and address get the same
+  simulator.
+  """
+  name = devspec.simulator
+  key = (name, devspec.get("gpibboard"), devspec.get("gpibpad"),
+      devspec.get("port"))
+  try:
+    return _simulators[key]
+  except KeyError:
+    pass
+  try:
+    cls = SIMULATORS[name]
+  except KeyError:
+    raise ValueError("No simulator %r. Choose one of %s." % (name,
+        ", ".join(SIMULATORS.keys())))
+  simulator = _simulators[key] = cls(devspec)
+  return simulator
@@ -9,6 +9,7 @@
 Devices in this class are typically multi-function.
 """
 
+import time
 
 from pycopia import scheduler
 
@@ -28,6 +29,13 @@ GSM = "GSM"
 GPRS = "GPRS"
 EGPRS = "EGPRS"
 
+# data condition register bit, set while a ping runs.
+PING_ACTIVE = 16384
+# The status registers from the data register up to the operation status
+# register, which sums up to the status byte.
+DATA_STATUS_PATH = ("STAT:OPER:CALL:COMM:DATA", "STAT:OPER:CALL:COMM",
+    "STAT:OPER:CALL", "STAT:OPER")
+
 class IntegrityError(Exception):
   pass
 
@@ -233,6 +241,18 @@ class BaseAg8960(TestSet):
   CONNECTION_BLER = "BLER"
   CONNECTION_SRBL = "SRBL"
 
+  STATE_QUERIES = {
+    "CALL:BAND": gpib.SameValue,
+    "CALL:POW": gpib.NumericValue,
+    "CALL:MS:TXL": gpib.NumericValue,
+    "CALL:PDTCH:MS:TXL:BURS1": gpib.NumericValue,
+    "CALL:PDTCH:MS:TXL:BURS2": gpib.NumericValue,
+    "CALL:PDTCH:MS:TXL:BURS3": gpib.NumericValue,
+    "CALL:PDTCH:MS:TXL:BURS4": gpib.NumericValue,
+  }
+  RESET_COMMANDS = gpib.GpibInstrument.RESET_COMMANDS + (
+      "SYSTEM:APPLICATION:SELECT", "SYST:APPL:SEL")
+
   def GetApplicationList(self):
     al = self.ask("SYST:APPL:CAT?")
     return [name[1:-1] for name in al.split(",")]
@@ -257,11 +277,43 @@ class BaseAg8960(TestSet):
     self.write("CALL:DATA:PING:SET:COUN %d" % count)
     self.write("CALL:DATA:PING:SET:PACK %d" % size)
     self.write("CALL:DATA:PING:SET:TIM %d" % timeout)
-    # perform
-    self.write("CALL:DATA:PING:START")
-    #errors = self.WaitToComplete()
-    scheduler.sleep(count * timeout) # XXX
-    errors = self.Errors()
+    # perform, and wait for the pings, which time out in count * timeout.
+    # It is not known if *OPC tracks them, but the ping active bit of the
+    # data condition register falls when they are done. The negative
+    # transition filter latches that in the data event register, which
+    # raises SRQ through the operation status summary. As a latch, it is
+    # not missed however soon the pings end, and it is not set by the last
+    # ping's end. Which bits of the registers between sum up the one below
+    # is not known here, so all are enabled, and a service request for
+    # anything else is told apart by the data event register.
+    finish = ";".join([":%s:EVEN?" % path for path in DATA_STATUS_PATH])
+    commands = ["STAT:OPER:CALL:COMM:DATA:PTR 0",
+        "STAT:OPER:CALL:COMM:DATA:NTR %d" % PING_ACTIVE,
+        "STAT:OPER:CALL:COMM:DATA:ENAB %d" % PING_ACTIVE]
+    for path in DATA_STATUS_PATH[1:]:
+      commands.append("%s:ENAB 32767" % path)
+    self.write(";:".join(commands))
+    self.ask(finish) # clears old events.
+    deadline = time.time() + count * timeout + 10
+    command = "CALL:DATA:PING:START"
+    errors = []
+    try:
+      while 1:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          raise gpib.GpibError("Ping did not finish in %s s." % (
+              count * timeout + 10,))
+        completion = self.StartStatusWait(gpib.OSS, finish, command,
+            gpib.GetTimeout(remaining))
+        command = None
+        errors.extend(completion.Wait())
+        if int(completion.status.split(";")[0]) & PING_ACTIVE:
+          break
+    finally:
+      commands = ["%s:ENAB 0" % path for path in DATA_STATUS_PATH]
+      commands.append("STAT:OPER:CALL:COMM:DATA:PTR 32767")
+      commands.append("STAT:OPER:CALL:COMM:DATA:NTR 0")
+      self.write(";:".join(commands))
     if errors:
       raise gpib.GpibError, errors
     rawres = self.ask("CALL:DATA:PING?")
@@ -366,22 +418,27 @@ class BaseAg8960(TestSet):
   def Prepare(self, measurecontext):
     myctx = measurecontext.testsets
     callplan = measurecontext.callplan
-    self.SetProfile(myctx.profile, measurecontext.SIM)
-    self.write("SYST:CORR:SGAIN %s" % ",".join(map(str,
-        [-measurecontext.measure.external_attenuation] * 20)))
-    self.write("CALL:ORIG:TIM +30")
-    self.write("DISP:WIND:ERR:CLE")
-    self.SetDownlinkAudio(myctx.downlinkaudio)
-    if callplan.include:
-      self.write("CALL:CPN:INCL INCL")
-      self.write('CALL:CPN "%s"' % callplan.orignumber)
-      self.write("CALL:CPN:PLAN %s" % callplan.plan.upper())
-      self.write("CALL:CPN:TYPE %s" % callplan.numbertype.upper())
-      self.write("CALL:CPN:PRES %s" % callplan.presentation.upper())
-      self.write("CALL:CPN:SCR %s" % callplan.screening.upper())
-    else:
-      self.write("CALL:CPN:INCL EXCL")
-    self.CheckErrors()
+    self.Begin() # send the settings in a few messages, check errors once.
+    try:
+      self.SetProfile(myctx.profile, measurecontext.SIM)
+      self.write("SYST:CORR:SGAIN %s" % ",".join(map(str,
+          [-measurecontext.measure.external_attenuation] * 20)))
+      self.write("CALL:ORIG:TIM +30")
+      self.write("DISP:WIND:ERR:CLE")
+      self.SetDownlinkAudio(myctx.downlinkaudio)
+      if callplan.include:
+        self.write("CALL:CPN:INCL INCL")
+        self.write('CALL:CPN "%s"' % callplan.orignumber)
+        self.write("CALL:CPN:PLAN %s" % callplan.plan.upper())
+        self.write("CALL:CPN:TYPE %s" % callplan.numbertype.upper())
+        self.write("CALL:CPN:PRES %s" % callplan.presentation.upper())
+        self.write("CALL:CPN:SCR %s" % callplan.screening.upper())
+      else:
+        self.write("CALL:CPN:INCL EXCL")
+    except:
+      self.Abort()
+      raise
+    self.Commit()
     return 5.0
 
 
@@ -393,6 +450,19 @@ class Ag8960GSM(BaseAg8960):
   GPRS = "GPRS"
   EGPRS = "EGPRS"
 
+  STATE_QUERIES = dict(BaseAg8960.STATE_QUERIES)
+  STATE_QUERIES.update({
+    "CALL:TCH:DOWN:SPE": gpib.SameValue,
+    "CALL:TCH:DOWN:SPE:LOOP:DEL": gpib.NumericValue,
+    "CALL:CELL:DTM": gpib.BooleanValue,
+    "CALL:CELL:OPER:MODE": gpib.SameValue,
+    "CALL:CELL:BCH:SCEL": gpib.SameValue,
+    "CALL:FUNC:CONN:TYPE": gpib.SameValue,
+    "CALL:PDTC:MSL:CONF": gpib.SameValue,
+    "CALL:CELL:POW:STAT:GSM": gpib.BooleanValue,
+    "CALL:MS:PATT:STAT": gpib.BooleanValue,
+  })
+
   def __str__(self):
     s = [str(self.identify()).strip()]
     s.append("   Application: %s" % self.GetCurrentApplication())
@@ -802,6 +872,9 @@ class Ag8960GSM(BaseAg8960):
 class Ag8960WCDMA(BaseAg8960):
   """GSM/GPRS_WCDMA Lab App"""
 
+  STATE_QUERIES = dict(BaseAg8960.STATE_QUERIES)
+  STATE_QUERIES["CALL:OPER:MODE"] = gpib.SameValue
+
   def __str__(self):
     s = [str(self.identify()).strip()]
     s.append("   Application: %s" % self.GetCurrentApplication())
@@ -142,17 +142,22 @@ class DataSampleReporter(object):
         axes=axes)
 
   def StatSelected(self, tmin, tmax):
-    set = self.dataset.GetTimeSlice((tmin, tmax))
-    values = set.transpose()[1]
+    stats = self.dataset.GetWindowStats(tmin, tmax)
     unit = self.unit
-    if len(values) > 0 and unit.endswith("A"):
+    if stats.count > 0 and unit.endswith("A"):
       s = []
-      s.append("%d samples over %.2f seconds." % (len(values), tmax - tmin))
-      avg = self.avgcurrent = numpy.mean(values)
-      s.append("Maximum: %.6f %s" % ( numpy.amax(values), unit))
-      s.append("Minimum: %.6f %s" % ( numpy.amin(values), unit))
-      s.append("Average: %.6f %s" % ( avg, unit))
-      s.append(" Median: %.6f %s" % ( numpy.median(values), unit))
+      s.append("%d samples over %.2f seconds." % (stats.count, tmax - tmin))
+      avg = self.avgcurrent = stats.mean
+      s.append("Maximum: %.6f %s" % (stats.maximum, unit))
+      s.append("Minimum: %.6f %s" % (stats.minimum, unit))
+      s.append("Average: %.6f %s" % (avg, unit))
+      # the range index has no order statistics, so this needs the samples.
+      values = self.dataset.GetTimeSlice((tmin, tmax))[:, 1]
+      s.append(" Median: %.6f %s" % (
+          numpy.median(values[~numpy.isnan(values)]), unit))
+      s.append("    RMS: %.6f %s" % (stats.rms, unit))
+      s.append(" Charge: %.4f mAh" % (
+          analyze.PQ(stats.charge, unit + "*s").inUnitsOf("mA*h").value))
       s.append("Estimated battery life: %.2f hours" % (
           self.battery_capacity / analyze.PQ(avg, unit)).inUnitsOf("h").value)
       self.textbox.set_text("\n".join(s))
@@ -41,6 +41,7 @@ import sys
 from pycopia import dictlib
 
 #from droid.reports import core as reportscore
+from droid.instruments import gpib
 from droid.storage import Storage
 
 
@@ -54,6 +55,42 @@ class MeasureError(Error):
   pass
 
 
+# Asynchronous instrument requests (such as from
+# GpibInstrument.begin_ask) started by measurers, not yet complete.
+_requests = []
+
+REQUEST_POLL_INTERVAL = 0.0005 # seconds between rounds of readiness checks
+
+
+def AddRequest(request):
+  """Have an asynchronous instrument request completed by the sequencer,
+  once it is ready.
+
+  So measurers that start requests, instead of asking and waiting, do not
+  hold up the tick while the instruments work. The request's callback
+  gets its response.
+  """
+  _requests.append(request)
+
+
+def CompleteRequests(wait=False):
+  """Complete the added requests that are ready.
+
+  The sequencer calls this at each tick, and with wait set when it stops.
+  Requests to an instrument that a measurer uses before then are
+  completed by that use.
+
+  Args:
+    wait (bool): also wait for the requests that are not ready.
+  """
+  global _requests
+  if wait:
+    gpib.CompleteAll(_requests, REQUEST_POLL_INTERVAL)
+    _requests = []
+  else:
+    _requests = gpib.CompleteReady(_requests)
+
+
 class ConfigDict(dictlib.AttrDict):
   def __init__(self, name):
     super(ConfigDict, self).__init__()
@@ -89,6 +126,7 @@ def MeasurementContext(**kwargs):
   ctx.useprogress = False # show a progress meter
   ctx.reset = False       # perform an instrument reset.
   ctx.triggered = False   # if performing a triggered measurement
+  ctx.overlapped = False  # overlap instrument queries of a sequencer tick
   ctx.capturemode = "N"   # default normal capture mode.
   ctx.SIM = "T-Mobile"   # What SIM is in the DUT
   ctx.datafilename = "-" 
@@ -282,9 +320,14 @@ class BaseMeasurer(object):
 
   Objects based on this class are intended for use in the measurement
   sequencer. 
+
+  Measurers that write a data file may also keep a stats.RunningStats
+  object, in the stats attribute, that they feed the primary value to.
+  The sequencer shows its summary when the measurer is finalized.
   """
   # Default values to avoid AttributeError
   datafile = None 
+  stats = None
   measuretime = 1.0
   delaytime = 30.0
 
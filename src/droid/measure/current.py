@@ -10,6 +10,7 @@
 import time
 
 from droid.measure import core
+from droid.measure import stats
 from droid.reports import core as reportcore
 
 
@@ -64,9 +65,7 @@ class SpecialCurrentMeasurer(core.OldMeasurer):
         inst.write("FETC:ARR:CURR?")
         timestamp = time.time()
         array = inst.read_values()
-        for samp in array:
-          report.WriteRecord(timestamp, samp)
-          timestamp += interval
+        report.WriteBlock(timestamp, interval, array)
       else:
         inst.timeout = inst.T30s
         for i in xrange(N):
@@ -74,9 +73,7 @@ class SpecialCurrentMeasurer(core.OldMeasurer):
           curr = inst.MeasureACDCCurrent()
           inst.write("FETC:ARR:CURR?")
           array = inst.read_values()
-          for samp in array:
-            report.WriteRecord(timestamp, samp)
-            timestamp += interval
+          report.WriteBlock(timestamp, interval, array)
     finally:
       inst.timeout = old_timeout
 
@@ -92,8 +89,12 @@ class PowerCurrentMeasurer(core.BaseMeasurer):
     self._device = ctx.environment.powersupply
     self.measuretime = self._device.Prepare(ctx)
     self.datafile = reportcore.GetDatafile(ctx)
+    self.stats = stats.RunningStats()
+    self._overlapped = (getattr(ctx, "overlapped", False) and
+        hasattr(self._device, "BeginMeasureAllCurrentAsText"))
 
   def Initialize(self):
+    self.stats.Clear()
     instrument = self._device
     instrument.write('SENS:FUNC "CURR"')
     self.datafile.Initialize()
@@ -104,9 +105,17 @@ class PowerCurrentMeasurer(core.BaseMeasurer):
     self.datafile.Finalize()
 
   def __call__(self, timestamp, oldvalue):
+    if self._overlapped:
+      core.AddRequest(self._device.BeginMeasureAllCurrentAsText(
+          lambda values: self._Record(timestamp, values)))
+      return oldvalue
+    return self._Record(timestamp, self._device.MeasureAllCurrentAsText())
+
+  def _Record(self, timestamp, values):
     rec = [repr(timestamp)]
-    rec.extend(self._device.MeasureAllCurrentAsText())
+    rec.extend(values)
     self.datafile.WriteTextRecord(*rec)
+    self.stats.Add(rec[1])
     return rec[1]
 
 
@@ -119,8 +128,10 @@ class PowerSupplyChargeCurrentMeasurer(core.BaseMeasurer):
     ctx.powersupplies.detector = "DC"
     self.measuretime = self._device.Prepare(ctx)
     self.datafile = reportcore.GetDatafile(ctx)
+    self.stats = stats.RunningStats()
 
   def Initialize(self):
+    self.stats.Clear()
     instrument = self._device
     instrument.write('SENS:FUNC "CURR"')
     self.datafile.Initialize()
@@ -134,6 +145,7 @@ class PowerSupplyChargeCurrentMeasurer(core.BaseMeasurer):
     rec = [repr(timestamp)]
     rec.extend(self._device.MeasureAllDCCurrentAsText())
     self.datafile.WriteTextRecord(*rec)
+    self.stats.Add(rec[1])
     return rec[1]
 
 
@@ -143,8 +155,12 @@ class PowerVoltageMeasurer(core.BaseMeasurer):
     super(PowerVoltageMeasurer, self).__init__(ctx)
     self._device = ctx.environment.powersupply
     self.datafile = reportcore.GetDatafile(ctx)
+    self.stats = stats.RunningStats()
+    self._overlapped = (getattr(ctx, "overlapped", False) and
+        hasattr(self._device, "BeginMeasureDCVoltage"))
 
   def Initialize(self):
+    self.stats.Clear()
     instrument = self._device
     #instrument.write('SENS:FUNC "VOLT"')
     self.datafile.Initialize()
@@ -155,8 +171,16 @@ class PowerVoltageMeasurer(core.BaseMeasurer):
     self.datafile.Finalize()
 
   def __call__(self, timestamp, oldvalue):
-    value = self._device.MeasureDCVoltage().value
+    if self._overlapped:
+      core.AddRequest(self._device.BeginMeasureDCVoltage(
+          lambda voltage: self._Record(timestamp, voltage)))
+      return oldvalue
+    return self._Record(timestamp, self._device.MeasureDCVoltage())
+
+  def _Record(self, timestamp, voltage):
+    value = voltage.value
     self.datafile.WriteRecord(timestamp, value)
+    self.stats.Add(value)
     return value
 
 
@@ -167,8 +191,10 @@ class CurrentMeasurer(core.BaseMeasurer):
     self._device = ctx.environment.currentmeter
     self.measuretime = self._device.Prepare(ctx)
     self.datafile = reportcore.GetDatafile(ctx)
+    self.stats = stats.RunningStats()
 
   def Initialize(self):
+    self.stats.Clear()
     instrument = self._device
     self.datafile.Initialize()
     headings = ("timestamp (s)",) + instrument.GetCurrentHeadings()
@@ -180,5 +206,6 @@ class CurrentMeasurer(core.BaseMeasurer):
   def __call__(self, timestamp, oldvalue):
     value = self._device.MeasureDCCurrent().value
     self.datafile.WriteRecord(timestamp, value)
+    self.stats.Add(value)
     return value
 
@@ -142,6 +142,8 @@ class _Sequencer(rtc.RTC, asyncio.PollerInterface):
     if irq & rtc.RTC_PF:
       while count > 0: # in case we missed an interrupt
         self._ticks += 1
+        # requests of earlier ticks that are ready by now.
+        core.CompleteRequests()
         for rate in self._rates.copy():
           if self._ticks % rate == 0:
             for callback, oneshot in self._sets[rate]:
@@ -262,15 +264,13 @@ class _Sequencer(rtc.RTC, asyncio.PollerInterface):
     if self._running:
       self.periodic_interrupt_off()
       asyncio.poller.unregister(self)
+      core.CompleteRequests(wait=True)
       for rate in self._rates:
         for callback, oneshot in self._sets[rate]:
-          if hasattr(callback, "Finalize"):
-            callback.Finalize()
+          _Finalize(callback)
       # Finalize measurerers that were removed during the run.
       while self._removedjobs:
-        callback = self._removedjobs.pop()
-        if hasattr(callback, "Finalize"):
-          callback.Finalize()
+        _Finalize(self._removedjobs.pop())
       self._running = False
 
   def Run(self):
@@ -287,6 +287,19 @@ class _Sequencer(rtc.RTC, asyncio.PollerInterface):
 
 
 
+def _Finalize(callback):
+  """Finalize a measurer, and show the summary of its values, if it keeps
+  one (see core.BaseMeasurer).
+  """
+  if hasattr(callback, "Finalize"):
+    callback.Finalize()
+  stats = getattr(callback, "stats", None)
+  if stats is not None and (stats.count or stats.invalid):
+    name = getattr(getattr(callback, "datafile", None), "name", None)
+    sys.stderr.write("\n%s:\n%s\n" % (name or callback.__class__.__name__,
+        stats))
+
+
 # The measurement timer must be a singleton, due to the nature of the RTC
 # device and kernel interface (it may not be shared).
 _measurement_timer = None
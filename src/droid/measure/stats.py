@@ -0,0 +1,221 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Online statistics for measurers.
+
+A measurer feeds each value to an accumulator as it is written to the
+data file. The summary (the same statistics DataSet.GetStats gives) is
+then available at any time during, or after, the run, and costs constant
+time and memory per sample.
+
+The mean and variance use Welford's method. Medians and other percentiles
+are estimated with the P-square algorithm (R. Jain and I. Chlamtac, "The
+P-square algorithm for dynamic calculation of quantiles and histograms
+without storing observations", CACM 28, 1985).
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import math
+
+
+# IEEE-488 special values (overflow, underflow, not a number) have an
+# absolute value at least this large.
+SCPI_SPECIAL = 9.9E+37
+
+
+class P2Quantile(object):
+  """Estimates one quantile of a stream of values.
+
+  Args:
+    p (float): the quantile, between 0 and 1 (0.5 is the median).
+  """
+  def __init__(self, p=0.5):
+    if not 0.0 < p < 1.0:
+      raise ValueError("Quantile must be between 0 and 1: %r" % (p,))
+    self.p = p
+    self.Clear()
+
+  def Clear(self):
+    p = self.p
+    self._heights = []
+    self._positions = [0, 1, 2, 3, 4]
+    self._desired = [0.0, 2.0 * p, 4.0 * p, 2.0 + 2.0 * p, 4.0]
+    self._increments = [0.0, p / 2.0, p, (1.0 + p) / 2.0, 1.0]
+
+  def Add(self, x):
+    q = self._heights
+    if len(q) < 5:
+      q.append(x)
+      q.sort()
+      return
+    n = self._positions
+    if x < q[0]:
+      q[0] = x
+      k = 0
+    elif x >= q[4]:
+      q[4] = x
+      k = 3
+    else:
+      k = 0
+      while x >= q[k + 1]:
+        k += 1
+    for i in range(k + 1, 5):
+      n[i] += 1
+    desired = self._desired
+    for i in range(5):
+      desired[i] += self._increments[i]
+    for i in (1, 2, 3):
+      d = desired[i] - n[i]
+      if (d >= 1.0 and n[i + 1] - n[i] > 1) or (
+          d <= -1.0 and n[i - 1] - n[i] < -1):
+        if d > 0:
+          d = 1
+        else:
+          d = -1
+        height = self._Parabolic(i, d)
+        if not q[i - 1] < height < q[i + 1]:
+          height = q[i] + d * (q[i + d] - q[i]) / float(n[i + d] - n[i])
+        q[i] = height
+        n[i] += d
+
+  def _Parabolic(self, i, d):
+    q = self._heights
+    n = self._positions
+    return q[i] + float(d) / (n[i + 1] - n[i - 1]) * (
+        (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / float(n[i + 1] - n[i]) +
+        (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / float(n[i] - n[i - 1]))
+
+  def GetValue(self):
+    """The current estimate, or None if no values were added.
+
+    The value is exact until five values have been added (interpolated
+    between the two nearest values, so the median of an even count is the
+    mean of the middle two).
+    """
+    q = self._heights
+    if not q:
+      return None
+    if len(q) < 5:
+      position = self.p * (len(q) - 1)
+      i = int(position)
+      if i + 1 < len(q):
+        return q[i] + (q[i + 1] - q[i]) * (position - i)
+      return q[i]
+    return q[2]
+
+  value = property(GetValue)
+
+
+class RunningStats(object):
+  """Accumulates summary statistics of a stream of values.
+
+  Values that are not finite (including the SCPI special values for
+  overflow and not a number) are counted, but left out of the statistics.
+
+  Args:
+    percentiles (sequence of floats, optional): extra quantiles to
+    estimate, between 0 and 1. The median is always estimated.
+  """
+  def __init__(self, percentiles=()):
+    self._median = P2Quantile(0.5)
+    self._quantiles = [P2Quantile(p) for p in percentiles]
+    self.Clear()
+
+  def Clear(self):
+    self.count = 0
+    self.invalid = 0
+    self._mean = 0.0
+    self._m2 = 0.0
+    self.minimum = None
+    self.maximum = None
+    self._median.Clear()
+    for quantile in self._quantiles:
+      quantile.Clear()
+
+  def Add(self, value):
+    x = float(value)
+    if x != x or abs(x) >= SCPI_SPECIAL: # NaN, INF, or SCPI special
+      self.invalid += 1
+      return
+    self.count += 1
+    delta = x - self._mean
+    self._mean += delta / self.count
+    self._m2 += delta * (x - self._mean)
+    if self.count == 1:
+      self.minimum = self.maximum = x
+    elif x < self.minimum:
+      self.minimum = x
+    elif x > self.maximum:
+      self.maximum = x
+    self._median.Add(x)
+    for quantile in self._quantiles:
+      quantile.Add(x)
+
+  def GetMean(self):
+    if self.count:
+      return self._mean
+    return None
+
+  def GetVariance(self):
+    """The sample variance, or None if fewer than two values."""
+    if self.count > 1:
+      return self._m2 / (self.count - 1)
+    return None
+
+  def GetStandardDeviation(self):
+    variance = self.GetVariance()
+    if variance is None:
+      return None
+    return math.sqrt(variance)
+
+  def GetMedian(self):
+    return self._median.GetValue()
+
+  def GetPercentile(self, p):
+    """Get the estimate of a quantile given to the constructor."""
+    if p == 0.5:
+      return self._median.GetValue()
+    for quantile in self._quantiles:
+      if quantile.p == p:
+        return quantile.GetValue()
+    raise ValueError("Quantile %r is not being estimated." % (p,))
+
+  def GetCrestFactor(self):
+    if self.count and self._mean:
+      return self.maximum / self._mean
+    return None
+
+  mean = property(GetMean)
+  variance = property(GetVariance)
+  stddev = property(GetStandardDeviation)
+  median = property(GetMedian)
+  crestfactor = property(GetCrestFactor)
+
+  def GetStats(self):
+    """Common statistics, in the same order as DataSet.GetStats.
+
+    Returns:
+      mean, maximum, minimum, median, crestfactor
+      of the values added so far (None if there are none).
+    """
+    return (self.GetMean(), self.maximum, self.minimum, self.GetMedian(),
+        self.GetCrestFactor())
+
+  def __str__(self):
+    if not self.count:
+      return "No samples (%d invalid)." % self.invalid
+    s = ["%d samples (%d invalid):" % (self.count, self.invalid)]
+    s.append(" Maximum: %s" % self.maximum)
+    s.append(" Minimum: %s" % self.minimum)
+    s.append("    Mean: %s" % self.mean)
+    s.append("  StdDev: %s" % self.stddev)
+    s.append("  Median: %s (estimated)" % self.median)
+    for quantile in self._quantiles:
+      s.append("  %5.1f%%: %s (estimated)" % (quantile.p * 100.0,
+          quantile.GetValue()))
+    s.append(" Crest factor: %s" % self.crestfactor)
+    return "\n".join(s)
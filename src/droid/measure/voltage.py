@@ -13,6 +13,7 @@ import sys
 import time
 
 from droid.measure import core
+from droid.measure import stats
 from droid.reports import core as reportcore
 
 
@@ -22,8 +23,12 @@ class VoltageMeasurer(core.BaseMeasurer):
     self._device = ctx.environment.voltmeter
     self.measuretime = self._device.Prepare(ctx)
     self.datafile = reportcore.GetDatafile(ctx)
+    self.stats = stats.RunningStats()
+    self._overlapped = (getattr(ctx, "overlapped", False) and
+        hasattr(self._device, "BeginMeasureDCVoltage"))
 
   def Initialize(self):
+    self.stats.Clear()
     instrument = self._device
     self.datafile.Initialize()
     headings = ("timestamp (s)",) + instrument.GetVoltageHeadings()
@@ -33,8 +38,16 @@ class VoltageMeasurer(core.BaseMeasurer):
     self.datafile.Finalize()
 
   def __call__(self, timestamp, oldvalue):
-    val = self._device.MeasureDCVoltage().value
+    if self._overlapped:
+      core.AddRequest(self._device.BeginMeasureDCVoltage(
+          lambda voltage: self._Record(timestamp, voltage)))
+      return oldvalue
+    return self._Record(timestamp, self._device.MeasureDCVoltage())
+
+  def _Record(self, timestamp, voltage):
+    val = voltage.value
     self.datafile.WriteRecord(timestamp, val)
+    self.stats.Add(val)
     return val
 
 
@@ -0,0 +1,193 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Cache of parsed text data files.
+
+The array parsed from a text data file is saved in numpy's binary .npy
+format, with a small header file that holds the column headers and the
+key of the data file it came from (size and modification time). The next
+read of an unchanged file maps the .npy file instead of parsing the text.
+
+The cache files are kept next to each data file by default. If a cache
+directory is set, they are kept there instead (named by a digest of the
+data file's path), and the least recently used are removed when the
+directory grows over its size limit.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import os
+try:
+  from hashlib import md5
+except ImportError: # Python 2.4
+  from md5 import new as md5
+
+import numpy
+from pycopia import dictlib
+
+
+ARRAY_EXTENSION = ".cache.npy"
+HEADER_EXTENSION = ".cache.hdr"
+MAXBYTES = 2 * 1024 * 1024 * 1024 # default size limit of a cache directory
+
+
+class ParseCache(object):
+  """Keeps parsed arrays of data files.
+
+  Args:
+    directory (string, optional): cache directory. Default is to keep the
+    cache files next to the data files.
+    maxbytes (int): size limit of the cache directory.
+  """
+  def __init__(self, directory=None, maxbytes=MAXBYTES):
+    self.directory = directory
+    self.maxbytes = maxbytes
+    self.enabled = True
+    self.counters = dictlib.AttrDict(hits=0, misses=0, stale=0, errors=0,
+        evictions=0)
+
+  def GetCacheNames(self, filename):
+    """Return the (array, header) cache file names for a data file."""
+    if self.directory is None:
+      base = filename
+    else:
+      digest = md5(os.path.abspath(filename)).hexdigest()
+      base = os.path.join(self.directory, digest)
+    return base + ARRAY_EXTENSION, base + HEADER_EXTENSION
+
+  def Read(self, filename, reader):
+    """Get the header and array of a data file, from the cache if it is
+    current, otherwise by calling reader(filename) and caching the result.
+    """
+    if not self.enabled:
+      return reader(filename)
+    st = os.stat(filename)
+    key = (st.st_size, st.st_mtime)
+    arrayname, headername = self.GetCacheNames(filename)
+    header = self._ReadHeader(headername, key)
+    if header is not None:
+      try:
+        a = numpy.load(arrayname, mmap_mode="c")
+      except (IOError, OSError, ValueError):
+        self.counters.errors += 1
+      else:
+        self.counters.hits += 1
+        if self.directory is not None:
+          _Touch(headername)
+        return header, a
+    self.counters.misses += 1
+    header, a = reader(filename)
+    self._Write(arrayname, headername, key, header, a)
+    return header, a
+
+  def _ReadHeader(self, headername, key):
+    try:
+      fo = open(headername)
+    except IOError:
+      return None
+    try:
+      lines = fo.read().split("\n")
+    finally:
+      fo.close()
+    try:
+      cachedkey = (int(lines[0]), float(lines[1]))
+    except (ValueError, IndexError):
+      self.counters.errors += 1
+      return None
+    if cachedkey != key:
+      self.counters.stale += 1
+      return None
+    return [h.decode("string_escape") for h in lines[2:-1]]
+
+  def _Write(self, arrayname, headername, key, header, a):
+    try:
+      if self.directory is not None:
+        if not os.path.isdir(self.directory):
+          os.makedirs(self.directory)
+        self.Evict(a.nbytes)
+      # written under temporary names, then renamed, so a reader never
+      # sees a partial file.
+      tmpname = "%s.%d.npy" % (arrayname, os.getpid())
+      numpy.save(tmpname, a)
+      os.rename(tmpname, arrayname)
+      tmpname = "%s.%d" % (headername, os.getpid())
+      fo = open(tmpname, "w")
+      try:
+        fo.write("%d\n%r\n" % key)
+        for h in header:
+          fo.write("%s\n" % str(h).encode("string_escape"))
+      finally:
+        fo.close()
+      os.rename(tmpname, headername)
+    except (IOError, OSError):
+      self.counters.errors += 1 # read-only data directory, just don't cache.
+
+  def Evict(self, needed=0):
+    """Remove the least recently used entries of the cache directory until
+    it has room for needed more bytes.
+
+    Returns:
+      number of entries removed.
+    """
+    if self.directory is None:
+      return 0
+    entries = []
+    total = 0
+    for fname in os.listdir(self.directory):
+      if not fname.endswith(HEADER_EXTENSION):
+        continue
+      base = os.path.join(self.directory, fname[:-len(HEADER_EXTENSION)])
+      try:
+        used = os.path.getmtime(base + HEADER_EXTENSION)
+        size = os.path.getsize(base + ARRAY_EXTENSION)
+      except OSError:
+        continue
+      entries.append((used, size, base))
+      total += size
+    entries.sort()
+    removed = 0
+    for used, size, base in entries:
+      if total + needed <= self.maxbytes:
+        break
+      for ext in (HEADER_EXTENSION, ARRAY_EXTENSION):
+        try:
+          os.unlink(base + ext)
+        except OSError:
+          pass
+      total -= size
+      removed += 1
+    self.counters.evictions += removed
+    return removed
+
+  def Remove(self, filename):
+    """Remove the cache files of a data file."""
+    for name in self.GetCacheNames(filename):
+      try:
+        os.unlink(name)
+      except OSError:
+        pass
+
+
+def _Touch(filename):
+  try:
+    os.utime(filename, None)
+  except OSError:
+    pass
+
+
+_cache = ParseCache()
+
+
+def GetCache():
+  """Get the cache that analyze.ReadArray uses."""
+  return _cache
+
+
+def SetCacheDirectory(directory, maxbytes=MAXBYTES):
+  """Keep the cache files in a directory, rather than next to the data."""
+  global _cache
+  _cache = ParseCache(directory, maxbytes)
+  return _cache
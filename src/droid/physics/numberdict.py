@@ -63,3 +63,8 @@ class NumberDict(dictlib.AttrDictDefault):
       new[key] = self[key] / other
     return new
 
+
+  # Attribute lookup falls back to the default value, so pickle would find
+  # a bogus __getstate__. Say how to rebuild the dictionary instead.
+  def __reduce__(self):
+    return (self.__class__, (dict(self), self._default))
@@ -11,6 +11,7 @@
 __author__ = 'dart@google.com (Keith Dart)'
 
 
+import itertools
 from cStringIO import StringIO
 
 from numpy import arange
@@ -23,6 +24,8 @@ from matplotlib.backends import backend_agg
 
 from PIL import Image
 
+from droid import decimate
+
 
 
 GRAPH_SIZE = (704, 440)
@@ -99,12 +102,62 @@ _MIMEMAP = {
 }
 
 class TimeDomainGraph(Graph):
+  """Plot of values over time.
+
+  Traces with many more samples than the image is wide are drawn as
+  min/max envelopes, so peaks stay visible and drawing time is bounded.
   """
-  """
+  def Initialize(self, ylabel=None):
+    self.ylabel = ylabel
+    self.traces = []
+    self.pyramids = []
+
+  def AddData(self, times, values, label, color=None):
+    self.traces.append((times, values, label, color))
+
+  def AddDataset(self, dataset, columns=None):
+    """Add columns of an analyze.DataSet."""
+    x_time, datacols, labels = dataset.GetColumns(columns)
+    colors = itertools.cycle(DEFAULT_COLORS)
+    for col, label in itertools.izip(datacols, labels):
+      self.AddData(x_time, col, label, colors.next())
+    if self.ylabel is None:
+      self.ylabel = dataset.unit
+
+  def AddPyramid(self, pyramid, start, end, label, color=None, column=1):
+    """Add a column from a decimate.Pyramid, between two times.
+
+    The level of detail is picked to match the image width when it is
+    rendered.
+    """
+    self.pyramids.append((pyramid, start, end, label, color, column))
 
   def GetImage(self, mimetype="image/png", **kwargs):
-    """
-    """
+    fig = self.GetFigure(**kwargs)
+    pixels = int(fig.get_figwidth() * fig.dpi)
+    ax = fig.add_subplot(111)
+    for times, values, label, color in self.traces:
+      envelope = decimate.Envelope(times, values, pixels)
+      if envelope is None:
+        ax.plot(times, values, color=color, label=label,
+            linewidth=GRAPH_LINEWIDTH)
+      else:
+        e_times, e_mins, e_maxs = envelope
+        ax.vlines(e_times, e_mins, e_maxs, color=color, label=label)
+    for pyramid, start, end, label, color, column in self.pyramids:
+      envelope = pyramid.GetEnvelope(start, end, pixels, column)
+      if envelope is None: # short span, use the finest detail there is.
+        if not len(pyramid):
+          continue
+        envelope = pyramid.GetLevelEnvelope(0, start, end, column)
+      e_times, e_mins, e_maxs = envelope
+      ax.vlines(e_times, e_mins, e_maxs, color=color, label=label)
+    ax.set_title(self.title)
+    ax.set_xlabel("Time (s)")
+    if self.ylabel:
+      ax.set_ylabel(self.ylabel)
+    ax.legend()
+    return self.RenderFigure(fig, mimetype)
 
 class LinePlot(Graph):
   pass # TODO(dart) implement...
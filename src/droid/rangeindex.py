@@ -0,0 +1,168 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Range query index for statistics over any window of time.
+
+A RangeIndex holds prefix sums of one data column (the values, their
+squares, and the charge, that is the values integrated over time), so the
+mean, RMS and charge of any window take two binary searches and a few
+subtractions. Extrema come from a sparse table over the minima and maxima
+of fixed size blocks of samples; only the partial blocks at the ends of
+the window are scanned.
+
+NaN values are left out of every statistic.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import numpy
+from pycopia import dictlib
+
+
+BLOCKSIZE = 256 # samples per block of the extrema index
+
+
+class RangeIndex(object):
+  """Index of one column of a data set.
+
+  Args:
+    times (array): time stamps, increasing.
+    values (array): the data column, same length.
+    blocksize (int): samples per block of the extrema index.
+  """
+  def __init__(self, times, values, blocksize=BLOCKSIZE):
+    self.times = numpy.ascontiguousarray(times, numpy.float64)
+    values = numpy.asarray(values, numpy.float64)
+    n = len(values)
+    self.blocksize = blocksize
+    finite = ~numpy.isnan(values)
+    clean = numpy.where(finite, values, 0.0)
+    # prefix arrays have one more element, so sums are p[j] - p[i].
+    self._count = _Prefix(finite.astype(numpy.int64))
+    self._sum = _Prefix(clean)
+    self._sumsq = _Prefix(clean * clean)
+    # trapezoid between each sample and the next, if both are valid.
+    charge = numpy.zeros((n,), numpy.float64)
+    if n > 1:
+      both = finite[1:] & finite[:-1]
+      charge[1:] = numpy.where(both,
+          (clean[1:] + clean[:-1]) * 0.5 * numpy.diff(self.times), 0.0)
+    self._charge = charge.cumsum()
+    self._values = values
+    self._mins = _SparseTable(_BlockReduce(numpy.where(finite, values,
+        numpy.inf), blocksize, numpy.minimum), numpy.minimum)
+    self._maxs = _SparseTable(_BlockReduce(numpy.where(finite, values,
+        -numpy.inf), blocksize, numpy.maximum), numpy.maximum)
+
+  def __len__(self):
+    return len(self.times)
+
+  def Find(self, start, end):
+    """Find the rows from start to end time, in seconds, relative to the
+    first time stamp (as analyze.TimeSlice does).
+    """
+    if not len(self.times):
+      return 0, 0
+    beginning = self.times[0]
+    return (int(self.times.searchsorted(beginning + start)),
+        int(self.times.searchsorted(beginning + end)))
+
+  def GetRangeStats(self, starti, endi):
+    """Statistics of rows starti up to, not including, endi.
+
+    Returns:
+      AttrDict with count, mean, rms, minimum, maximum (None if there are
+      no valid values), and charge (value units times seconds, between
+      the first and last row).
+    """
+    count = int(self._count[endi] - self._count[starti])
+    stats = dictlib.AttrDict(count=count, mean=None, rms=None,
+        minimum=None, maximum=None, charge=0.0)
+    if count:
+      stats.mean = (self._sum[endi] - self._sum[starti]) / count
+      meansq = (self._sumsq[endi] - self._sumsq[starti]) / count
+      stats.rms = numpy.sqrt(max(meansq, 0.0))
+      stats.minimum, stats.maximum = self.GetExtrema(starti, endi)
+    if endi - starti > 1:
+      stats.charge = self._charge[endi - 1] - self._charge[starti]
+    return stats
+
+  def GetWindowStats(self, start, end):
+    """Statistics of a window of time, relative to the first time stamp.
+
+    Returns:
+      the GetRangeStats AttrDict, plus the window's start and end row.
+    """
+    starti, endi = self.Find(start, end)
+    stats = self.GetRangeStats(starti, endi)
+    stats.start = starti
+    stats.end = endi
+    return stats
+
+  def GetExtrema(self, starti, endi):
+    """Minimum and maximum of the valid values in a range of rows."""
+    size = self.blocksize
+    firstblock = -(-starti // size) # first whole block
+    lastblock = endi // size # after the last whole block
+    if firstblock >= lastblock: # no whole block in range
+      parts = [self._values[starti:endi]]
+    else:
+      parts = [self._values[starti:firstblock * size],
+          self._values[lastblock * size:endi]]
+    lo = numpy.inf
+    hi = -numpy.inf
+    for part in parts:
+      part = part[~numpy.isnan(part)]
+      if len(part):
+        lo = min(lo, part.min())
+        hi = max(hi, part.max())
+    if firstblock < lastblock:
+      lo = min(lo, self._mins.Query(firstblock, lastblock))
+      hi = max(hi, self._maxs.Query(firstblock, lastblock))
+    if lo > hi: # nothing valid
+      return None, None
+    return float(lo), float(hi)
+
+
+def _Prefix(a):
+  rv = numpy.zeros((len(a) + 1,), a.dtype)
+  a.cumsum(out=rv[1:])
+  return rv
+
+
+def _BlockReduce(values, size, ufunc):
+  whole = len(values) - len(values) % size
+  if not whole:
+    return numpy.zeros((0,), numpy.float64)
+  return ufunc.reduce(values[:whole].reshape((-1, size)), axis=1)
+
+
+class _SparseTable(object):
+  """Answers min (or max) over any range of an array in constant time.
+
+  Level k holds the reduction of each run of 2**k elements.
+  """
+  def __init__(self, values, ufunc):
+    self._ufunc = ufunc
+    self._levels = [values]
+    width = 1
+    while width * 2 <= len(values):
+      prev = self._levels[-1]
+      self._levels.append(ufunc(prev[:len(prev) - width], prev[width:]))
+      width *= 2
+
+  def Query(self, i, j):
+    """Reduce elements i up to, not including, j (j > i)."""
+    k = _Log2(j - i)
+    level = self._levels[k]
+    return self._ufunc(level[i], level[j - (1 << k)])
+
+
+def _Log2(n):
+  k = 0
+  while (2 << k) <= n:
+    k += 1
+  return k
@@ -43,3 +43,15 @@ class Report(object):
   def WriteTextRecord(self, *args):
     """Write a record where all arguments are strings (faster)."""
     raise NotImplementedError
+
+  def WriteArray(self, array):
+    """Write many records, one per row of a two dimensional array."""
+    for row in array:
+      self.WriteRecord(*row)
+
+  def WriteBlock(self, timestamp, interval, values):
+    """Write samples taken at a fixed interval as (time stamp, value)
+    records.
+    """
+    from droid.reports import core
+    core.WriteBlock(self, timestamp, interval, values)
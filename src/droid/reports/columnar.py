@@ -0,0 +1,274 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Binary columnar data files.
+
+The file has a fixed size header followed by a body of fixed size,
+little-endian records. The header holds the column labels (same "name
+(unit)" form the text reports use) and the type of each column. There is
+no record count in the header, so records may be appended to an existing
+file at any time. The record count is derived from the file size, and a
+partially written trailing record is ignored.
+
+Header layout (HEADER_SIZE bytes, zero padded):
+
+  magic (8 bytes), version (uint16), number of columns (uint16),
+  reserved (uint32), then for each column: type code (2 bytes, e.g. "f8")
+  and label (62 bytes, NUL padded).
+
+Files are read back with numpy.memmap, so opening a large capture does
+not read or parse the data.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import os
+import struct
+
+import numpy
+
+from droid.reports import core
+
+
+MAGIC = "PDCOL\x00\r\n"
+VERSION = 1
+HEADER_SIZE = 4096
+_PREAMBLE = "<8sHHI"
+_COLUMN = "<2s62s"
+_PREAMBLE_SIZE = struct.calcsize(_PREAMBLE)
+_COLUMN_SIZE = struct.calcsize(_COLUMN)
+MAXCOLUMNS = (HEADER_SIZE - _PREAMBLE_SIZE) // _COLUMN_SIZE
+
+# column type code: struct format character
+TYPECODES = {
+  "f8": "d",
+  "f4": "f",
+  "i8": "q",
+  "i4": "i",
+}
+DEFAULT_TYPE = "f8"
+
+# SCPI special values are stored as IEEE equivalents.
+_SPECIALS = {
+  9.91E+37: numpy.nan,
+  9.9E+37: numpy.inf,
+  -9.9E+37: -numpy.inf,
+}
+
+
+class ColumnarReport(core.BaseDatafile):
+  """Writes measurement records to a binary columnar data file.
+
+  If the context has a true "append" attribute, and the file already
+  exists with the same columns, new records are appended to it.
+  """
+  EXTENSION = ".pdc"
+  filename = None
+
+  def __init__(self, context):
+    self._filename = context.datafilename
+    self._append = getattr(context, "append", False)
+    self._fo = None
+    self._format = None
+    self._converters = None
+    self._dtype = None
+
+  name = property(lambda self: self.filename)
+
+  def Initialize(self):
+    if self._filename == "-":
+      raise core.DatafileError("Binary data files cannot be written to stdout.")
+    basename, ext = os.path.splitext(self._filename)
+    self.filename = basename + self.EXTENSION
+    if self._append and os.path.exists(self.filename):
+      self._fo = open(self.filename, "r+b")
+      self._fo.seek(0, 2)
+    else:
+      self._fo = open(self.filename, "wb")
+
+  def Finalize(self):
+    if self._fo is not None:
+      self._fo.close()
+      self._fo = None
+
+  def SetColumns(self, *args, **kwargs):
+    """Sets the column headings, and writes the file header.
+
+    Args:
+      Any number of strings, the column labels.
+      types (keyword, optional): sequence of type codes (keys of
+      TYPECODES), one per column. Default is all "f8".
+    """
+    types = kwargs.get("types") or [DEFAULT_TYPE] * len(args)
+    if len(types) != len(args):
+      raise core.DatafileError("Need one type code per column.")
+    if len(args) > MAXCOLUMNS:
+      raise core.DatafileError("Too many columns (max %d)." % MAXCOLUMNS)
+    header = (list(args), list(types))
+    if self._fo.tell() > 0: # appending
+      self._fo.seek(0)
+      try:
+        oldheader = ReadHeader(self._fo)
+      finally:
+        self._fo.seek(0, 2)
+      if oldheader != header:
+        raise core.DatafileError(
+            "Columns do not match existing file %r." % self.filename)
+      self._TrimPartial(header)
+    else:
+      self._fo.write(EncodeHeader(*header))
+    self._format = "<" + "".join([TYPECODES[t] for t in types])
+    self._converters = [_GetConverter(t) for t in types]
+    self._dtype = GetRecordDtype(*header)
+
+  def _TrimPartial(self, header):
+    recsize = GetRecordDtype(*header).itemsize
+    end = self._fo.tell()
+    extra = (end - HEADER_SIZE) % recsize
+    if extra:
+      self._fo.truncate(end - extra)
+      self._fo.seek(0, 2)
+
+  def WriteRecord(self, *args):
+    self._fo.write(struct.pack(self._format,
+        *[conv(arg) for conv, arg in zip(self._converters, args)]))
+
+  def WriteTextRecord(self, *args):
+    self.WriteRecord(*args)
+
+  def WriteArray(self, array):
+    """Write many records, converted as WriteRecord does, with one write.
+
+    Args:
+      array: two dimensional array, one record per row.
+    """
+    rows = numpy.asarray(array)
+    if not len(rows):
+      return
+    records = numpy.empty((len(rows),), self._dtype)
+    for i, name in enumerate(self._dtype.names):
+      if self._dtype[i].kind == "f":
+        records[name] = _ConvertFloats(rows[:, i])
+      else:
+        records[name] = rows[:, i]
+    self._fo.write(records.tostring())
+
+
+def _GetConverter(typecode):
+  """Return a function that converts a record value for the column type."""
+  if typecode[0] == "f":
+    return _ConvertFloat
+  else:
+    return int
+
+
+def _ConvertFloat(value):
+  value = float(value)
+  return _SPECIALS.get(value, value)
+
+
+def _ConvertFloats(values):
+  values = numpy.array(values, numpy.float64)
+  for special, value in _SPECIALS.items():
+    values[values == special] = value
+  return values
+
+
+def EncodeHeader(labels, types):
+  """Return the fixed size header for the given labels and types."""
+  parts = [struct.pack(_PREAMBLE, MAGIC, VERSION, len(labels), 0)]
+  for label, typecode in zip(labels, types):
+    if typecode not in TYPECODES:
+      raise core.DatafileError("Unsupported column type: %r" % (typecode,))
+    if len(label) > _COLUMN_SIZE - 2:
+      raise core.DatafileError("Column label too long: %r" % (label,))
+    parts.append(struct.pack(_COLUMN, typecode, label))
+  header = "".join(parts)
+  return header + "\x00" * (HEADER_SIZE - len(header))
+
+
+def ReadHeader(fo):
+  """Read the header from an open file object.
+
+  Returns:
+    tuple of (list of labels, list of type codes).
+  """
+  header = fo.read(HEADER_SIZE)
+  if len(header) < HEADER_SIZE:
+    raise core.DatafileError("Truncated binary data file header.")
+  magic, version, ncols, unused_ = struct.unpack(
+      _PREAMBLE, header[:_PREAMBLE_SIZE])
+  if magic != MAGIC:
+    raise core.DatafileError("Not a binary columnar data file.")
+  if version > VERSION:
+    raise core.DatafileError("Unsupported file version: %s" % version)
+  labels = []
+  types = []
+  offset = _PREAMBLE_SIZE
+  for i in range(ncols):
+    typecode, label = struct.unpack(_COLUMN,
+        header[offset:offset + _COLUMN_SIZE])
+    types.append(typecode)
+    labels.append(label.rstrip("\x00"))
+    offset += _COLUMN_SIZE
+  return labels, types
+
+
+def GetRecordDtype(labels, types):
+  """Return the numpy record dtype for one row of the file body."""
+  return numpy.dtype([("f%d" % i, "<" + t) for i, t in enumerate(types)])
+
+
+def MapArray(filename, mode="c"):
+  """Map the data in a binary columnar file into memory.
+
+  No data is read or copied. If all columns are the same type the result
+  is a two dimensional array, organized in rows, just like ReadArray
+  returns for text files. Otherwise it is a one dimensional record array
+  with fields "f0", "f1", etc.
+
+  Args:
+    filename (string): name of the .pdc file.
+    mode (string): numpy.memmap mode. The default, "c", is copy-on-write,
+    so in-place changes (e.g. NormalizeTime) never touch the file.
+
+  Returns:
+    tuple of (list of labels, array).
+  """
+  fo = open(filename, "rb")
+  try:
+    labels, types = ReadHeader(fo)
+    fo.seek(0, 2)
+    size = fo.tell()
+  finally:
+    fo.close()
+  rowtype = GetRecordDtype(labels, types)
+  count = (size - HEADER_SIZE) // rowtype.itemsize
+  if count <= 0:
+    return labels, numpy.zeros((0, len(labels)), numpy.float64)
+  if len(set(types)) == 1:
+    a = numpy.memmap(filename, dtype="<" + types[0], mode=mode,
+        offset=HEADER_SIZE, shape=(count, len(labels)))
+  else:
+    a = numpy.memmap(filename, dtype=rowtype, mode=mode,
+        offset=HEADER_SIZE, shape=(count,))
+  return labels, a
+
+
+def ToFloatArray(a):
+  """Return a two dimensional float64 array from a mapped array.
+
+  This is a no-op (zero-copy) for homogeneous float64 files.
+  """
+  if a.dtype.names is None:
+    if a.dtype == numpy.float64:
+      return a
+    return a.astype(numpy.float64)
+  rows = numpy.empty((len(a), len(a.dtype.names)), numpy.float64)
+  for i, name in enumerate(a.dtype.names):
+    rows[:, i] = a[name]
+  return rows
+
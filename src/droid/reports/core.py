@@ -11,6 +11,7 @@ Supports constructing data holder formats of various types.
 
 import os
 
+import numpy
 from pycopia import dictlib
 from pycopia import module
 
@@ -21,6 +22,7 @@ DATAFORMATS = { # name: implementation (class object)
   "dat": "droid.reports.flatfile.GnuplotReport",
   "csv": "droid.reports.flatfile.CsvReport",
   "rrd": "droid.reports.rrd.RRDReport",
+  "pdc": "droid.reports.columnar.ColumnarReport",
 #  "hdf": "droid.reports.hdf5.HDF5Datafile",
 #  "h5": "droid.reports.hdf5.HDF5Datafile",
 #  "db": "droid.reports.database.DataBaseReport",
@@ -82,6 +84,48 @@ class BaseDatafile(object):
     """
     raise NotImplementedError
 
+  def WriteArray(self, array):
+    """Write many records at once.
+
+    This implementation writes them one at a time. Writers that can,
+    format and write the whole array in one go.
+
+    Args:
+      array: two dimensional array (or sequence of sequences), one record
+      per row.
+    """
+    for row in array:
+      self.WriteRecord(*row)
+
+  def WriteBlock(self, timestamp, interval, values):
+    """Write a block of samples taken at a fixed interval, such as an
+    instrument's sample array, as (time stamp, value) records.
+
+    Args:
+      timestamp (float): the time of the first sample.
+      interval (float): the time between samples.
+      values: sequence of sample values.
+    """
+    WriteBlock(self, timestamp, interval, values)
+
+
+def WriteBlock(report, timestamp, interval, values):
+  """Write a block of evenly spaced samples with the report's WriteArray.
+
+  Works with any report object that has WriteArray. The time stamps are
+  summed one interval at a time, as a WriteRecord loop doing "timestamp
+  += interval" makes them, so the records are the same to the last bit.
+  """
+  values = numpy.asarray(values, numpy.float64)
+  block = numpy.empty((len(values), 2), numpy.float64)
+  if len(values):
+    times = block[:, 0]
+    times[0] = timestamp
+    times[1:] = interval
+    numpy.add.accumulate(times, out=times)
+  block[:, 1] = values
+  report.WriteArray(block)
+
 
 class Metadata(dictlib.AttrDict):
   def __str__(self):
@@ -13,10 +13,15 @@ __author__ = 'dart@google.com (Keith Dart)'
 
 import sys
 import os
+import itertools
+from cStringIO import StringIO
 
 from droid.reports import core
 
 
+BLOCKROWS = 8192 # rows formatted, and written, at a time by WriteArray
+
+
 class FileReport(core.BaseDatafile):
   EXTENSION = ".txt"
   filename = None
@@ -54,6 +59,14 @@ class FileReport(core.BaseDatafile):
   def WriteTextRecord(self, *args):
     self._fo.write("\t".join(args))
 
+  def WriteArray(self, array):
+    """Write many records, formatted as WriteRecord does, with one string
+    formatting operation and one write per block of rows.
+    """
+    for block in _IterBlocks(array):
+      fmt = "\t".join(["%r"] * len(block[0])) + "\n"
+      self._fo.write((fmt * len(block)) % tuple(itertools.chain(*block)))
+
 
 class CsvReport(FileReport):
   EXTENSION = ".csv"
@@ -77,6 +90,13 @@ class CsvReport(FileReport):
   def WriteTextRecord(self, *args):
     self._csv.writerow([s.strip() for s in args])
 
+  def WriteArray(self, array):
+    import csv
+    for block in _IterBlocks(array):
+      buf = StringIO()
+      csv.writer(buf).writerows(block)
+      self._fo.write(buf.getvalue())
+
 
 class GnuplotReport(FileReport):
   EXTENSION = ".dat"
@@ -94,4 +114,11 @@ class GnuplotReport(FileReport):
     self._fo.write("\t".join(args))
 
 
-
+def _IterBlocks(array):
+  """Yield lists of up to BLOCKROWS rows, each a list of Python numbers."""
+  try:
+    rows = array.tolist()
+  except AttributeError:
+    rows = [list(row) for row in array]
+  for start in xrange(0, len(rows), BLOCKROWS):
+    yield rows[start:start + BLOCKROWS]
@@ -49,6 +49,13 @@ class RRDReport(Report):
   def WriteRecord(self, *args):
     rrdtool.update(self._filename, ":".join(map(repr, args)))
 
+  def WriteArray(self, array):
+    """Write many records with one rrdtool update per block of rows."""
+    from droid.reports import flatfile
+    for block in flatfile._IterBlocks(array):
+      rrdtool.update(self._filename,
+          *[":".join(map(repr, row)) for row in block])
+
   def RRDGraph(self):
     lasttime = rrdtool.last(self._filename)
     gfilename = os.path.splitext(self._filename)[0] + ".png"
@@ -0,0 +1,130 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Cache of results computed from data files.
+
+Results, such as battery life reports, are kept in a sidecar file next to
+the data file they were computed from (see SIDECAR_EXTENSION). Each is
+keyed by a tuple of the parameters it was computed with (for example the
+battery model and the time marks), and is valid only as long as the data
+file has the same size and modification time. Charts of many files then
+only compute the results of new or changed files.
+
+Results are stored as JSON, so they must be made of dicts, lists,
+strings, numbers, booleans and None. Reading a sidecar never runs code,
+since the data directory may be shared. Keys should include a version of
+the computation, so results from an older one are not used.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import os
+
+try:
+  import json
+except ImportError: # Python 2.4, 2.5
+  import simplejson as json
+
+from pycopia import dictlib
+
+
+SIDECAR_EXTENSION = ".results.json"
+
+FORMAT = 1 # of the sidecar file
+
+
+class ResultCache(object):
+  """Keeps results of computations on data files."""
+  def __init__(self):
+    self.enabled = True
+    self.counters = dictlib.AttrDict(hits=0, misses=0, errors=0)
+    self._loaded = {} # sidecar name: (file key, results)
+
+  def Get(self, filename, key, default=None):
+    """Get a cached result, or default if there is no current one."""
+    if not self.enabled:
+      return default
+    stamp, results = self._Load(filename)
+    try:
+      value = results[repr(key)]
+    except KeyError:
+      self.counters.misses += 1
+      return default
+    self.counters.hits += 1
+    return value
+
+  def Put(self, filename, key, value):
+    """Cache a result. The sidecar file is rewritten at once."""
+    if not self.enabled:
+      return
+    stamp, results = self._Load(filename)
+    results[repr(key)] = value
+    sidecar = GetSidecarName(filename)
+    tmpname = "%s.%d" % (sidecar, os.getpid())
+    try:
+      data = json.dumps({"format": FORMAT, "stamp": list(stamp),
+          "results": results})
+    except (TypeError, ValueError):
+      del results[repr(key)]
+      raise ValueError("ResultCache: result is not JSON serializable: %r" %
+          (value,))
+    try:
+      fo = open(tmpname, "w")
+      try:
+        fo.write(data)
+      finally:
+        fo.close()
+      os.rename(tmpname, sidecar)
+    except (IOError, OSError):
+      self.counters.errors += 1 # read-only data directory, just don't cache.
+
+  def Remove(self, filename):
+    """Remove the cached results of a data file."""
+    sidecar = GetSidecarName(filename)
+    self._loaded.pop(sidecar, None)
+    try:
+      os.unlink(sidecar)
+    except OSError:
+      pass
+
+  def _Load(self, filename):
+    st = os.stat(filename)
+    stamp = [st.st_size, st.st_mtime]
+    sidecar = GetSidecarName(filename)
+    try:
+      cached = self._loaded[sidecar]
+    except KeyError:
+      cached = None
+    if cached is None or cached[0] != stamp:
+      cached = (stamp, {})
+      try:
+        fo = open(sidecar)
+      except IOError:
+        pass
+      else:
+        try:
+          try:
+            saved = json.load(fo)
+            if saved["format"] == FORMAT and saved["stamp"] == stamp:
+              cached = (stamp, dict(saved["results"]))
+          except (ValueError, TypeError, KeyError):
+            self.counters.errors += 1
+        finally:
+          fo.close()
+      self._loaded[sidecar] = cached
+    return cached
+
+
+def GetSidecarName(filename):
+  return filename + SIDECAR_EXTENSION
+
+
+_cache = ResultCache()
+
+
+def GetCache():
+  """Get the cache that the analyze module uses."""
+  return _cache
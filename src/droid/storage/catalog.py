@@ -0,0 +1,404 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Persistent catalog of the data files in a data directory.
+
+The metadata encoded in data file path names (see the datafile module) is
+decoded once and kept in a SQLite database, along with summary statistics
+of the data. A refresh only decodes files that are new, or have changed
+since the last refresh, by modification time and size. Queries then do
+not touch the data directory at all.
+
+The catalog is stored, by default, in the top of the data directory, as
+CATALOG_NAME.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import os
+
+try:
+  import sqlite3
+except ImportError: # Python 2.4
+  from pysqlite2 import dbapi2 as sqlite3
+
+from pycopia import dictlib
+from pycopia import timelib
+
+from droid.storage import datafile
+
+
+CATALOG_NAME = ".catalog.sqlite"
+
+DATA_EXTENSIONS = (".txt", ".csv", ".dat", ".pdc")
+
+_TIMEFORMAT = "%Y%m%d%H%M%S"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+  id INTEGER PRIMARY KEY,
+  pathname TEXT UNIQUE NOT NULL,
+  mtime REAL,
+  size INTEGER,
+  testcase TEXT,
+  product TEXT,
+  buildtype TEXT,
+  buildid TEXT,
+  timestamp TEXT,
+  rollup REAL,
+  voltage REAL,
+  samples INTEGER,
+  statsmtime REAL,
+  mean REAL,
+  maximum REAL,
+  minimum REAL,
+  median REAL,
+  crestfactor REAL
+);
+CREATE TABLE IF NOT EXISTS states (
+  file INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_buildid ON files (buildid, testcase);
+CREATE INDEX IF NOT EXISTS files_product ON files (product, buildtype);
+CREATE INDEX IF NOT EXISTS files_testcase ON files (testcase);
+CREATE INDEX IF NOT EXISTS states_file ON states (file, name, value);
+"""
+
+# query keyword: files table column
+_FILECOLUMNS = {
+  "testcase": "testcase",
+  "product": "product",
+  "buildtype": "buildtype",
+  "buildid": "buildid",
+  "rollup": "rollup",
+  "voltage": "voltage",
+  "samples": "samples",
+}
+
+STATNAMES = ("mean", "maximum", "minimum", "median", "crestfactor")
+
+# file ids per query, below SQLite's limit on the size of a statement.
+_MAXIDS = 500
+
+# What reading a file that is not a proper data file may raise. The header
+# of a .txt file is evaluated.
+_READERRORS = (IOError, OSError, ValueError, ZeroDivisionError, IndexError,
+    TypeError, NameError, SyntaxError, AttributeError)
+
+
+class Catalog(object):
+  """An index of data files, their metadata and summary statistics.
+
+  Args:
+    filename (string): name of the SQLite database file. It is created
+    if it does not exist.
+  """
+  def __init__(self, filename):
+    self.filename = filename
+    self._conn = sqlite3.connect(filename)
+    self._conn.text_factory = str
+    self._conn.executescript(_SCHEMA)
+
+  def close(self):
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+
+  def __len__(self):
+    return self._conn.execute("SELECT count(*) FROM files").fetchone()[0]
+
+  def Refresh(self, topdir):
+    """Bring the catalog up to date with the files under a directory.
+
+    Returns:
+      tuple of counts of (added, updated, removed) files.
+    """
+    topdir = os.path.abspath(topdir)
+    known = {}
+    for fid, pathname, mtime, size in self._conn.execute(
+          "SELECT id, pathname, mtime, size FROM files "
+          "WHERE pathname LIKE ? ESCAPE '\\'",
+          (_LikePrefix(topdir),)):
+      known[pathname] = (fid, mtime, size)
+    added = updated = 0
+    cursor = self._conn.cursor()
+    try:
+      for pathname, st in _WalkDataFiles(topdir):
+        try:
+          fid, mtime, size = known.pop(pathname)
+        except KeyError:
+          self._Insert(cursor, pathname, st)
+          added += 1
+        else:
+          if mtime != st.st_mtime or size != st.st_size:
+            self._Delete(cursor, fid)
+            self._Insert(cursor, pathname, st)
+            updated += 1
+      # what is left was removed from the file system.
+      for fid, mtime, size in known.values():
+        self._Delete(cursor, fid)
+    except:
+      self._conn.rollback()
+      raise
+    self._conn.commit()
+    return added, updated, len(known)
+
+  def _Insert(self, cursor, pathname, st):
+    data = datafile.DecodeFullPathName(pathname)
+    build = dict.get(data, "build") or dictlib.AttrDict()
+    cursor.execute("INSERT INTO files (pathname, mtime, size, testcase, "
+        "product, buildtype, buildid, timestamp, rollup, voltage, samples) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (pathname, st.st_mtime, st.st_size, data.testcase,
+        build.get("product"), build.get("type"), build.get("id"),
+        data.timestamp.strftime(_TIMEFORMAT), data.rollup, data.voltage,
+        data.samples))
+    fid = cursor.lastrowid
+    cursor.executemany("INSERT INTO states (file, name, value) "
+        "VALUES (?, ?, ?)",
+        [(fid, name, str(value)) for name, value in
+        data._GetStates().items()])
+
+  def _Delete(self, cursor, fid):
+    cursor.execute("DELETE FROM states WHERE file = ?", (fid,))
+    cursor.execute("DELETE FROM files WHERE id = ?", (fid,))
+
+  def Query(self, **kwargs):
+    """Find data files by metadata.
+
+    Keyword arguments name either one of the fixed fields (testcase,
+    product, buildtype, buildid, rollup, voltage, samples) or a state,
+    e.g. Query(buildid="12345", testcase="idle", radio="ON").
+
+    Returns:
+      list of datafile.DataFileData objects, in path name order. They
+      also have the cached summary statistics as attributes, or None
+      for those that have not been computed (see UpdateStats).
+    """
+    sql, params = _MakeQuery("*", kwargs)
+    rows = self._conn.execute(sql, params).fetchall()
+    return self._MakeMetadata(rows)
+
+  def GetPathNames(self, **kwargs):
+    """Like Query, but return just the path names."""
+    sql, params = _MakeQuery("pathname", kwargs)
+    return [row[0] for row in self._conn.execute(sql, params)]
+
+  def GetMetadata(self, pathname):
+    """Get the metadata of one file, or None if it is not in the catalog,
+    or has changed since it was.
+    """
+    pathname = os.path.abspath(pathname)
+    rows = self._conn.execute("SELECT * FROM files WHERE pathname = ?",
+        (pathname,)).fetchall()
+    if not rows:
+      return None
+    try:
+      st = os.stat(pathname)
+    except OSError:
+      return None
+    data = self._MakeMetadata(rows)[0]
+    if data.mtime != st.st_mtime or data.size != st.st_size:
+      return None
+    return data
+
+  def _MakeMetadata(self, rows):
+    if not rows:
+      return []
+    states = {}
+    for i in xrange(0, len(rows), _MAXIDS):
+      ids = ",".join([str(row[0]) for row in rows[i:i + _MAXIDS]])
+      for fid, name, value in self._conn.execute(
+            "SELECT file, name, value FROM states WHERE file IN (%s)" % ids):
+        states.setdefault(fid, []).append((name, value))
+    rv = []
+    for row in rows:
+      (fid, pathname, mtime, size, testcase, product, buildtype, buildid,
+          timestamp, rollup, voltage, samples, statsmtime) = row[:13]
+      data = datafile.DataFileData()
+      data.pathname = pathname
+      data.testcase = testcase
+      if product is None:
+        data.build = None
+      else:
+        data.build = dictlib.AttrDict(product=product, type=buildtype,
+            id=buildid)
+      mt = timelib.strptime_mutable(timestamp, _TIMEFORMAT)
+      mt.set_format("%a, %d %b %Y %H:%M:%S %Z")
+      data.timestamp = mt
+      data.rollup = rollup
+      data.voltage = voltage
+      data.samples = samples
+      for name, value in states.get(fid, ()):
+        data[name] = datafile._STATEMAP.get(value, value)
+      # not part of the metadata proper, so set on the instance.
+      data.__dict__["mtime"] = mtime
+      data.__dict__["size"] = size
+      if statsmtime == mtime:
+        stats = row[13:]
+      else:
+        stats = (None,) * len(STATNAMES)
+      for name, value in zip(STATNAMES, stats):
+        data.__dict__[name] = value
+      rv.append(data)
+    return rv
+
+  def SetStats(self, pathname, mtime, stats):
+    """Cache the summary statistics of a file.
+
+    Args:
+      pathname (string): the data file.
+      mtime (float): the modification time of the file the statistics
+      were computed from.
+      stats: mean, maximum, minimum, median, crestfactor, as floats.
+    """
+    self._conn.execute("UPDATE files SET statsmtime = ?, mean = ?, "
+        "maximum = ?, minimum = ?, median = ?, crestfactor = ? "
+        "WHERE pathname = ?",
+        (mtime,) + tuple(map(float, stats)) + (os.path.abspath(pathname),))
+    self._conn.commit()
+
+  def UpdateStats(self, **kwargs):
+    """Compute and cache the summary statistics of files that do not have
+    them, or have changed since they were computed.
+
+    The same keyword arguments as Query select the files to update.
+    The files are read with analyze.StreamingDataSet, so large files do not
+    need to fit in memory.
+
+    Returns:
+      number of files updated.
+    """
+    from droid import analyze
+    count = 0
+    for data in self.Query(**kwargs):
+      if data.mean is not None:
+        continue
+      try:
+        ds = analyze.StreamingDataSet(data.pathname)
+        stats = [float(getattr(v, "value", v)) for v in ds.GetStats()]
+      except _READERRORS: # not a data file after all, or a broken one.
+        continue
+      self.SetStats(data.pathname, data.mtime, stats)
+      count += 1
+    return count
+
+
+def GetCatalog(config):
+  """Get the catalog of the configured data directory."""
+  return Catalog(os.path.join(config.DATABASEDIR, CATALOG_NAME))
+
+
+# process id: {directory: the Catalog above it, or None}. A process
+# forked from one that opened a catalog (such as a worker of
+# droid.util.workers) must not use its SQLite connection, so it opens its
+# own. The parent's are kept, so the child does not close them either.
+_catalogs = {}
+
+def FindCatalog(pathname):
+  """Find the catalog of the data directory a file is in.
+
+  The catalog is looked for in the file's directory, and each directory
+  above it. What is found is remembered for each directory searched.
+
+  Returns:
+    a Catalog, or None if there is none.
+  """
+  dirname = os.path.dirname(os.path.abspath(pathname))
+  catalogs = _catalogs.setdefault(os.getpid(), {})
+  searched = []
+  cat = None
+  while 1:
+    try:
+      cat = catalogs[dirname]
+      break
+    except KeyError:
+      pass
+    searched.append(dirname)
+    filename = os.path.join(dirname, CATALOG_NAME)
+    if os.path.isfile(filename):
+      try:
+        cat = Catalog(filename)
+      except sqlite3.Error:
+        cat = None
+      break
+    parent = os.path.dirname(dirname)
+    if parent == dirname:
+      break
+    dirname = parent
+  for dirname in searched:
+    catalogs[dirname] = cat
+  return cat
+
+
+def GetMetadata(pathname):
+  """Get the metadata of a data file.
+
+  It is taken from the catalog of its data directory if the file is
+  current there, so it also has any cached statistics (see Query).
+  Otherwise the path name is decoded, as datafile.DecodeFullPathName does.
+  """
+  cat = FindCatalog(pathname)
+  if cat is not None:
+    data = cat.GetMetadata(pathname)
+    if data is not None:
+      data.pathname = pathname
+      return data
+  return datafile.DecodeFullPathName(pathname)
+
+
+def GetCachedStats(data):
+  """Get the cached statistics from metadata that GetMetadata returned.
+
+  Returns:
+    mean, maximum, minimum, median, crestfactor as floats, or None if
+    they are not cached.
+  """
+  stats = [data.__dict__.get(name) for name in STATNAMES]
+  if None in stats:
+    return None
+  return stats
+
+
+def _MakeQuery(columns, selection):
+  where = []
+  params = []
+  for name, value in selection.items():
+    try:
+      column = _FILECOLUMNS[name]
+    except KeyError:
+      where.append("EXISTS (SELECT 1 FROM states "
+          "WHERE file = files.id AND name = ? AND value = ?)")
+      params.extend((name, str(value)))
+    else:
+      where.append("%s = ?" % column)
+      params.append(value)
+  sql = "SELECT %s FROM files" % columns
+  if where:
+    sql += " WHERE " + " AND ".join(where)
+  return sql + " ORDER BY pathname", params
+
+
+def _WalkDataFiles(topdir):
+  for dirpath, dirnames, filenames in os.walk(topdir):
+    for fname in filenames:
+      if fname.startswith("."):
+        continue
+      if os.path.splitext(fname)[1] in DATA_EXTENSIONS:
+        pathname = os.path.join(dirpath, fname)
+        try:
+          yield pathname, os.stat(pathname)
+        except OSError: # removed while walking
+          pass
+
+
+def _LikePrefix(dirname):
+  """Return a LIKE pattern matching all path names below a directory."""
+  for char in "\\%_":
+    dirname = dirname.replace(char, "\\" + char)
+  return dirname.rstrip("/") + "/%"
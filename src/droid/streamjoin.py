@@ -0,0 +1,193 @@
+#!/usr/bin/python2.4
+# -*- coding: us-ascii -*-
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""Join data sets that were sampled at different times.
+
+Measurers write the time stamps of their samples from the same clock,
+but at their own periods, so, for example, a voltage log and a current
+log of one run do not line up row for row. Join puts the data columns of
+several data sets onto one time base, either by linear interpolation or
+by taking the last sample at or before each time ("as of" join). All of
+it is done with whole-array operations.
+
+AddPowerAndEnergy then derives power (V times I) and cumulative energy
+columns from a joined data set.
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+import numpy
+
+from droid import analyze
+
+
+INTERPOLATE = "interpolate"
+ASOF = "asof"
+METHODS = (INTERPOLATE, ASOF)
+
+
+def Interpolate(times, sampletimes, values):
+  """Linearly interpolate samples at other times.
+
+  Times outside of the sampled span get NaN, as do times next to a NaN
+  sample.
+  """
+  return numpy.interp(times, sampletimes, values, left=numpy.nan,
+      right=numpy.nan)
+
+
+def AsOf(times, sampletimes, values):
+  """Take the value of the last sample at or before each time.
+
+  Times before the first sample get NaN.
+  """
+  index = sampletimes.searchsorted(times, side="right") - 1
+  rv = values[numpy.maximum(index, 0)].astype(numpy.float64)
+  rv[index < 0] = numpy.nan
+  return rv
+
+
+_ALIGNERS = {
+  INTERPOLATE: Interpolate,
+  ASOF: AsOf,
+}
+
+
+def GetTimebase(datasets, period=None):
+  """Get a common time base for data sets, over the span they all cover.
+
+  Args:
+    datasets (list): DataSet objects, with time stamps from the same
+    clock (that is, not normalized).
+    period (float, optional): time between rows, in seconds. Default is
+    to use the time stamps of the first data set.
+
+  Returns:
+    array of time stamps.
+  """
+  start = max([ds.measurements[0, 0] for ds in datasets])
+  end = min([ds.measurements[-1, 0] for ds in datasets])
+  if start > end:
+    raise ValueError("Data sets do not overlap in time.")
+  if period is None:
+    times = datasets[0].measurements[:, 0]
+    times = times[times.searchsorted(start):
+        times.searchsorted(end, side="right")]
+    if not len(times):
+      raise ValueError("First data set has no samples where they overlap.")
+    return times
+  count = int(numpy.floor((end - start) / period)) + 1
+  return start + numpy.arange(count) * float(period)
+
+
+def Join(datasets, method=INTERPOLATE, timebase=None, period=None):
+  """Join the data columns of several data sets on one time base.
+
+  Args:
+    datasets (list): DataSet objects, with time stamps from the same clock.
+    method (string): INTERPOLATE or ASOF.
+    timebase (array, optional): the time stamps to align to. Default is
+    from GetTimebase(datasets, period).
+
+  Returns:
+    a new DataSet, with the time column of the first data set followed by
+    the data columns of each data set in turn. Its metadata is that of the
+    first data set.
+  """
+  try:
+    align = _ALIGNERS[method]
+  except KeyError:
+    raise ValueError("Join: method must be one of %s, not %r." % (
+        ", ".join(METHODS), method))
+  if timebase is None:
+    timebase = GetTimebase(datasets, period)
+  timebase = numpy.asarray(timebase, numpy.float64)
+  ncols = 1 + sum([len(ds.labels) - 1 for ds in datasets])
+  joined = numpy.empty((len(timebase), ncols), numpy.float64)
+  joined[:, 0] = timebase
+  headers = ["%s (%s)" % (datasets[0].labels[0], datasets[0].units[0])]
+  col = 1
+  for ds in datasets:
+    sampletimes = numpy.ascontiguousarray(ds.measurements[:, 0])
+    for n in range(1, len(ds.labels)):
+      joined[:, col] = align(timebase, sampletimes, ds.measurements[:, n])
+      headers.append("%s (%s)" % (ds.labels[n], ds.units[n]))
+      col += 1
+  return _MakeDataSet(joined, headers, datasets[0].metadata)
+
+
+def AddPowerAndEnergy(dataset, voltagecolumn=None, currentcolumn=None):
+  """Add power and cumulative energy columns to a joined data set.
+
+  Args:
+    dataset (DataSet): has a voltage column (unit V) and a current column
+    (unit A or mA), such as the Join of a voltage and a current data set.
+    voltagecolumn, currentcolumn (int, optional): the column numbers.
+    Default is the first column with a suitable unit.
+
+  Returns:
+    a new DataSet with "Power (W)" and "Energy (J)" columns added. Energy
+    is integrated from the first row with the trapezoid rule; intervals
+    with a NaN at either end add nothing.
+  """
+  if voltagecolumn is None:
+    voltagecolumn = _FindColumn(dataset, lambda unit: unit == "V")
+  if currentcolumn is None:
+    currentcolumn = _FindColumn(dataset, lambda unit: unit.endswith("A"))
+  scale = analyze.PQ(1.0, dataset.units[currentcolumn]).inUnitsOf("A").value
+  measurements = dataset.measurements
+  times = measurements[:, 0]
+  power = measurements[:, voltagecolumn] * measurements[:, currentcolumn]
+  power *= scale
+  energy = numpy.zeros((len(times),), numpy.float64)
+  if len(times) > 1:
+    steps = (power[1:] + power[:-1]) * 0.5 * numpy.diff(times)
+    steps[numpy.isnan(steps)] = 0.0
+    numpy.cumsum(steps, out=energy[1:])
+  rv = numpy.empty((len(times), measurements.shape[1] + 2), numpy.float64)
+  rv[:, :-2] = measurements
+  rv[:, -2] = power
+  rv[:, -1] = energy
+  headers = ["%s (%s)" % lu for lu in zip(dataset.labels, dataset.units)]
+  headers.extend(["Power (W)", "Energy (J)"])
+  return _MakeDataSet(rv, headers, dataset.metadata)
+
+
+def GetPowerDataSet(voltage, current, method=INTERPOLATE, period=None,
+      timemarks=None):
+  """Join a voltage and a current data set, and add power and energy.
+
+  Args:
+    timemarks (string, optional): the span of time to keep, relative to
+    the start of the joined data. Energy is integrated from its start.
+
+  Returns:
+    DataSet with time, voltage, current, power and energy columns.
+  """
+  joined = Join([voltage, current], method, period=period)
+  if timemarks:
+    rows = joined.GetTimeSlice(timemarks)
+    if not len(rows):
+      raise ValueError("No joined samples in time span %r." % (timemarks,))
+    headers = ["%s (%s)" % lu for lu in zip(joined.labels, joined.units)]
+    joined = _MakeDataSet(rows, headers, joined.metadata)
+  return AddPowerAndEnergy(joined, 1, len(voltage.labels))
+
+
+def _FindColumn(dataset, test):
+  for n, unit in enumerate(dataset.units):
+    if n and test(unit):
+      return n
+  raise ValueError("No column with a suitable unit in %s." % (
+      ", ".join(dataset.units),))
+
+
+def _MakeDataSet(measurements, headers, metadata):
+  ds = analyze.DataSet(array=measurements, headers=headers)
+  ds._shared = False # made here, so nobody else has it
+  if metadata is not None:
+    ds.metadata = metadata.copy()
+  return ds
@@ -0,0 +1,123 @@
+#!/usr/bin/python2.4
+# vim:ts=2:sw=2:softtabstop=0:tw=74:smarttab:expandtab
+#
+# Copyright The Android Open Source Project
+
+"""A pool of forked worker processes.
+
+Each job is a function call run in a child process forked for it, so the
+job sees all of the parent's state (such as loaded data arrays) without
+copying or pickling it. Only the return value is pickled and sent back.
+At most a given number of children run at once.
+
+"""
+
+__author__ = 'dart@google.com (Keith Dart)'
+
+
+import os
+import select
+import cPickle
+import traceback
+
+
+class WorkerError(Exception):
+  """A job raised an exception. The argument is the child's traceback."""
+
+
+def GetCPUCount():
+  try:
+    return max(1, int(os.sysconf("SC_NPROCESSORS_ONLN")))
+  except (ValueError, OSError, AttributeError):
+    return 1
+
+
+class Pool(object):
+  """Run function calls in forked children, a limited number at a time.
+
+  Args:
+    workers (int, optional): maximum number of children at once. Default
+    is the number of CPUs. With one worker, jobs are just called in this
+    process.
+  """
+  def __init__(self, workers=None):
+    if workers is None:
+      workers = GetCPUCount()
+    self.workers = max(1, int(workers))
+    self._results = []
+    self._running = {} # read fd: [pid, job index, list of data read]
+
+  def Submit(self, func, *args, **kwargs):
+    """Start a job, after waiting for a free worker if need be.
+
+    Returns:
+      the job index, its position in the list Wait returns.
+    """
+    index = len(self._results)
+    self._results.append(None)
+    if self.workers == 1:
+      self._results[index] = (True, func(*args, **kwargs))
+      return index
+    while len(self._running) >= self.workers:
+      self._Reap()
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0: # child
+      os.close(rfd)
+      _RunChild(wfd, func, args, kwargs)
+    os.close(wfd)
+    self._running[rfd] = [pid, index, []]
+    return index
+
+  def Wait(self):
+    """Wait for all jobs to finish.
+
+    Returns:
+      list of the return values of the jobs, in the order they were
+      submitted.
+
+    Raises:
+      WorkerError if any job failed (after all have finished).
+    """
+    while self._running:
+      self._Reap()
+    results = self._results
+    self._results = []
+    errors = [value for ok, value in results if not ok]
+    if errors:
+      raise WorkerError("\n".join(errors))
+    return [value for ok, value in results]
+
+  def _Reap(self):
+    readable, unused_w, unused_x = select.select(self._running.keys(), [], [])
+    for fd in readable:
+      pid, index, data = self._running[fd]
+      buf = os.read(fd, 65536)
+      if buf:
+        data.append(buf)
+        continue
+      del self._running[fd]
+      os.close(fd)
+      unused_, status = os.waitpid(pid, 0)
+      try:
+        self._results[index] = cPickle.loads("".join(data))
+      except (EOFError, cPickle.UnpicklingError):
+        self._results[index] = (False,
+            "Worker %d exited (status %d) without a result." % (pid, status))
+
+
+def _RunChild(wfd, func, args, kwargs):
+  try:
+    try:
+      rv = (True, func(*args, **kwargs))
+    except:
+      rv = (False, traceback.format_exc())
+    try:
+      data = cPickle.dumps(rv, cPickle.HIGHEST_PROTOCOL)
+    except:
+      data = cPickle.dumps((False, traceback.format_exc()))
+    while data:
+      n = os.write(wfd, data)
+      data = data[n:]
+  finally:
+    os._exit(0) # skip the parent's cleanup handlers
@@ -16,6 +16,9 @@ import glob
 
 from pycopia.WWW import json
 
+from droid.storage import Storage
+from droid.storage import catalog
+
 
 HOSTNAME = os.uname()[1]
 
@@ -25,10 +28,29 @@ def testing(*args, **kwargs):
 def listing():
   return glob.glob("/var/www/%s/media/images/charts/*.png" % HOSTNAME)
 
+def datafiles(**kwargs):
+  """List the data files, with their cached statistics, that have the
+  given metadata (see catalog.Catalog.Query).
+  """
+  selection = {}
+  for name, value in kwargs.items():
+    selection[str(name)] = value
+  cat = catalog.GetCatalog(Storage.GetConfig())
+  try:
+    rv = []
+    for data in cat.Query(**selection):
+      entry = {"pathname": data.pathname}
+      for name in catalog.STATNAMES:
+        entry[name] = getattr(data, name)
+      rv.append(entry)
+    return rv
+  finally:
+    cat.close()
+
 def powerprofile():
   pass
 
 
-_EXPORTED = [testing, listing]
+_EXPORTED = [testing, listing, datafiles]
 
 handler = json.JSONDispatcher(_EXPORTED)